@@ -0,0 +1,5 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Benchmarks for chemlearning_data. Run them as python -m benchmarks.bench_xxx"""
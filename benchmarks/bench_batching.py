@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Benchmark of job batching: one task per molecule, chunked tasks, chunked Link1 jobs"""
+
+import argparse
+import itertools
+import os
+import stat
+import tempfile
+from concurrent.futures.process import ProcessPoolExecutor
+from functools import partial
+from benchmarks.common import QM9_TEST_ARCHIVE, report, timed
+from chemlearning_data.chemlearning_data import (
+    chunked,
+    compute_dispersion_correction,
+    compute_dispersion_corrections,
+    get_gaussian_arguments,
+    iter_qm9_archive,
+    submit_bounded,
+)
+from chemlearning_data.molecule import MoleculeBatch
+
+# Stand-in for g16: a fixed startup cost per process, then a fixed cost per
+# step, and the output lines read by the parser for every step.
+FAKE_G16 = """#!/bin/sh
+echo " Copyright (c) 1988-2017, Gaussian, Inc.  All Rights Reserved."
+sleep {startup}
+awk '
+function results() {{
+    system("sleep {step}")
+    print " SCF Done:  E(RB3LYP) =  -40.5183723401     A.U. after    9 cycles"
+    print " Sum of electronic and thermal Enthalpies=             -40.469780"
+    print " Sum of electronic and thermal Free Energies=          -40.491059"
+    print " Normal termination of Gaussian 16"
+}}
+/^--Link1--$/ {{ results(); next }}
+{{ print }}
+END {{ results() }}
+'
+"""
+
+
+def install_fake_g16(directory, startup, step):
+    """Write the stand-in g16 in directory, and put it first in PATH"""
+    path = os.path.join(directory, "g16")
+    with open(path, mode="w") as script:
+        script.write(FAKE_G16.format(startup=startup, step=step))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    os.environ["PATH"] = directory + os.pathsep + os.environ["PATH"]
+
+
+def molecules(count):
+    """count (file_id, Molecule), cycling over the test archive"""
+    source = [molecule for _, molecule in iter_qm9_archive(QM9_TEST_ARCHIVE, max_workers=0)]
+    for file_id, molecule in enumerate(itertools.islice(itertools.cycle(source), count)):
+        yield str(file_id).zfill(6), molecule
+
+
+def count_done(done, key, future):
+    """on_done callback counting successful molecules"""
+    result = future.result()
+    if isinstance(result, list):
+        done[0] += sum(1 for _, energies, _, _ in result if energies is not None)
+    else:
+        done[0] += 1
+
+
+def run_single(count, locations, gaussian_args, workers):
+    """One task, and one g16 process, per molecule"""
+    done = [0]
+    jobs = (
+        (file_id, compute_dispersion_correction, {
+            "molecule": molecule,
+            "file_id": file_id,
+            "file_name": file_id + ".xyz",
+            "locations": locations,
+            "gaussian_args": gaussian_args,
+        })
+        for file_id, molecule in molecules(count)
+    )
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        submit_bounded(executor, jobs, partial(count_done, done), 2 * workers)
+    return done[0]
+
+
+def run_chunked(count, locations, gaussian_args, workers, chunk_size, link1):
+    """One task per chunk of molecules, and one g16 process per chunk with link1"""
+    done = [0]
+
+    def jobs():
+        for chunk in chunked(molecules(count), chunk_size):
+            batch = MoleculeBatch.from_molecules(
+                [molecule for _, molecule in chunk], file_ids=[file_id for file_id, _ in chunk]
+            )
+            yield chunk[0][0], compute_dispersion_corrections, {
+                "batch": batch,
+                "locations": locations,
+                "gaussian_args": gaussian_args,
+                "link1": link1,
+            }
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        submit_bounded(executor, jobs(), partial(count_done, done), 2 * workers)
+    return done[0]
+
+
+def main():
+    """Launcher."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--molecules", type=int, default=256)
+    parser.add_argument("--chunk-size", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--startup", type=float, default=0.05,
+                        help="seconds spent by the stand-in g16 before any step")
+    parser.add_argument("--step", type=float, default=0.01,
+                        help="seconds spent by the stand-in g16 on each step")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        install_fake_g16(tmp_dir, args.startup, args.step)
+        locations = {"computations": os.path.join(tmp_dir, "computations")}
+        gaussian_args = get_gaussian_arguments()
+
+        done, elapsed = timed(run_single, args.molecules, locations, gaussian_args, args.workers)
+        report("one task per molecule", done, elapsed)
+        for link1 in (False, True):
+            done, elapsed = timed(
+                run_chunked, args.molecules, locations, gaussian_args,
+                args.workers, args.chunk_size, link1,
+            )
+            name = "chunks of {}{}".format(args.chunk_size, ", Link1" if link1 else "")
+            report(name, done, elapsed)
+
+
+if __name__ == "__main__":
+    main()
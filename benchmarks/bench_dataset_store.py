@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Benchmark of dataset updates as results come in: incremental store against full rebuilds"""
+
+import argparse
+import os
+import tempfile
+from benchmarks.common import QM9_TEST_ARCHIVE, build_synthetic_archive, timed
+from chemlearning_data.chemlearning_data import pack_qm9_archive
+from chemlearning_data.dataset_store import DatasetStore
+from chemlearning_data.graph_features import featurize_archive
+from chemlearning_data.result_store import ResultWriter
+
+
+def add_results(directory, file_ids):
+    """Write placeholder results for file_ids"""
+    with ResultWriter(directory) as writer:
+        for file_id in file_ids:
+            writer.add(str(file_id).zfill(6), {"scfenergy": -1.0, "enthalpy": -float(file_id),
+                                               "freeenergy": -1.0})
+
+
+def main():
+    """Launcher."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--replicate", type=int, default=2000,
+                        help="copies of the test archive in the synthetic archive")
+    parser.add_argument("--steps", type=int, default=8, help="number of updates")
+    parser.add_argument("--workers", type=int, default=None, help="parsing processes")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        archive = os.path.join(tmp_dir, "qm9_synthetic.tar.bz2")
+        count = build_synthetic_archive(QM9_TEST_ARCHIVE, archive, args.replicate)
+        pack = os.path.join(tmp_dir, "qm9.pack")
+        pack_qm9_archive(archive, pack)
+        results = os.path.join(tmp_dir, "results")
+        stores = {
+            "tar": DatasetStore(os.path.join(tmp_dir, "dataset_tar")),
+            "pack": DatasetStore(os.path.join(tmp_dir, "dataset_pack")),
+        }
+        step = count // args.steps
+        print("{:>8} {:>8} {:>16} {:>16} {:>16}".format(
+            "total", "new", "rebuild tar (s)", "update tar (s)", "update pack (s)"))
+        for start in range(0, step * args.steps, step):
+            add_results(results, range(start + 1, start + step + 1))
+            # Former way: featurize the whole archive again
+            _, rebuild = timed(featurize_archive, archive, results, max_workers=args.workers)
+            _, update_tar = timed(stores["tar"].update, archive, results,
+                                  max_workers=args.workers)
+            _, update_pack = timed(stores["pack"].update, pack, results,
+                                   max_workers=args.workers)
+            print("{:>8d} {:>8d} {:>16.3f} {:>16.3f} {:>16.3f}".format(
+                start + step, step, rebuild, update_tar, update_pack))
+
+        store = stores["pack"]
+        _, elapsed = timed(store.compact, min_rows=count + 1)
+        print("compaction of {} chunks: {:.3f} s".format(args.steps, elapsed))
+        _, elapsed = timed(store.load)
+        print("load of the latest version: {:.3f} s".format(elapsed))
+
+
+if __name__ == "__main__":
+    main()
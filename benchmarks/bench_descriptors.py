@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Benchmark of descriptors: batched arrays against a per-molecule loop"""
+
+import argparse
+import itertools
+import os
+import tempfile
+import numpy
+from benchmarks.common import QM9_TEST_ARCHIVE, build_synthetic_archive, report, timed
+from chemlearning_data.chemlearning_data import iter_qm9_archive
+from chemlearning_data.descriptors import bag_layout, compute_descriptors, write_descriptors
+from chemlearning_data.molecule import Molecule, MoleculeBatch
+
+MAX_ATOMS = 29
+# Composition of a typical QM9 molecule (C7H10NO, 19 atoms)
+QM9_LIKE = [6] * 7 + [7] + [8] + [1] * 10
+
+
+def qm9_sized_molecules(count, seed=0):
+    """
+    count molecules with the size of typical QM9 molecules, at random positions.
+
+    Molecules of the test archive have 1 to 5 atoms, which would favour
+    the per-molecule loop: its cost grows with the square of the size.
+    """
+    rng = numpy.random.default_rng(seed)
+    coordinates = rng.uniform(-3.0, 3.0, size=(count, len(QM9_LIKE), 3))
+    return [Molecule(positions, QM9_LIKE) for positions in coordinates]
+
+
+def naive_descriptors(molecule, layout):
+    """Reference: all descriptors of one molecule, atom pair by atom pair"""
+    natoms = molecule.natoms
+    charges = molecule.elements_list.tolist()
+    coordinates = molecule.coordinates.tolist()
+    distances = numpy.zeros((MAX_ATOMS, MAX_ATOMS))
+    coulomb = numpy.zeros((MAX_ATOMS, MAX_ATOMS))
+    for i in range(natoms):
+        coulomb[i, i] = 0.5 * charges[i] ** 2.4
+        for j in range(natoms):
+            if i != j:
+                distance = sum((a - b) ** 2 for a, b in zip(coordinates[i], coordinates[j])) ** 0.5
+                distances[i, j] = distance
+                coulomb[i, j] = charges[i] * charges[j] / distance
+    eigenvalues = numpy.linalg.eigvalsh(coulomb)
+    eigenvalues = eigenvalues[numpy.argsort(-numpy.abs(eigenvalues))]
+    bags = list()
+    for element_a, element_b, size in layout:
+        if element_b == 0:
+            values = [coulomb[i, i] for i in range(natoms) if charges[i] == element_a]
+        else:
+            values = [
+                coulomb[i, j] for i in range(natoms) for j in range(i + 1, natoms)
+                if sorted([charges[i], charges[j]]) == [element_a, element_b]
+            ]
+        values.sort(reverse=True)
+        bags.extend(values + [0.0] * (size - len(values)))
+    return distances, coulomb, eigenvalues, numpy.array(bags)
+
+
+def main():
+    """Launcher."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--molecules", type=int, default=20000)
+    parser.add_argument("--naive", type=int, default=500, help="molecules for the naive loop")
+    parser.add_argument("--chunk-size", type=int, default=4096)
+    parser.add_argument("--test-archive", action="store_true",
+                        help="use molecules of the test archive instead of QM9-sized ones")
+    parser.add_argument("--replicate", type=int, default=5000,
+                        help="copies of the test archive for the streamed run")
+    args = parser.parse_args()
+
+    if args.test_archive:
+        source = [molecule for _, molecule in iter_qm9_archive(QM9_TEST_ARCHIVE, max_workers=0)]
+        molecules = list(itertools.islice(itertools.cycle(source), args.molecules))
+    else:
+        molecules = qm9_sized_molecules(args.molecules)
+
+    layout = bag_layout()
+    _, elapsed = timed(lambda: [naive_descriptors(m, layout) for m in molecules[:args.naive]])
+    report("naive per-molecule loop", args.naive, elapsed)
+
+    def batched():
+        for start in range(0, len(molecules), args.chunk_size):
+            batch = MoleculeBatch.from_molecules(molecules[start:start + args.chunk_size])
+            compute_descriptors(batch)
+
+    _, elapsed = timed(batched)
+    report("batched, chunks of " + str(args.chunk_size), len(molecules), elapsed)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        archive = os.path.join(tmp_dir, "qm9_synthetic.tar.bz2")
+        count = build_synthetic_archive(QM9_TEST_ARCHIVE, archive, args.replicate)
+        for max_workers in (0, None):
+            output = os.path.join(tmp_dir, "descriptors_" + str(max_workers))
+            _, elapsed = timed(write_descriptors, archive, output, max_workers=max_workers,
+                               chunk_size=args.chunk_size)
+            name = "streamed to disk, " + ("1 process" if max_workers == 0 else "all cores")
+            report(name, count, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Benchmark of preprocessed dataset loading: cold, warm from npz, warm from the feature cache"""
+
+import argparse
+import os
+import tempfile
+import numpy
+from benchmarks.common import QM9_TEST_ARCHIVE, build_synthetic_archive, report, timed
+from chemlearning_data.chemlearning_data import iter_qm9_archive
+from chemlearning_data.feature_cache import FeatureCache, RaggedArray, feature_key, file_hash
+
+MAX_ATOMS = 29
+
+
+def preprocess(archive):
+    """
+    Stand-in for chainer_chemistry preprocessing, when it is not installed.
+
+    One pass over the archive, giving the kind of arrays NFP preprocessing
+    gives: ragged atomic numbers, padded (MAX_ATOMS, MAX_ATOMS) distance
+    matrices and a label column.
+    """
+    atoms = list()
+    distances = list()
+    labels = list()
+    for _, molecule, properties, _ in iter_qm9_archive(archive, labels=True):
+        atoms.append(molecule.elements_list.astype(numpy.int32))
+        matrix = numpy.zeros((MAX_ATOMS, MAX_ATOMS), dtype=numpy.float32)
+        delta = molecule.coordinates[:, None, :] - molecule.coordinates[None, :, :]
+        matrix[:molecule.natoms, :molecule.natoms] = numpy.sqrt((delta ** 2).sum(axis=-1))
+        distances.append(matrix)
+        labels.append([properties["homo"]])
+    atoms_array = numpy.empty(len(atoms), dtype=object)
+    atoms_array[:] = atoms
+    return atoms_array, numpy.stack(distances), numpy.array(labels, dtype=numpy.float32)
+
+
+def touch_all(arrays):
+    """Read every element once, as an epoch does"""
+    total = 0.0
+    for array in arrays:
+        if isinstance(array, RaggedArray):
+            total += float(numpy.asarray(array.values).sum())
+        elif array.dtype == object:
+            total += sum(float(item.sum()) for item in array)
+        else:
+            total += float(numpy.asarray(array).sum())
+    return total
+
+
+def load_npz(path):
+    """Former path: NumpyTupleDataset.load, every array read in memory"""
+    with numpy.load(path, allow_pickle=True) as content:
+        return tuple(content["arr_" + str(i)] for i in range(len(content.files)))
+
+
+def main():
+    """Launcher."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--replicate", type=int, default=2000,
+                        help="copies of the test archive in the synthetic archive")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        archive = os.path.join(tmp_dir, "qm9_synthetic.tar.bz2")
+        count = build_synthetic_archive(QM9_TEST_ARCHIVE, archive, args.replicate)
+        cache = FeatureCache(os.path.join(tmp_dir, "features"))
+
+        def cold():
+            key = feature_key("stand-in", "homo", file_hash(archive))
+            return cache.save(key, preprocess(archive))
+
+        arrays, elapsed = timed(cold)
+        report("cold: preprocess and store", count, elapsed)
+
+        # Former main(): NumpyTupleDataset.save, then load, both with npz
+        npz_path = os.path.join(tmp_dir, "data.npz")
+        numpy.savez(npz_path, *[
+            array[numpy.arange(len(array))] if isinstance(array, RaggedArray) else array
+            for array in arrays
+        ])
+        loaded, elapsed = timed(load_npz, npz_path)
+        report("warm: npz load", count, elapsed)
+        _, elapsed = timed(touch_all, loaded)
+        report("warm: npz, first pass over data", count, elapsed)
+
+        def warm():
+            return cache.load(feature_key("stand-in", "homo", file_hash(archive)))
+
+        loaded, elapsed = timed(warm)
+        report("warm: feature cache load (mmap)", count, elapsed)
+        _, elapsed = timed(touch_all, loaded)
+        report("warm: feature cache, first pass over data", count, elapsed)
+
+
+if __name__ == "__main__":
+    main()
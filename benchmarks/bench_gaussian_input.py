@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Benchmark of Gaussian input rendering: inputs per second for a QM9-sized dataset"""
+
+import argparse
+import itertools
+from cclib.parser.utils import PeriodicTable
+from benchmarks.common import QM9_TEST_ARCHIVE, report, timed
+from chemlearning_data.chemlearning_data import get_gaussian_arguments, iter_qm9_archive
+from chemlearning_data.gaussian_job import GaussianJob, build_input_scripts
+
+QM9_SIZE = 133885
+
+
+def legacy_input_script(job):
+    """Reference: rendering formerly done by GaussianJob, one float at a time"""
+    periodic_table = PeriodicTable()
+    script = ["%NProcShared=1"]
+    route = "# " + job.gaussian_args["functional"] + " "
+    if job.gaussian_args["dispersion"] is not None:
+        route += "EmpiricalDispersion=" + job.gaussian_args["dispersion"] + " "
+    script.extend([route + "gen freq", "", job.name, "", "0 1"])
+    periodic_table = PeriodicTable()
+    script.extend(
+        " ".join(
+            [periodic_table.element[job.molecule.elements_list[i]].ljust(5)]
+            + ["{:.6f}".format(s).rjust(25) for s in atom]
+        )
+        for i, atom in enumerate(job.molecule.coordinates)
+    )
+    script.append("")
+    periodic_table = PeriodicTable()
+    elements = [periodic_table.element[el] for el in set(job.molecule.elements_list)]
+    script.extend([" ".join(elements) + " 0", job.gaussian_args["basisset"], "****", ""])
+    script.extend(["", ""])
+    return "\n".join(script)
+
+
+def main():
+    """Launcher."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--archive", default=QM9_TEST_ARCHIVE)
+    parser.add_argument("--molecules", type=int, default=QM9_SIZE)
+    args = parser.parse_args()
+
+    gaussian_args = get_gaussian_arguments()
+    molecules = [molecule for _, molecule in iter_qm9_archive(args.archive, max_workers=0)]
+    jobs = [
+        GaussianJob(
+            basedir="computation",
+            name=str(i).zfill(6) + ".xyz",
+            molecule=molecule,
+            job_id=i,
+            gaussian_args=gaussian_args,
+        )
+        for i, molecule in enumerate(itertools.islice(itertools.cycle(molecules), args.molecules))
+    ]
+
+    _, elapsed = timed(lambda: [legacy_input_script(job) for job in jobs])
+    report("legacy rendering", len(jobs), elapsed, unit="inputs")
+    _, elapsed = timed(lambda: ["\n".join(job.build_input_script()) for job in jobs])
+    report("GaussianJob.build_input_script", len(jobs), elapsed, unit="inputs")
+    _, elapsed = timed(build_input_scripts, jobs)
+    report("build_input_scripts", len(jobs), elapsed, unit="inputs")
+
+
+if __name__ == "__main__":
+    main()
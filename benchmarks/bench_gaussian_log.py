@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Benchmark of Gaussian output parsing: seconds per MB, targeted parser against cclib"""
+
+import argparse
+import logging
+import os
+import tempfile
+from cclib.io import ccread
+from benchmarks.common import QM9_TEST_ARCHIVE, sample_gaussian_log, timed
+from chemlearning_data.chemlearning_data import iter_qm9_archive
+from chemlearning_data.gaussian_log import parse_gaussian_log
+
+
+def main():
+    """Launcher."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--steps", type=int, nargs="+", default=[1, 100, 1000, 10000])
+    args = parser.parse_args()
+
+    # Largest molecule of the test archive
+    molecule = max(
+        (molecule for _, molecule in iter_qm9_archive(QM9_TEST_ARCHIVE, max_workers=0)),
+        key=lambda molecule: molecule.natoms,
+    )
+    print("{:>8} {:>10} {:>14} {:>14} {:>8}".format(
+        "steps", "size (MB)", "ccread (s/MB)", "parser (s/MB)", "speedup"))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for steps in args.steps:
+            path = os.path.join(tmpdir, "sample.log")
+            with open(path, mode="w") as log:
+                log.write(sample_gaussian_log(molecule, steps=steps))
+            size = os.path.getsize(path) / 1024 ** 2
+            _, cclib_time = timed(ccread, path, loglevel=logging.ERROR)
+            _, parser_time = timed(parse_gaussian_log, path)
+            print("{:>8d} {:>10.3f} {:>14.4f} {:>14.4f} {:>8.1f}".format(
+                steps, size, cclib_time / size, parser_time / size, cclib_time / parser_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Benchmark of minibatch iteration over on-disk features: SerialIterator against blocks"""
+
+import argparse
+import os
+import tempfile
+import time
+import numpy
+from benchmarks.common import report, timed
+from chemlearning_data.batch_iterator import BlockShuffleIterator
+
+
+class SerialIteratorStandIn:
+    """
+    Stand-in for chainer SerialIterator and concat_examples, when chainer is not installed.
+
+    Same access pattern: a random permutation of all rows, each batch built
+    from one dataset[i] tuple per row, then stacked column by column.
+
+    Attributes:
+        - arrays (columns of the dataset, tuple of arrays)
+        - batch_size (rows per batch, int)
+
+    """
+
+    def __init__(self, arrays, batch_size, seed=0):
+        """Build the SerialIteratorStandIn class."""
+        self.arrays = arrays
+        self.batch_size = batch_size
+        self._order = numpy.random.default_rng(seed).permutation(len(arrays[0]))
+        self._position = 0
+
+    def next(self):
+        """Next batch, as a tuple of arrays"""
+        rows = self._order[self._position:self._position + self.batch_size]
+        self._position += self.batch_size
+        if self._position >= len(self._order):
+            self._position = 0
+        examples = [tuple(array[row] for array in self.arrays) for row in rows.tolist()]
+        return tuple(numpy.stack(column) for column in zip(*examples))
+
+
+def serial_iterator(arrays, batch_size):
+    """chainer SerialIterator with concat_examples if available, else the stand-in"""
+    try:
+        # pylint: disable=import-outside-toplevel
+        from chainer.dataset import concat_examples
+        from chainer.iterators import SerialIterator
+        from chainer_chemistry.datasets import NumpyTupleDataset
+    except ImportError:
+        return SerialIteratorStandIn(arrays, batch_size), "stand-in SerialIterator"
+    iterator = SerialIterator(NumpyTupleDataset(*arrays), batch_size)
+
+    class Converted:
+        """SerialIterator batches through concat_examples, as updaters do"""
+
+        @staticmethod
+        def next():
+            return concat_examples(iterator.next())
+
+    return Converted(), "chainer SerialIterator"
+
+
+def write_features(directory, count, max_atoms, seed=0):
+    """NFP-like padded features on disk: atoms, adjacency and labels; return their paths"""
+    rng = numpy.random.default_rng(seed)
+    atoms = rng.integers(0, 10, size=(count, max_atoms)).astype(numpy.int32)
+    adjacency = (rng.random((count, max_atoms, max_atoms)) < 0.1).astype(numpy.float32)
+    labels = rng.random((count, 1)).astype(numpy.float32)
+    paths = list()
+    for name, array in (("atoms", atoms), ("adjacency", adjacency), ("labels", labels)):
+        paths.append(os.path.join(directory, name + ".npy"))
+        numpy.save(paths[-1], array)
+    return paths
+
+
+def evict(paths):
+    """Drop files from the page cache where the system allows it, for cold reads"""
+    for path in paths:
+        with open(path, mode="rb") as source:
+            os.fsync(source.fileno())
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(source.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def consume(iterator, batches, step_time):
+    """Take batches from iterator, with step_time seconds of training per batch"""
+    samples = 0
+    for _ in range(batches):
+        batch = iterator.next()
+        samples += len(batch[0])
+        if step_time:
+            time.sleep(step_time)
+    return samples
+
+
+def main():
+    """Launcher."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--molecules", type=int, default=100000,
+                        help="rows of the synthetic dataset")
+    parser.add_argument("--max-atoms", type=int, default=29,
+                        help="padding of atoms and adjacency, 29 for QM9 with hydrogens")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--batches", type=int, default=1000, help="batches per measure")
+    parser.add_argument("--block-size", type=int, default=1024)
+    parser.add_argument("--step-time", type=float, default=0.0,
+                        help="seconds of training per batch, to measure overlap")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = write_features(tmp_dir, args.molecules, args.max_atoms)
+
+        def load():
+            evict(paths)
+            return tuple(numpy.load(path, mmap_mode="r") for path in paths)
+
+        iterator, name = serial_iterator(load(), args.batch_size)
+        samples, elapsed = timed(consume, iterator, args.batches, args.step_time)
+        report(name, samples, elapsed, unit="samples")
+
+        for prefetch in (1, 4):
+            iterator = BlockShuffleIterator(load(), args.batch_size, block_size=args.block_size,
+                                            prefetch=prefetch)
+            samples, elapsed = timed(consume, iterator, args.batches, args.step_time)
+            iterator.finalize()
+            report("blocks, prefetch " + str(prefetch), samples, elapsed, unit="samples")
+
+
+if __name__ == "__main__":
+    main()
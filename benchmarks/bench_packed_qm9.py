@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Benchmark of QM9 reads from the bz2 tar archive and from a pack: full scans and random access"""
+
+import argparse
+import os
+import tempfile
+import numpy
+from benchmarks.common import QM9_TEST_ARCHIVE, build_synthetic_archive, report, timed
+from chemlearning_data.chemlearning_data import chunk_qm9_archive, pack_qm9_archive
+from chemlearning_data.packed_qm9 import CODECS, PackedQM9
+
+
+def scan(archive):
+    """Read every member, return their number"""
+    return sum(len(chunk) for chunk in chunk_qm9_archive(archive, 256))
+
+
+def tar_lookup(archive, file_ids):
+    """Only way with a tar: decompress up to the last wanted member"""
+    wanted = set(file_ids)
+    found = 0
+    for chunk in chunk_qm9_archive(archive, 256):
+        found += sum(1 for file_id, _ in chunk if file_id in wanted)
+        if found == len(wanted):
+            break
+    return found
+
+
+def pack_lookup(path, file_ids):
+    """One get per id, in random order"""
+    with PackedQM9(path) as pack:
+        return sum(1 for file_id in file_ids if pack.get(file_id))
+
+
+def pack_sample(path, fraction):
+    """Random sample read in pack order"""
+    with PackedQM9(path) as pack:
+        return sum(1 for _ in pack.sample(fraction=fraction))
+
+
+def main():
+    """Launcher."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--replicate", type=int, default=5000,
+                        help="copies of the test archive in the synthetic archive")
+    parser.add_argument("--lookups", type=int, default=100, help="random single reads")
+    parser.add_argument("--block-size", type=int, default=64)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        archive = os.path.join(tmp_dir, "qm9_synthetic.tar.bz2")
+        count = build_synthetic_archive(QM9_TEST_ARCHIVE, archive, args.replicate)
+        print("bz2 tar: {:.1f} MB".format(os.path.getsize(archive) / 1024 ** 2))
+        rng = numpy.random.default_rng(0)
+        file_ids = [str(file_id).zfill(6) for file_id in
+                    rng.choice(numpy.arange(1, count + 1), size=args.lookups, replace=False)]
+
+        _, elapsed = timed(scan, archive)
+        report("bz2 tar, full scan", count, elapsed)
+        found, elapsed = timed(tar_lookup, archive, file_ids)
+        report("bz2 tar, random reads", found, elapsed)
+
+        for codec in CODECS:
+            path = os.path.join(tmp_dir, "qm9_" + codec + ".pack")
+            try:
+                _, elapsed = timed(pack_qm9_archive, archive, path, args.block_size, codec)
+            except ImportError:
+                print(codec + ": not installed, skipped")
+                continue
+            print("{} pack: {:.1f} MB, converted in {:.1f} s".format(
+                codec, os.path.getsize(path) / 1024 ** 2, elapsed))
+            _, elapsed = timed(scan, path)
+            report(codec + " pack, full scan", count, elapsed)
+            found, elapsed = timed(pack_lookup, path, file_ids)
+            report(codec + " pack, random reads", found, elapsed)
+            sampled, elapsed = timed(pack_sample, path, 0.1)
+            report(codec + " pack, 10% sample", sampled, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Benchmark of QM9 readers: molecules per second from archive and from folder"""
+
+import argparse
+import os
+import tarfile
+import tempfile
+from benchmarks.common import QM9_TEST_ARCHIVE, build_synthetic_archive, report, timed
+from chemlearning_data.chemlearning_data import (
+    extract_xyz_geometries,
+    iter_qm9_archive,
+    iter_qm9_directory,
+)
+
+
+def serial_tar_walk(archive):
+    """Reference: the tar loop formerly used in main(), parsing in the parent"""
+    count = 0
+    with tarfile.open(name=archive, mode="r:bz2") as qm9_tar:
+        for xyz_file in qm9_tar:
+            extract_xyz_geometries(qm9_tar.extractfile(xyz_file))
+            count += 1
+    return count
+
+
+def consume(iterator):
+    """Exhaust iterator, return the number of items"""
+    return sum(1 for _ in iterator)
+
+
+def main():
+    """Launcher."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--archive", default=QM9_TEST_ARCHIVE)
+    parser.add_argument("--replicate", type=int, default=1000,
+                        help="Repeat archive contents to get a meaningful size")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archive = os.path.join(tmpdir, "qm9_bench.tar.bz2")
+        build_synthetic_archive(args.archive, archive, args.replicate)
+        extracted = os.path.join(tmpdir, "xyz")
+        with tarfile.open(name=archive, mode="r:bz2") as qm9_tar:
+            qm9_tar.extractall(extracted)
+
+        count, elapsed = timed(serial_tar_walk, archive)
+        report("archive, serial tar walk", count, elapsed)
+        count, elapsed = timed(consume, iter_qm9_archive(archive, max_workers=0))
+        report("archive, streaming, in process", count, elapsed)
+        count, elapsed = timed(consume, iter_qm9_archive(archive, args.workers))
+        report("archive, streaming, worker pool", count, elapsed)
+        count, elapsed = timed(consume, iter_qm9_directory(extracted, max_workers=0))
+        report("folder, in process", count, elapsed)
+        count, elapsed = timed(consume, iter_qm9_directory(extracted, args.workers))
+        report("folder, worker pool", count, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Simulated makespan of a QM9 run with FIFO, LPT and guided scheduling"""
+
+import argparse
+import numpy
+from chemlearning_data.chemlearning_data import get_gaussian_arguments, iter_qm9_archive
+from chemlearning_data.molecule import Molecule
+from chemlearning_data.scheduling import POLICIES, CostModel, schedule_chunks, simulate_makespan
+
+# Number of QM9 molecules with 1 to 9 heavy atoms (C, N, O, F)
+QM9_HEAVY_ATOMS = [3, 5, 8, 22, 66, 249, 1136, 6095, 126301]
+# Share of each heavy element in QM9
+HEAVY_ELEMENTS = {6: 0.70, 7: 0.12, 8: 0.17, 9: 0.01}
+
+
+def synthetic_qm9(count, seed):
+    """
+    count (file_id, Molecule) following QM9 heavy atom counts and element mix.
+
+    Molecules come by increasing number of heavy atoms, as in the QM9
+    archive: the largest molecules are at the end of a FIFO run.
+    """
+    rng = numpy.random.default_rng(seed)
+    weights = numpy.array(QM9_HEAVY_ATOMS, dtype=numpy.float64)
+    heavy_counts = rng.choice(numpy.arange(1, 10), size=count, p=weights / weights.sum())
+    heavy_counts = numpy.sort(heavy_counts)
+    elements = list(HEAVY_ELEMENTS)
+    shares = list(HEAVY_ELEMENTS.values())
+    molecules = list()
+    for file_id, heavy in enumerate(heavy_counts.tolist()):
+        hydrogens = int(rng.integers(max(0, heavy - 4), 2 * heavy + 3))
+        atoms = rng.choice(elements, size=heavy, p=shares).tolist() + [1] * hydrogens
+        molecule = Molecule(numpy.zeros((len(atoms), 3)), atoms)
+        molecules.append((str(file_id + 1).zfill(6), molecule))
+    return molecules
+
+
+def makespan(molecules, model, noise, workers, chunk_size, policy):
+    """Simulated makespan: tasks are chunks, costing the actual time of their molecules"""
+    tasks = list()
+    for chunk in schedule_chunks(iter(molecules), model, chunk_size, workers, policy=policy):
+        tasks.append(sum(noise[file_id] * model.estimate(molecule) for file_id, molecule in chunk))
+    return simulate_makespan(tasks, workers)
+
+
+def main():
+    """Launcher."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--molecules", type=int, default=133885)
+    parser.add_argument("--archive", help="QM9 archive to use instead of synthetic molecules")
+    parser.add_argument("--workers", type=int, nargs="+", default=[32, 256, 2048])
+    parser.add_argument("--chunk-size", type=int, default=8)
+    parser.add_argument("--sigma", type=float, default=0.3,
+                        help="spread of actual job times around the estimate (lognormal)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.archive:
+        molecules = list(iter_qm9_archive(args.archive))
+    else:
+        molecules = synthetic_qm9(args.molecules, args.seed)
+    model = CostModel(get_gaussian_arguments())
+    # Actual times differ from estimates: the scheduler only knows estimates
+    rng = numpy.random.default_rng(args.seed + 1)
+    noise = dict(zip(
+        (file_id for file_id, _ in molecules),
+        rng.lognormal(0.0, args.sigma, size=len(molecules)).tolist(),
+    ))
+    total = sum(noise[file_id] * model.estimate(molecule) for file_id, molecule in molecules)
+
+    print("{} molecules, {:.0f} core hours".format(len(molecules), total / 3600))
+    print("{:>8} {:>12}".format("workers", "ideal (h)") + "".join(
+        "{:>16}".format(policy + " (h)") for policy in POLICIES))
+    for workers in args.workers:
+        line = "{:>8d} {:>12.2f}".format(workers, total / workers / 3600)
+        for policy in POLICIES:
+            hours = makespan(molecules, model, noise, workers, args.chunk_size, policy) / 3600
+            line += "{:>16.2f}".format(hours)
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
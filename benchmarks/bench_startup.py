@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Benchmark of worker startup: import times, and time to first job per worker process"""
+
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from benchmarks.common import QM9_TEST_ARCHIVE, read_archive_members
+from chemlearning_data.chemlearning_data import (
+    get_gaussian_arguments,
+    make_executor,
+    parse_xyz_members,
+)
+from chemlearning_data.gaussian_job import GaussianJob
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_time(modules):
+    """Seconds to import modules in a fresh interpreter"""
+    code = ("import time; start = time.perf_counter(); import " + ", ".join(modules)
+            + "; print(time.perf_counter() - start)")
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True,
+                            cwd=ROOT, text=True).stdout
+    return float(output)
+
+
+def first_job(members):
+    """A small job: parse a molecule, write its Gaussian input; return pid and end time"""
+    batch, _ = parse_xyz_members(members)
+    job = GaussianJob("/tmp", "bench.xyz", batch[0], 1, get_gaussian_arguments())
+    job.build_input_script()
+    # Long enough for every worker to get a job
+    time.sleep(0.05)
+    return os.getpid(), time.monotonic()
+
+
+def time_to_first_job(executor_factory, workers, members):
+    """Seconds from pool creation to the first job done by each worker: mean and max"""
+    start = time.monotonic()
+    first = dict()
+    with executor_factory() as executor:
+        futures = [executor.submit(first_job, members) for _ in range(4 * workers)]
+        for future in futures:
+            pid, end = future.result()
+            first.setdefault(pid, end - start - 0.05)
+    return sum(first.values()) / len(first), max(first.values()), len(first)
+
+
+def measure(start_method, variant, workers, repeat):
+    """Best time to first job of a pool, measured in this (fresh) process"""
+    members = read_archive_members(QM9_TEST_ARCHIVE)[:1]
+    members = [("000001", content) for _, content in members]
+    if variant == "initializer":
+        def factory():
+            return make_executor(workers, start_method)
+    else:
+        context = multiprocessing.get_context(start_method)
+
+        def factory():
+            return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    return min((time_to_first_job(factory, workers, members) for _ in range(repeat)),
+               key=lambda result: result[1])
+
+
+def main():
+    """Launcher."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3, help="measures, best one kept")
+    # A fork server is started once per process, with the preload of its first executor:
+    # each pool is measured in its own interpreter
+    parser.add_argument("--measure", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(*measure(*args.measure, args.workers, args.repeat))
+        return
+
+    for name, modules in (
+            ("chemlearning_data.chemlearning_data", ["chemlearning_data.chemlearning_data"]),
+            ("  + cclib (former eager import)",
+             ["chemlearning_data.chemlearning_data", "cclib.parser.utils"]),
+            ("chemlearning_data.chainer_chemistry_test",
+             ["chemlearning_data.chainer_chemistry_test"]),
+    ):
+        best = min(import_time(modules) for _ in range(args.repeat))
+        print("{:<50} import {:8.3f} s".format(name, best))
+
+    for start_method in ("fork", "spawn", "forkserver"):
+        for variant in ("plain", "initializer"):
+            command = [sys.executable, "-m", "benchmarks.bench_startup", "--measure",
+                       start_method, variant, "--workers", str(args.workers),
+                       "--repeat", str(args.repeat)]
+            output = subprocess.run(command, check=True, capture_output=True, cwd=ROOT,
+                                    text=True).stdout.split()
+            mean, maximum, workers = float(output[0]), float(output[1]), int(output[2])
+            print("{:<12} {:<12} first job: mean {:7.3f} s, max {:7.3f} s ({} workers)".format(
+                start_method, variant, mean, maximum, workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Benchmark of job submission: parent peak RSS against dataset size"""
+
+import argparse
+import itertools
+import resource
+import subprocess
+import sys
+from concurrent.futures.process import ProcessPoolExecutor
+from benchmarks.common import QM9_TEST_ARCHIVE
+from chemlearning_data.chemlearning_data import iter_qm9_archive, submit_bounded
+
+
+def fake_computation(molecule, file_id):
+    """Stand-in for compute_dispersion_correction, returning energies at once"""
+    energies = {"scfenergy": float(molecule.natoms), "enthalpy": 0.0, "freeenergy": 0.0}
+    return file_id, energies
+
+
+def molecules(count):
+    """count molecules, cycling over the test archive"""
+    source = [molecule for _, molecule in iter_qm9_archive(QM9_TEST_ARCHIVE, max_workers=0)]
+    for file_id, molecule in enumerate(itertools.islice(itertools.cycle(source), count)):
+        yield str(file_id).zfill(6), molecule
+
+
+def submit_all(count):
+    """Former main() loop: submit everything, keep all futures, read results at the end"""
+    results = list()
+    with ProcessPoolExecutor() as executor:
+        for file_id, molecule in molecules(count):
+            results.append(executor.submit(fake_computation, molecule, file_id))
+    return sum(1 for result in results if result.result())
+
+
+def submit_window(count, max_in_flight):
+    """Bounded submission, as in main()"""
+    done = [0]
+
+    def on_done(_, future):
+        future.result()
+        done[0] += 1
+
+    jobs = (
+        (file_id, fake_computation, {"molecule": molecule, "file_id": file_id})
+        for file_id, molecule in molecules(count)
+    )
+    with ProcessPoolExecutor() as executor:
+        submit_bounded(executor, jobs, on_done, max_in_flight)
+    return done[0]
+
+
+def child(mode, count, max_in_flight):
+    """Run one configuration, print peak RSS in MB"""
+    if mode == "all":
+        submit_all(count)
+    else:
+        submit_window(count, max_in_flight)
+    # ru_maxrss is in kB on Linux
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def main():
+    """Launcher."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--window", type=int, default=32)
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], int(args.child[1]), args.window)
+        return
+
+    print("{:>10} {:>22} {:>22}".format("molecules", "submit all (MB)", "window (MB)"))
+    for size in args.sizes:
+        # Each run in a fresh process, as peak RSS never goes down
+        peaks = [
+            float(subprocess.check_output([
+                sys.executable, "-m", "benchmarks.bench_submission",
+                "--child", mode, str(size), "--window", str(args.window),
+            ]))
+            for mode in ["all", "window"]
+        ]
+        print("{:>10d} {:>22.1f} {:>22.1f}".format(size, *peaks))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Benchmark of job directories: filesystem time per job, with and without a workspace"""
+
+import argparse
+import itertools
+import os
+import tempfile
+from benchmarks.common import QM9_TEST_ARCHIVE, report, sample_gaussian_log, timed
+from chemlearning_data.chemlearning_data import get_gaussian_arguments, iter_qm9_archive
+from chemlearning_data.gaussian_job import GaussianJob
+from chemlearning_data.workspace import Workspace
+
+
+def run_jobs(count, basedir, workspace=None):
+    """
+    Set up, "run" and clean up count jobs, return their total filesystem time.
+
+    g16 is replaced by the writing of a sample output file, so that only
+    directory and file operations are measured.
+    """
+    source = [molecule for _, molecule in iter_qm9_archive(QM9_TEST_ARCHIVE, max_workers=0)]
+    logs = [sample_gaussian_log(molecule) for molecule in source]
+    gaussian_args = get_gaussian_arguments()
+    fs_time = 0.0
+    for file_id, (molecule, log) in enumerate(
+            itertools.islice(itertools.cycle(zip(source, logs)), count)):
+        job = GaussianJob(basedir, str(file_id) + ".xyz", molecule, file_id, gaussian_args,
+                          workspace=workspace)
+        job.setup_computation()
+        with open(job.output_path, mode="w") as output_file:
+            output_file.write(log)
+        job.get_energies()
+        job.cleanup()
+        fs_time += job.fs_time
+    return fs_time
+
+
+def main():
+    """Launcher."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--basedir", default=os.getcwd(),
+                        help="folder for job directories without a workspace (shared filesystem)")
+    parser.add_argument("--scratch", default="/dev/shm" if os.path.isdir("/dev/shm") else None,
+                        help="folder for the workspace")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.basedir) as basedir:
+        fs_time, elapsed = timed(run_jobs, args.jobs, basedir)
+        report("makedirs/rmtree in " + args.basedir, args.jobs, elapsed, unit="jobs")
+        print("    filesystem time per job: {:.1f} us".format(1e6 * fs_time / args.jobs))
+
+    configurations = [("pool in " + args.basedir, args.basedir, None)]
+    if args.scratch:
+        configurations.append(("pool in " + args.scratch, args.scratch, None))
+        configurations.append(("pool in " + args.scratch + ", logs compressed",
+                               args.scratch, "compress"))
+    for name, scratch, keep_logs in configurations:
+        with tempfile.TemporaryDirectory(dir=scratch) as scratch_dir, \
+                tempfile.TemporaryDirectory(dir=args.basedir) as durable:
+            with Workspace(scratch_dir, durable=durable, keep_logs=keep_logs) as workspace:
+                fs_time, elapsed = timed(run_jobs, args.jobs, scratch_dir, workspace)
+            report(name, args.jobs, elapsed, unit="jobs")
+            print("    filesystem time per job: {:.1f} us".format(1e6 * fs_time / args.jobs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Helpers shared by all benchmarks"""
+
+import io
+import os
+import tarfile
+import time
+
+QM9_TEST_ARCHIVE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "qm9", "qm9_test.tar.bz2"
+)
+
+
+def read_archive_members(archive):
+    """Return the list of (name, raw bytes) of all members of a tar archive"""
+    members = list()
+    with tarfile.open(name=archive, mode="r|*") as tar:
+        for member in tar:
+            if member.isfile():
+                members.append((member.name, tar.extractfile(member).read()))
+    return members
+
+
+def build_synthetic_archive(source, destination, replicate):
+    """
+    Write a QM9-like tar.bz2 archive with every member of source repeated replicate times.
+
+    Copies are renumbered, so that file ids stay unique: the test archive only
+    holds 10 molecules, which is not enough to measure anything.
+    """
+    members = read_archive_members(source)
+    file_id = 0
+    with tarfile.open(name=destination, mode="w:bz2") as tar:
+        for _ in range(replicate):
+            for _, content in members:
+                file_id += 1
+                info = tarfile.TarInfo("dsgdb9nsd_" + str(file_id).zfill(6) + ".xyz")
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+    return file_id
+
+
+def timed(function, *args, **kwargs):
+    """Run function, return its result and the elapsed wall time in seconds"""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def report(name, count, elapsed, unit="molecules"):
+    """Print a throughput line"""
+    rate = count / elapsed if elapsed > 0 else float("inf")
+    print("{:<40} {:>10d} {} in {:8.3f} s : {:12.1f} {}/s".format(
+        name, count, unit, elapsed, rate, unit))
+
+
+def sample_gaussian_log(molecule, steps=1, energies=None):
+    """
+    Text of a Gaussian output file for molecule, as an optimization of steps steps.
+
+    Each step holds a Standard orientation block and an SCF Done line, as in
+    real logs, followed by NPA charges and thermochemistry. Large step counts
+    give multi-MB files, to compare parsers.
+    """
+    energies = energies or {"scf": -40.5183723401, "enthalpy": -40.469780,
+                            "freeenergy": -40.491059}
+    separator = " " + "-" * 69
+    lines = [
+        " Copyright (c) 1988-2017, Gaussian, Inc.  All Rights Reserved.",
+        " Gaussian 16:  ES64L-G16RevA.03 25-Dec-2016",
+    ]
+    for step in range(steps):
+        lines.extend([
+            "                         Standard orientation:                         ",
+            separator,
+            " Center     Atomic      Atomic             Coordinates (Angstroms)",
+            " Number     Number       Type             X           Y           Z",
+            separator,
+        ])
+        for i, (element, atom) in enumerate(
+                zip(molecule.elements_list.tolist(), molecule.coordinates.tolist())):
+            lines.append("{:>7d}{:>11d}{:>12d}    {:>12.6f}{:>12.6f}{:>12.6f}".format(
+                i + 1, element, 0, *atom))
+        lines.append(separator)
+        energy = energies["scf"] + 1e-3 * (steps - step - 1)
+        lines.append(" SCF Done:  E(RB3LYP) =  {:.10f}     A.U. after    9 cycles".format(energy))
+    lines.extend([
+        " Summary of Natural Population Analysis:",
+        "",
+        "                                     Natural Population",
+        "              Natural  -----------------------------------------------",
+        "    Atom No    Charge         Core      Valence    Rydberg      Total",
+        " -----------------------------------------------------------------------",
+    ])
+    for i, element in enumerate(molecule.elements_list.tolist()):
+        lines.append("      X{:>5d}   {:>8.5f}      0.00000     0.00000    0.00000     0.00000"
+                     .format(i + 1, 0.01 * (i - 1) * (element % 3)))
+    lines.extend([
+        " =======================================================================",
+        " Sum of electronic and thermal Enthalpies=           {:.6f}".format(
+            energies["enthalpy"]),
+        " Sum of electronic and thermal Free Energies=        {:.6f}".format(
+            energies["freeenergy"]),
+        " Normal termination of Gaussian 16 at Mon Jan  1 00:00:00 2019.",
+        "",
+    ])
+    return "\n".join(lines)
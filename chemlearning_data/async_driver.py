@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Drive many Gaussian computations from a single process with asyncio"""
+
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from chemlearning_data.gaussian_job import GaussianJob
+from chemlearning_data.profiling import StageTimer
+
+
+class AsyncJobDriver:
+    """
+    Run Gaussian jobs concurrently from an asyncio event loop.
+
+    g16 processes are started with asyncio.create_subprocess_exec, at most
+    cores // nprocshared at a time, so that the jobs fill the core budget
+    given the %NProcShared of each input. Molecules are pulled lazily from
+    the source iterable into a bounded queue, and input writing, parsing and
+    cleanup happen in a small thread pool. g16 is killed, with the processes
+    it started, after job_timeout seconds, or when the run is interrupted.
+
+    Attributes:
+        - basedir (directory in which computations are run, str)
+        - gaussian_args (arguments of the Gaussian computations, dict)
+        - cores (number of cores available for all jobs, int)
+        - slots (number of jobs running at the same time, int)
+        - parse_workers (number of threads for file operations, int)
+        - report_interval (seconds between two progress reports, float)
+        - workspace (pool of job directories, Workspace or None)
+        - metrics (histograms of stage timings of all jobs, StageMetrics or None)
+        - job_timeout (seconds after which a job is killed, None for no limit, float)
+        - stats (counters and throughput, dict)
+
+    """
+
+    def __init__(
+            self, basedir, gaussian_args, cores=None, parse_workers=2, report_interval=60.0,
+            workspace=None, metrics=None, job_timeout=None,
+    ):
+        """Build the AsyncJobDriver class."""
+        self.basedir = basedir
+        self.gaussian_args = gaussian_args
+        self.cores = cores if cores is not None else os.cpu_count()
+        self.parse_workers = parse_workers
+        self.report_interval = report_interval
+        self.workspace = workspace
+        self.metrics = metrics
+        self.job_timeout = job_timeout
+        self.stats = dict.fromkeys(["submitted", "running", "peak_running", "done", "failed"], 0)
+        self.stats["queue_depth"] = 0
+        self.stats["jobs_per_second"] = 0.0
+        self.stats["elapsed"] = 0.0
+        self._queue = None
+        self._start = None
+
+    @property
+    def slots(self):
+        """Number of jobs running at the same time"""
+        nprocshared = int(self.gaussian_args.get("nprocshared", 1))
+        return max(1, self.cores // nprocshared)
+
+    def run(self, molecules, on_result=None):
+        """
+        Run a job for every (file_id, Molecule) of molecules, blocking until all are done.
+
+        on_result(file_id, energies) is called in the event loop thread for each
+        successful job; results are not kept, so that memory use stays flat.
+        Returns the final stats.
+        """
+        return asyncio.run(self.run_async(molecules, on_result))
+
+    async def run_async(self, molecules, on_result=None):
+        """Coroutine version of run."""
+        self._start = time.perf_counter()
+        self._queue = asyncio.Queue(maxsize=2 * self.slots)
+        with ThreadPoolExecutor(max_workers=self.parse_workers) as thread_pool:
+            workers = [
+                asyncio.ensure_future(self._worker(thread_pool, on_result))
+                for _ in range(self.slots)
+            ]
+            reporter = asyncio.ensure_future(self._reporter())
+            try:
+                await self._producer(iter(molecules), thread_pool)
+                await asyncio.gather(*workers)
+            finally:
+                reporter.cancel()
+                for worker in workers:
+                    worker.cancel()
+        self._update_stats()
+        self.report()
+        if self.metrics is not None:
+            self.metrics.report()
+            self.metrics.write()
+        return self.stats
+
+    async def _producer(self, molecules, thread_pool):
+        """Pull molecules from the source into the queue, then stop all workers"""
+        loop = asyncio.get_running_loop()
+        sentinel = object()
+        while True:
+            # Reading the source may block (decompression, parsing): use a thread
+            item = await loop.run_in_executor(thread_pool, next, molecules, sentinel)
+            if item is sentinel:
+                break
+            await self._queue.put(item)
+            self.stats["submitted"] += 1
+        for _ in range(self.slots):
+            await self._queue.put(None)
+
+    async def _worker(self, thread_pool, on_result):
+        """Run jobs from the queue one after the other"""
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            file_id, molecule = item
+            job = GaussianJob(
+                basedir=self.basedir,
+                name=str(file_id) + ".xyz",
+                molecule=molecule,
+                job_id=file_id,
+                gaussian_args=self.gaussian_args,
+                workspace=self.workspace,
+                timer=StageTimer(),
+            )
+            self.stats["running"] += 1
+            self.stats["peak_running"] = max(self.stats["peak_running"], self.stats["running"])
+            try:
+                await loop.run_in_executor(thread_pool, job.setup_computation)
+                returncode = await job.run_async(timeout=self.job_timeout)
+                if returncode != 0:
+                    raise RuntimeError("g16 returned " + str(returncode))
+                energies = await loop.run_in_executor(thread_pool, job.get_energies)
+                await loop.run_in_executor(thread_pool, job.cleanup)
+            except Exception:  # pylint: disable=broad-except
+                # Job directory is kept, for inspection
+                logging.exception("Job failed: %s", str(file_id))
+                self.stats["failed"] += 1
+            else:
+                self.stats["done"] += 1
+                if on_result is not None:
+                    on_result(file_id, energies)
+            finally:
+                self.stats["running"] -= 1
+                if self.metrics is not None:
+                    self.metrics.add(job.timer.timings)
+
+    async def _reporter(self):
+        """Log progress every report_interval seconds"""
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self._update_stats()
+            self.report()
+            if self.metrics is not None:
+                self.metrics.write()
+
+    def _update_stats(self):
+        """Refresh throughput and queue depth"""
+        self.stats["elapsed"] = time.perf_counter() - self._start
+        finished = self.stats["done"] + self.stats["failed"]
+        if self.stats["elapsed"] > 0:
+            self.stats["jobs_per_second"] = finished / self.stats["elapsed"]
+        self.stats["queue_depth"] = self._queue.qsize() if self._queue is not None else 0
+
+    def report(self):
+        """Log current stats"""
+        logging.info(
+            "Jobs: %d done, %d failed, %d running, %d queued; %.3f jobs/s",
+            self.stats["done"],
+            self.stats["failed"],
+            self.stats["running"],
+            self.stats["queue_depth"],
+            self.stats["jobs_per_second"],
+        )
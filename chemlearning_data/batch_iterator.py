@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Shuffled minibatches over on-disk arrays, read by blocks and prefetched"""
+
+import os
+import queue
+import threading
+import time
+import numpy
+
+
+def split_blocks(length, ratio, seed=0, block_size=1024):
+    """
+    Random split of range(length) in two sets of whole blocks of block_size rows.
+
+    Returns sorted index arrays of the first set (about ratio of rows) and of
+    the second one, so that both are read by contiguous runs.
+    """
+    starts = numpy.arange(0, length, block_size)
+    order = numpy.random.default_rng(seed).permutation(len(starts))
+    first = numpy.zeros(len(starts), dtype=bool)
+    first[order[:int(round(len(starts) * ratio))]] = True
+    blocks = [numpy.arange(start, min(start + block_size, length)) for start in starts]
+    empty = numpy.empty(0, dtype=numpy.int64)
+    return (
+        numpy.concatenate([block for block, keep in zip(blocks, first) if keep] or [empty]),
+        numpy.concatenate([block for block, keep in zip(blocks, first) if not keep] or [empty]),
+    )
+
+
+def _read_rows(array, rows):
+    """Rows of array, with a slice when they are contiguous, for sequential reads"""
+    if len(rows) and rows[-1] - rows[0] == len(rows) - 1:
+        return numpy.asarray(array[rows[0]:rows[-1] + 1])
+    return numpy.asarray(array[rows])
+
+
+def pad_objects(column, padding=0):
+    """Stack an object array of arrays of different shapes, padded to the largest one"""
+    items = [numpy.asarray(item) for item in column]
+    shape = numpy.max([item.shape for item in items], axis=0)
+    stacked = numpy.full((len(items),) + tuple(shape), padding, dtype=items[0].dtype)
+    for index, item in enumerate(items):
+        stacked[(index,) + tuple(slice(0, size) for size in item.shape)] = item
+    return stacked
+
+
+def concat_arrays(batch, device=None, padding=0):
+    """
+    Converter for chainer updaters: batches are already tuples of arrays.
+
+    Columns of arrays of varying shapes (object arrays, as unpadded
+    preprocessors give) are padded with padding, as concat_examples does.
+    Arrays are only sent to device if one is given, through chainer.
+    """
+    batch = tuple(
+        pad_objects(array, padding) if array.dtype == object and len(array) else array
+        for array in batch
+    )
+    if device is None:
+        return batch
+    # pylint: disable=import-outside-toplevel
+    from chainer.dataset import to_device
+    return tuple(to_device(device, array) for array in batch)
+
+
+class BlockShuffleIterator:
+    """
+    Iterator of shuffled minibatches over arrays of the same length, such as memory-maps.
+
+    Rows are read by blocks of block_size contiguous rows, so that I/O stays
+    sequential: each epoch shuffles the order of blocks, then the rows of
+    buffer_blocks blocks at a time. Blocks are dealt to num_shards
+    data-parallel workers, all seeded alike so that they agree on the
+    partition; each shard gets as many blocks, extra ones being left out of
+    the epoch. Batches are built in a background thread, prefetch of them
+    ahead. A batch is a tuple of arrays, one per input array; the last batch
+    of an epoch may be smaller.
+
+    Follows the chainer Iterator interface (next, epoch, epoch_detail,
+    is_new_epoch, reset, finalize), use it with the concat_arrays converter.
+    The thread does not survive fork or pickling: it is started again, from
+    the beginning of the current epoch, in the process that next uses it,
+    as the workers of MultiprocessParallelUpdater.
+
+    Attributes:
+        - arrays (data, tuple of arrays, or anything with get_datasets, as NumpyTupleDataset)
+        - batch_size (rows per batch, int)
+        - indices (rows to iterate over, sorted int array, all rows by default)
+        - block_size (rows read at once, int)
+        - buffer_blocks (blocks shuffled together, int)
+        - shuffle (whether blocks and rows are shuffled, bool)
+        - seed (seed of the shuffling, int)
+        - shard (index of this worker, int)
+        - num_shards (number of data-parallel workers, int)
+        - repeat (whether to iterate over epochs forever, bool)
+        - prefetch (number of batches built in advance, int)
+        - epoch (number of completed epochs, int)
+        - is_new_epoch (whether the last batch ended an epoch, bool)
+
+    """
+
+    def __init__(self, arrays, batch_size, indices=None, block_size=1024, buffer_blocks=8,
+                 shuffle=True, seed=0, shard=0, num_shards=1, repeat=True, prefetch=4):
+        """Build the BlockShuffleIterator class, and start prefetching."""
+        if hasattr(arrays, "get_datasets"):
+            arrays = arrays.get_datasets()
+        self.arrays = tuple(arrays)
+        lengths = {len(array) for array in self.arrays}
+        if len(lengths) != 1:
+            raise ValueError("Arrays are not the same length")
+        if not 0 <= shard < num_shards:
+            raise ValueError("shard should be in range(num_shards)")
+        self.batch_size = batch_size
+        length = lengths.pop()
+        self.indices = numpy.arange(length) if indices is None else numpy.sort(indices)
+        self.block_size = block_size
+        self.buffer_blocks = buffer_blocks
+        self.shuffle = shuffle
+        self.seed = seed
+        self.shard = shard
+        self.num_shards = num_shards
+        self.repeat = repeat
+        self.prefetch = prefetch
+        self.epoch = 0
+        self.is_new_epoch = False
+        self._position = 0
+        self._queue = None
+        self._stop = None
+        self._thread = None
+        self._pid = None
+        self._start()
+
+    @property
+    def rows_per_epoch(self):
+        """Number of rows of the current epoch for this shard"""
+        if self.num_shards == 1:
+            return len(self.indices)
+        return sum(len(block) for block in self.epoch_blocks(self.epoch))
+
+    @property
+    def epoch_detail(self):
+        """Fractional number of epochs"""
+        rows = max(self.rows_per_epoch, 1)
+        return self.epoch + self._position / rows
+
+    def epoch_blocks(self, epoch):
+        """Blocks of rows (list of index arrays) of this shard for an epoch, in order"""
+        blocks = [
+            self.indices[start:start + self.block_size]
+            for start in range(0, len(self.indices), self.block_size)
+        ]
+        order = numpy.arange(len(blocks))
+        if self.shuffle:
+            order = numpy.random.default_rng([self.seed, epoch]).permutation(len(blocks))
+        per_shard = len(blocks) // self.num_shards if self.num_shards > 1 else len(blocks)
+        order = order[self.shard::self.num_shards][:per_shard]
+        return [blocks[index] for index in order]
+
+    def _epoch_batches(self, epoch):
+        """Yield the batches of an epoch"""
+        rng = numpy.random.default_rng([self.seed, epoch, self.shard])
+        blocks = self.epoch_blocks(epoch)
+        pending = None
+        for start in range(0, len(blocks), self.buffer_blocks):
+            group = blocks[start:start + self.buffer_blocks]
+            buffer = tuple(
+                numpy.concatenate([_read_rows(array, block) for block in group])
+                for array in self.arrays
+            )
+            if self.shuffle:
+                permutation = rng.permutation(len(buffer[0]))
+                buffer = tuple(array[permutation] for array in buffer)
+            if pending is not None:
+                buffer = tuple(numpy.concatenate(pair) for pair in zip(pending, buffer))
+                pending = None
+            stop = len(buffer[0]) - len(buffer[0]) % self.batch_size
+            for batch_start in range(0, stop, self.batch_size):
+                yield tuple(array[batch_start:batch_start + self.batch_size] for array in buffer)
+            if stop < len(buffer[0]):
+                pending = tuple(array[stop:] for array in buffer)
+        if pending is not None:
+            yield pending
+
+    def _produce(self, epoch, batches, stop):
+        """Background thread: put (batch, epoch ended) in the queue, then None"""
+        try:
+            while not stop.is_set():
+                previous = None
+                for batch in self._epoch_batches(epoch):
+                    if previous is not None:
+                        self._put(batches, stop, (previous, False))
+                    previous = batch
+                if previous is not None:
+                    self._put(batches, stop, (previous, True))
+                epoch += 1
+                if not self.repeat or previous is None:
+                    break
+        except Exception as error:  # pylint: disable=broad-except
+            self._put(batches, stop, error)
+        self._put(batches, stop, None)
+
+    @staticmethod
+    def _put(batches, stop, item):
+        """Put an item in the queue, unless the iterator is finalized"""
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _start(self):
+        """Start the background thread from the current epoch"""
+        self._pid = os.getpid()
+        self._position = 0
+        self._queue = queue.Queue(maxsize=self.prefetch)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._produce, args=(self.epoch, self._queue, self._stop), daemon=True
+        )
+        self._thread.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._thread is None or self._pid != os.getpid():
+            self._start()
+        item = self._queue.get()
+        if item is None:
+            self._queue.put(None)
+            raise StopIteration
+        if isinstance(item, Exception):
+            raise item
+        batch, epoch_end = item
+        self._position += len(batch[0])
+        self.is_new_epoch = epoch_end
+        if epoch_end:
+            self.epoch += 1
+            self._position = 0
+        return batch
+
+    next = __next__
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_queue=None, _stop=None, _thread=None, _pid=None)
+        return state
+
+    def finalize(self):
+        """Stop the background thread"""
+        if self._thread is not None and self._pid == os.getpid():
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        """Start again from the first epoch"""
+        self.finalize()
+        self.epoch = 0
+        self.is_new_epoch = False
+        self._start()
+
+    def serialize(self, serializer):
+        """Save or load the epoch, as chainer iterators do; the next epoch starts afresh"""
+        epoch = serializer("epoch", self.epoch)
+        if epoch != self.epoch:
+            self.finalize()
+            self.epoch = epoch
+            self._start()
+
+
+class TimedIterator:
+    """
+    Wrapper of a chainer-like iterator, measuring time spent waiting for batches.
+
+    Any other attribute is the one of the wrapped iterator. take_stats gives
+    and resets counters, so that a training loop can tell whether it is
+    bound by data loading (large wait_time) or by computation.
+
+    Attributes:
+        - iterator (wrapped iterator)
+        - samples (rows of batches taken since the last take_stats, int)
+        - batches (batches taken since the last take_stats, int)
+        - wait_time (seconds spent in next since the last take_stats, float)
+
+    """
+
+    def __init__(self, iterator):
+        """Build the TimedIterator class."""
+        self.iterator = iterator
+        self.samples = 0
+        self.batches = 0
+        self.wait_time = 0.0
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the wrapper itself
+        if name == "iterator":
+            raise AttributeError(name)
+        return getattr(self.iterator, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            batch = self.iterator.next()
+        finally:
+            self.wait_time += time.perf_counter() - start
+        self.batches += 1
+        self.samples += len(batch[0]) if isinstance(batch, tuple) else len(batch)
+        return batch
+
+    next = __next__
+
+    def take_stats(self):
+        """Dict of samples, batches and wait_time since the last call, then reset them"""
+        stats = {"samples": self.samples, "batches": self.batches, "wait_time": self.wait_time}
+        self.samples = 0
+        self.batches = 0
+        self.wait_time = 0.0
+        return stats
@@ -5,55 +5,225 @@
 """Tools to use data (especially from QM9) for machine learning applications."""
 
 # Here comes your imports
-import cclib
-import tarfile
+# chainer and chainer_chemistry take seconds to import: they are imported in
+# the functions using them, so that importing this module stays cheap
+# pylint: disable=import-outside-toplevel
 import os
-import chainer
-from chainer.datasets import split_dataset_random
-from chainer_chemistry import datasets
-from chainer_chemistry.dataset.preprocessors import preprocess_method_dict
-from chainer_chemistry.datasets import NumpyTupleDataset
-from chainer_chemistry.models import MLP, NFP
+import time
+from functools import lru_cache
+from chemlearning_data.batch_iterator import (
+    BlockShuffleIterator,
+    TimedIterator,
+    concat_arrays,
+    split_blocks,
+)
+from chemlearning_data.chemlearning_data import get_gaussian_arguments
+from chemlearning_data.dataset_store import DatasetStore
+from chemlearning_data.feature_cache import FeatureCache, feature_key, file_hash
+from chemlearning_data.result_store import results_directory
 
 # Here comes your (few) global variables
+# chainer.training.PRIORITY_WRITER: run before extensions reading reports
+PRIORITY_WRITER = 300
+
 
 # Here comes your class definitions
-class GraphConvPredictor(chainer.Chain):
+@lru_cache(maxsize=None)
+def graph_conv_predictor_class():
+    """GraphConvPredictor class, defined on first use, as it derives from chainer.Chain"""
+    import chainer
+
+    class GraphConvPredictor(chainer.Chain):
+
+        def __init__(self, graph_conv, mlp):
+            super(GraphConvPredictor, self).__init__()
+            with self.init_scope():
+                self.graph_conv = graph_conv
+                self.mlp = mlp
+
+        def __call__(self, atoms, adjs):
+            x = self.graph_conv(atoms, adjs)
+            x = self.mlp(x)
+            return x
+
+    return GraphConvPredictor
+
+
+class ThroughputReport:
+    """
+    Report training throughput every epoch: samples/s, epoch time and data-loading stalls.
+
+    stall_time is the time the updater waited for batches from its
+    TimedIterator; a large stall_fraction means training is bound by data
+    loading, a small one by computation. With several devices, samples are
+    counted on the main one and scaled by their number.
+    Trainer.extend takes it as any callable with trigger and priority, and
+    names it default_name.
+
+    Attributes:
+        - iterator (TimedIterator of the main device)
+        - devices (number of devices trained on in parallel, int)
 
-    def __init__(self, graph_conv, mlp):
-        super(GraphConvPredictor, self).__init__()
-        with self.init_scope():
-            self.graph_conv = graph_conv
-            self.mlp = mlp
+    """
 
-    def __call__(self, atoms, adjs):
-        x = self.graph_conv(atoms, adjs)
-        x = self.mlp(x)
-        return x
+    default_name = "throughput"
+    trigger = (1, "epoch")
+    priority = PRIORITY_WRITER
+
+    def __init__(self, iterator, devices=1):
+        """Build the ThroughputReport extension."""
+        self.iterator = iterator
+        self.devices = devices
+        self._start = time.perf_counter()
+
+    def initialize(self, trainer):
+        self._start = time.perf_counter()
+        self.iterator.take_stats()
+
+    def __call__(self, trainer):
+        now = time.perf_counter()
+        elapsed = now - self._start
+        self._start = now
+        stats = self.iterator.take_stats()
+        import chainer
+        chainer.report({
+            "samples_per_second": stats["samples"] * self.devices / elapsed,
+            "epoch_time": elapsed,
+            "stall_time": stats["wait_time"],
+            "stall_fraction": stats["wait_time"] / elapsed,
+        })
 
 
 # Here comes your function definitions
+def get_qm9_dataset(cache_dir, method, labels, preprocessor_args=None):
+    """
+    QM9 preprocessed with method, from the feature cache if already done.
+
+    Entries are keyed by preprocessor, its arguments, labels and hash of the
+    source data, and memory-mapped when loaded: on a hit, nothing is
+    preprocessed, and nothing is read before it is used.
+    """
+    from chainer_chemistry import datasets
+    from chainer_chemistry.dataset.preprocessors import preprocess_method_dict
+    from chainer_chemistry.datasets import NumpyTupleDataset
+    preprocessor_args = preprocessor_args or dict()
+    cache = FeatureCache(cache_dir)
+    source_hash = file_hash(datasets.get_qm9_filepath())
+    key = feature_key(method, labels, source_hash, preprocessor_args)
+    arrays = cache.load(key)
+    if arrays is None:
+        preprocessor = preprocess_method_dict[method](**preprocessor_args)
+        dataset = datasets.get_qm9(preprocessor, labels=labels)
+        arrays = cache.save(key, dataset.get_datasets())
+    return NumpyTupleDataset(*arrays)
+
+
+def train(model, dataset, train, validation, batch_size=32, epochs=20, devices=None,
+          out="data/training", seed=777):
+    """
+    Train model on rows train of dataset, with MAE evaluation on rows validation.
+
+    Batches come from BlockShuffleIterator, so that the dataset can stay
+    memory-mapped on disk. With several devices, a MultiprocessParallelUpdater
+    is used, each device training on its own shard of train; chainer only
+    supports it on GPUs (it communicates through NCCL). On CPU (devices None),
+    training is not data parallel: a single StandardUpdater runs, and only
+    the BLAS threads of numpy use the other cores of the node.
+    Returns the trainer.
+    """
+    import chainer
+    import chainer.functions as F
+    from chainer import training
+    from chainer.training import extensions
+    from chainer_chemistry.models.prediction import Regressor
+    regressor = Regressor(model, lossfun=F.mean_squared_error,
+                          metrics_fun={"mae": F.mean_absolute_error})
+    optimizer = chainer.optimizers.Adam()
+    optimizer.setup(regressor)
+
+    devices = list(devices or [])
+    shards = max(len(devices), 1)
+    iterators = [
+        BlockShuffleIterator(dataset, batch_size, indices=train, seed=seed, shard=shard,
+                             num_shards=shards)
+        for shard in range(shards)
+    ]
+    iterators[0] = TimedIterator(iterators[0])
+    if len(devices) > 1:
+        device_names = {"main": devices[0]}
+        device_names.update(
+            {"device" + str(index): device for index, device in enumerate(devices[1:], 1)}
+        )
+        updater = training.updaters.MultiprocessParallelUpdater(
+            iterators, optimizer, converter=concat_arrays, devices=device_names
+        )
+    else:
+        device = devices[0] if devices else -1
+        updater = training.StandardUpdater(
+            iterators[0], optimizer, converter=concat_arrays, device=device
+        )
+    trainer = training.Trainer(updater, (epochs, "epoch"), out=out)
+
+    valid_iter = BlockShuffleIterator(dataset, batch_size, indices=validation, shuffle=False,
+                                      repeat=False)
+    trainer.extend(extensions.Evaluator(
+        valid_iter, regressor, converter=concat_arrays, device=devices[0] if devices else -1
+    ))
+    trainer.extend(ThroughputReport(iterators[0], shards))
+    trainer.extend(extensions.LogReport())
+    trainer.extend(extensions.PrintReport([
+        "epoch", "main/mae", "validation/main/mae", "samples_per_second", "epoch_time",
+        "stall_fraction", "elapsed_time",
+    ]))
+    trainer.run()
+    for iterator in iterators + [valid_iter]:
+        iterator.finalize()
+    return trainer
 
 
 def main():
     """Launcher."""
-    preprocessor = preprocess_method_dict["nfp"]()
-    dataset = datasets.get_qm9(preprocessor, labels="homo")
-    cache_dir = "data/"
-    if not(os.path.exists(cache_dir)):
-        os.makedirs(cache_dir)
-    NumpyTupleDataset.save(cache_dir + "data.npz", dataset)
-    dataset = NumpyTupleDataset.load(cache_dir + 'data.npz')
+    cache_dir = "data/features"
+    # Train on our computed energies, or on chainer_chemistry QM9 labels
+    use_computed_energies = False
+    compaction = None
+    if use_computed_energies:
+        from chainer_chemistry.datasets import NumpyTupleDataset
+        # Only molecules computed since the last run are featurized, into a new
+        # version; train again on a former one with store.load(version)
+        store = DatasetStore("data/dataset")
+        archive = "qm9/qm9.pack" if os.path.isfile("qm9/qm9.pack") else "qm9/qm9.tar.bz2"
+        # Results of the current Gaussian arguments only
+        results = results_directory("data/qm9_dispersion", get_gaussian_arguments())
+        version = store.update(archive, results)
+        print('dataset version:', version)
+        dataset = NumpyTupleDataset(*store.load(version))
+        # Merges small chunks while training, into a version of the same rows
+        compaction = store.start_compaction()
+    else:
+        dataset = get_qm9_dataset(cache_dir, "nfp", "homo")
     train_data_ratio = 0.7
-    train_data_size = int(len(dataset) * train_data_ratio)
-    train, validation = split_dataset_random(dataset, train_data_size, 777)
-    print('train dataset size:', len(train))
-    print('validation dataset size:', len(validation))
+    batch_size = 32
+    # Split by blocks of rows, and iterate over the memory-mapped arrays
+    # without loading them: reads stay sequential, and RAM use bounded
+    train_rows, validation_rows = split_blocks(len(dataset), train_data_ratio, 777)
+    print('train dataset size:', len(train_rows))
+    print('validation dataset size:', len(validation_rows))
 
+    from chainer_chemistry.models import MLP, NFP
     n_unit = 16
     conv_layers = 4
-    model = GraphConvPredictor(NFP(n_unit, n_unit, conv_layers),
-                               MLP(n_unit, 1))
+    model = graph_conv_predictor_class()(NFP(n_unit, n_unit, conv_layers),
+                                         MLP(n_unit, 1))
+    # GPU ids to train on in parallel, e.g. [0, 1, 2, 3]; None for CPU
+    devices = None
+    try:
+        train(model, dataset, train_rows, validation_rows, batch_size, epochs=20,
+              devices=devices)
+    finally:
+        # Exiting while a merged chunk is written would leave it behind, half written
+        if compaction is not None:
+            compaction.join()
 
 
 if __name__ == "__main__":
@@ -6,51 +6,116 @@
 
 # Here comes your imports
 import os
-import re
+import shutil
+import subprocess
 import tarfile
+import tempfile
+import time
 import logging
 import multiprocessing
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait
 from concurrent.futures.process import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from cclib.parser.utils import PeriodicTable
-from chemlearning_data.gaussian_job import GaussianJob
-from chemlearning_data.molecule import Molecule
+import numpy
+from chemlearning_data.gaussian_job import GaussianJob, JobStopped, LinkedGaussianJob
+from chemlearning_data.gaussian_log import hartree_to_ev
+from chemlearning_data.manifest import RunManifest
+from chemlearning_data.packed_qm9 import PackedQM9, is_packed, write_pack
+from chemlearning_data.profiling import StageMetrics, StageTimer, profile_path, profiled
+from chemlearning_data.result_cache import ResultCache
+from chemlearning_data.result_store import ResultWriter, results_directory
+from chemlearning_data.scheduling import CostModel, ProgressEstimator, schedule_chunks
+from chemlearning_data.stragglers import (
+    FALLBACK_ARGUMENTS,
+    StragglerPolicy,
+    speculative_arguments,
+    stop_copy,
+    submit_speculative,
+)
+from chemlearning_data.workspace import process_workspace
+from chemlearning_data.molecule import (
+    Molecule,
+    MoleculeBatch,
+    atomic_numbers,
+    element_symbols,
+    xyz_line_formats,
+)
+
+# Maximum size of the result cache, in bytes
+CACHE_MAX_SIZE = 10 * 1024 ** 3
+
+# Fast local folder for job directories, in memory: only used if asked for, and if it exists
+SCRATCH_LOCATION = "/dev/shm"
+
+# Seconds between two writes of stage timing metrics
+METRICS_INTERVAL = 60.0
+
+# Modules imported once by the fork server, before it forks workers (see make_executor)
+WORKER_PRELOAD = ("chemlearning_data.chemlearning_data", "cclib.parser.utils")
+
+
+# Names of the properties found on the second line of QM9 files, after "gdb index".
+# See qm9_readme for units.
+QM9_PROPERTIES = [
+    "A", "B", "C", "mu", "alpha", "homo", "lumo", "gap",
+    "r2", "zpve", "U0", "U", "H", "G", "Cv",
+]
+
+
+def parse_qm9_xyz(content):
+    """
+    Parse the content of a QM9 xyz file, given as bytes.
+
+    Returns a tuple with:
+        - the Molecule
+        - properties (dict of the 15 QM9 reference properties, floats)
+        - identifiers (dict with smiles_gdb, smiles_relaxed, inchi_gdb, inchi_relaxed)
+
+    File layout (see qm9_readme for details):
+        n_atoms
+        gdb index A B C mu alpha homo lumo gap r2 zpve U0 U H G Cv
+        Element x y z Mulliken_charge    (n_atoms lines)
+        Harmonic frequencies
+        SMILES from GDB-17 / SMILES from B3LYP relaxation
+        InChI from GDB-17 / InChI from B3LYP relaxation
+    """
+    # Some values are written as powers of 10: e.g. 1.999*^-6. Fix them all at once.
+    lines = content.replace(b"*^", b"e").splitlines()
+    n_atoms = int(lines[0])
+
+    # Property line starts with "gdb index", then all 15 properties
+    values = lines[1].split()[2:]
+    properties = dict(zip(QM9_PROPERTIES, [float(value) for value in values]))
+
+    # Atom lines hold 5 fields each: element, x, y, z, charge
+    fields = numpy.array(b" ".join(lines[2:2 + n_atoms]).split()).reshape(n_atoms, 5)
+    coordinates = fields[:, 1:4].astype(numpy.float64)
+    numbers = atomic_numbers()
+    elements_list = numpy.array(
+        [numbers[atom] for atom in fields[:, 0].tolist()], dtype=numpy.uint8
+    )
 
-# pylint: disable=invalid-name
-lock = multiprocessing.Lock()
+    identifiers = dict()
+    smiles = lines[3 + n_atoms].split()
+    inchi = lines[4 + n_atoms].split()
+    identifiers["smiles_gdb"] = smiles[0].decode("utf-8")
+    identifiers["smiles_relaxed"] = smiles[-1].decode("utf-8")
+    identifiers["inchi_gdb"] = inchi[0].decode("utf-8")
+    identifiers["inchi_relaxed"] = inchi[-1].decode("utf-8")
 
+    return Molecule(coordinates, elements_list), properties, identifiers
 
-def extract_xyz_geometries(xyz_file):
-    """Extract xyz geometries from files in QM9"""
-    coordinates = list()
-    atoms = list()
-
-    # Open the file, then retrieve the first two lines for the properties included.
-    # With natoms, read all useful lines to get the coordinates, splitting them between
-    # atom nuclei on one list and xyz coordinates on the other. See qm9_readme for details
-    n_atoms = int(xyz_file.readline())
-    xyz_file.readline()  # Property line. Do not use.
-
-    for line in xyz_file.readlines()[0:n_atoms]:
-        line = line.split(b"\t")
-        line = [elem.decode("utf-8") for elem in line]
-        atoms.append(str(line[0]))
-        coords = line[1:4]
-        for j, word in enumerate(coords):
-            if "*^" in word:  # Some values are written as powers of 10: e.g. 1.999*^-6.
-                values = re.split(r"\*\^", word)
-                coords[j] = float(values[0]) * pow(10, int(values[1]))
-            else:
-                coords[j] = float(word)
 
-        coordinates.append(coords)
+def extract_qm9_data(xyz_file):
+    """Extract geometry, properties and identifiers from an opened QM9 xyz file"""
+    return parse_qm9_xyz(xyz_file.read())
 
-    # Cleanup atoms list thanks to cclib PeriodicTable, convert them to atomic number
-    periodic_table = PeriodicTable()
-    elements_list = [periodic_table.number[atom] for atom in atoms]
 
-    # Build the Molecule object and return it
-    molecule = Molecule(coordinates, elements_list)
+def extract_xyz_geometries(xyz_file):
+    """Extract xyz geometries from files in QM9"""
+    molecule, _, _ = extract_qm9_data(xyz_file)
     return molecule
 
 
@@ -69,6 +134,164 @@ def get_qm9files(data_location):
     return qm9files
 
 
+def get_file_id(file_name):
+    """Get the id of a QM9 file from its name: dsgdb9nsd_012503.xyz gives 012503"""
+    file_name = os.path.basename(file_name).split("_")[1]
+    return file_name.split(".")[0]
+
+
+def parse_xyz_members(members, labels=False):
+    """
+    Parse a chunk of xyz files already read in memory.
+
+    Used by worker processes: takes a list of (file_id, raw bytes) tuples and
+    returns all molecules packed in a single MoleculeBatch, so that they are
+    sent back to the parent as a few arrays. With labels, a list of
+    (properties, identifiers) tuples comes along, None otherwise.
+    """
+    parsed = [parse_qm9_xyz(content) for _, content in members]
+    batch = MoleculeBatch.from_molecules(
+        [molecule for molecule, _, _ in parsed],
+        file_ids=[file_id for file_id, _ in members],
+    )
+    if labels:
+        return batch, [(properties, identifiers) for _, properties, identifiers in parsed]
+    return batch, None
+
+
+def unpack_chunk(batch, labels):
+    """
+    Unpack the result of parse_xyz_members.
+
+    Yields (file_id, Molecule), or (file_id, Molecule, properties, identifiers)
+    when labels are present.
+    """
+    if labels is None:
+        yield from zip(batch.file_ids, batch)
+        return
+    for file_id, molecule, (properties, identifiers) in zip(batch.file_ids, batch, labels):
+        yield file_id, molecule, properties, identifiers
+
+
+def parse_xyz_files(paths, labels=False):
+    """
+    Parse a chunk of xyz files from disk.
+
+    Used by worker processes: takes a list of paths and returns the same
+    as parse_xyz_members.
+    """
+    members = list()
+    for path in paths:
+        with open(path, mode="rb") as xyz_file:
+            members.append((get_file_id(path), xyz_file.read()))
+    return parse_xyz_members(members, labels=labels)
+
+
+def chunk_qm9_archive(archive, chunk_size):
+    """
+    Read a QM9 tar archive sequentially, yielding lists of (file_id, raw bytes).
+
+    Members are read in archive order, so that the compressed stream is only
+    decompressed once, and only the current chunk is held in memory.
+    A pack file (see pack_qm9_archive) is read in the same way, block by block.
+    """
+    if is_packed(archive):
+        with PackedQM9(archive) as pack:
+            yield from pack.chunks(chunk_size)
+        return
+    chunk = list()
+    with tarfile.open(name=archive, mode="r:*") as qm9_tar:
+        for member in qm9_tar:
+            if not member.isfile() or not member.name.endswith(".xyz"):
+                continue
+            content = qm9_tar.extractfile(member).read()
+            chunk.append((get_file_id(member.name), content))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = list()
+    if chunk:
+        yield chunk
+
+
+def pack_qm9_archive(archive, destination, block_size=64, codec="zlib", level=6):
+    """
+    Convert a QM9 tar archive to a pack file, for random access (see PackedQM9).
+
+    Only xyz members are kept, in archive order. Returns their number.
+    """
+    members = (
+        member for chunk in chunk_qm9_archive(archive, 1024) for member in chunk
+    )
+    return write_pack(members, destination, block_size=block_size, codec=codec, level=level)
+
+
+def chunk_qm9_directory(data_location, chunk_size):
+    """Yield lists of paths to the xyz files of an extracted QM9 folder, sorted by id"""
+    qm9files = get_qm9files(data_location)
+    chunk = list()
+    for file_id in sorted(qm9files):
+        chunk.append(os.path.join(data_location, "dsgdb9nsd_" + qm9files[file_id]))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = list()
+    if chunk:
+        yield chunk
+
+
+def parse_chunks(chunks, parser, max_workers=None, max_pending=None):
+    """
+    Apply parser to all chunks, yielding the result for each chunk, in order.
+
+    Chunks are dispatched to a pool of max_workers processes, and at most
+    max_pending chunks (default: twice the number of workers) are in flight,
+    so that memory use does not depend on the size of the dataset.
+    With max_workers=0, everything is parsed in the current process.
+    """
+    if max_workers == 0:
+        for chunk in chunks:
+            yield parser(chunk)
+        return
+
+    with make_executor(max_workers) as executor:
+        if max_pending is None:
+            # pylint: disable=protected-access
+            max_pending = 2 * executor._max_workers
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(parser, chunk))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_qm9_archive(archive, max_workers=None, chunk_size=256, labels=False):
+    """
+    Lazily yield (file_id, Molecule) for every xyz file in a QM9 tar archive.
+
+    Decompression happens in the calling process, parsing in max_workers
+    worker processes (see parse_chunks).
+    With labels, yield (file_id, Molecule, properties, identifiers) instead.
+    """
+    chunks = chunk_qm9_archive(archive, chunk_size)
+    parser = partial(parse_xyz_members, labels=labels)
+    for batch, batch_labels in parse_chunks(chunks, parser, max_workers=max_workers):
+        yield from unpack_chunk(batch, batch_labels)
+
+
+def iter_qm9_directory(data_location, max_workers=None, chunk_size=256, labels=False):
+    """
+    Lazily yield (file_id, Molecule) for every xyz file in an extracted QM9 folder.
+
+    Files are parsed in max_workers worker processes (see parse_chunks).
+    With labels, yield (file_id, Molecule, properties, identifiers) instead.
+    """
+    chunks = chunk_qm9_directory(data_location, chunk_size)
+    parser = partial(parse_xyz_files, labels=labels)
+    for batch, batch_labels in parse_chunks(chunks, parser, max_workers=max_workers):
+        yield from unpack_chunk(batch, batch_labels)
+
+
 def get_gaussian_arguments():
     """All arguments necessary for a Gaussian computation"""
     args = dict()
@@ -78,8 +301,36 @@ def get_gaussian_arguments():
     return args
 
 
+def get_workspace(locations):
+    """
+    Workspace of the current process if locations has a "scratch" folder, else None.
+
+    Output files are kept in locations["logs"] if locations["keep_logs"] is
+    "move" or "compress".
+    """
+    if locations.get("scratch") is None:
+        return None
+    return process_workspace(
+        locations["scratch"],
+        durable=locations.get("logs"),
+        keep_logs=locations.get("keep_logs"),
+    )
+
+
+def job_name(file_id, copy=0, attempt=0):
+    """
+    Name of the Gaussian job of a molecule, hence of its directory.
+
+    Speculative copies and retries get their own, as they may run at the same
+    time, or after a killed job whose directory is kept for inspection.
+    """
+    suffix = (".copy" + str(copy) if copy else "") + (".retry" + str(attempt) if attempt else "")
+    return file_id + suffix + ".xyz"
+
+
 def compute_dispersion_correction(
-        molecule, file_id, file_name, locations, gaussian_args, output_file
+        molecule, file_id, file_name, locations, gaussian_args, cache=None, timer=None,
+        timeout=None, stop_file=None,
 ):
     """
     Wrapper around all operations:
@@ -88,8 +339,18 @@ def compute_dispersion_correction(
         - Setting up computation
         - Running Gaussian computation
         - Retrieving computation results
+
+    Job directories are taken from a scratch workspace if locations has one
+    (see get_workspace). Energies are returned, to be written by the parent process.
+    With a ResultCache, new results are stored in the cache; looking it up
+    before submitting the job is left to the caller.
+    Time spent in each stage is added to timer, a StageTimer, if given.
+    Gaussian is killed after timeout seconds, if given, raising
+    subprocess.TimeoutExpired, or once stop_file exists, raising JobStopped
+    (see GaussianJob.run); the directory of a stopped job is removed.
     """
     logging.info("Starting computation for %s", str(file_name))
+    timer = timer if timer is not None else StageTimer()
 
     # Build the Gaussian job
     logging.debug("Setting up Gaussian job for %s", str(file_name))
@@ -99,29 +360,27 @@ def compute_dispersion_correction(
         molecule=molecule,
         job_id=file_id,
         gaussian_args=gaussian_args,
+        workspace=get_workspace(locations),
+        timer=timer,
     )
     job.setup_computation()
 
     # Run the job
     logging.debug("Starting Gaussian job for %s", str(file_name))
-    job.run()
+    try:
+        job.run(timeout=timeout, stop_file=stop_file)
+    except JobStopped:
+        job.cleanup()
+        raise
 
     # Retrieve results upon completion
     logging.debug("Parsing results for %s", str(file_name))
     # Retrieve all useful energies
     energies = job.get_energies()
 
-    # Write data to file
-    global lock
-    with lock:
-        with open(output_file, mode="a") as out_file:
-            values = [
-                energies["scfenergy"],
-                energies["enthalpy"],
-                energies["freeenergy"],
-            ]
-            values = [str(val) for val in values]
-            out_file.write(str(file_id) + "\t" + "\t".join(values) + "\n")
+    if cache is not None:
+        with timer.stage("cache"):
+            cache.put(molecule, gaussian_args, energies, log_path=job.output_path)
 
     # Cleanup after job
     job.cleanup()
@@ -129,6 +388,218 @@ def compute_dispersion_correction(
     return file_id, energies
 
 
+def compute_linked_dispersion_corrections(molecules, locations, gaussian_args, timer=None,
+                                          timeout=None, copy=0, stop_file=None):
+    """
+    Compute a chunk of (file_id, Molecule) with a single g16 process (--Link1--).
+
+    Returns a list of (file_id, energies) in the same order, energies being
+    None for steps without results. Stages of the whole job are timed in
+    timer, a StageTimer, if given. Gaussian is killed after timeout seconds,
+    if given, raising subprocess.TimeoutExpired, or once stop_file exists,
+    raising JobStopped; copy is the number of a speculative copy, which gets
+    its own job name.
+    """
+    steps = [
+        GaussianJob(
+            basedir=locations["computations"],
+            name=file_id + ".xyz",
+            molecule=molecule,
+            job_id=file_id,
+            gaussian_args=gaussian_args,
+        )
+        for file_id, molecule in molecules
+    ]
+    first_id = molecules[0][0]
+    job = LinkedGaussianJob(
+        basedir=locations["computations"],
+        name="linked_" + job_name(first_id, copy)[:-len(".xyz")],
+        steps=steps,
+        job_id=first_id,
+        workspace=get_workspace(locations),
+        timer=timer,
+    )
+    logging.info("Starting linked computation of %d molecules from %s", len(steps), first_id)
+    job.setup_computation()
+    try:
+        job.run(timeout=timeout, stop_file=stop_file)
+    except JobStopped:
+        job.cleanup()
+        raise
+    energies = job.get_energies()
+    job.cleanup()
+    return [(file_id, step_energies) for (file_id, _), step_energies in zip(molecules, energies)]
+
+
+def compute_dispersion_corrections(batch, locations, gaussian_args, cache=None, link1=False,
+                                   timeouts=None, stragglers=None, copy=0, stop_file=None):
+    """
+    Compute a chunk of molecules, packed in a MoleculeBatch, in a single worker task.
+
+    Molecules are computed one by one with compute_dispersion_correction, or
+    all together in one multi-step Gaussian job with link1. New results are
+    stored in cache, a ResultCache, if given; molecules are looked up in it
+    by the caller, before submitting them.
+    Returns a list of (file_id, energies, error, seconds, timings): energies
+    are None for failed molecules, and error then explains why. seconds is
+    the wall time of the job, None for linked jobs; for
+    a killed molecule, that of its last attempt, a lower bound.
+    timings are the seconds spent in each stage (see StageTimer); a linked
+    job is shared evenly among its molecules.
+    timeouts are the seconds after which the job of each molecule is killed
+    (see StragglerPolicy.timeouts), None for no limit, a linked job getting
+    their sum; a killed linked job is followed by jobs one by one, and a
+    killed job by the retries of stragglers, a StragglerPolicy, if given,
+    with longer timeouts. copy is the number of a speculative copy of the
+    task (see submit_speculative), 0 for the original; the task is stopped,
+    raising JobStopped, once stop_file exists (see speculative_arguments).
+    With locations["profiles"] set, a fraction locations["profile_rate"] of
+    jobs runs under cProfile, stats written there (see profile_path).
+    """
+    results = list()
+    remaining = list(zip(batch.file_ids, batch))
+    timers = {file_id: StageTimer() for file_id in batch.file_ids}
+    timeouts = dict(zip(batch.file_ids, timeouts)) if timeouts is not None else dict()
+
+    profiles = locations.get("profiles")
+    profile_rate = locations.get("profile_rate", 0.0)
+    if link1 and remaining:
+        timer = StageTimer()
+        timeout = None
+        if timeouts and None not in [timeouts[file_id] for file_id, _ in remaining]:
+            timeout = sum(timeouts[file_id] for file_id, _ in remaining)
+        try:
+            with profiled(profile_path(profiles, "linked_" + remaining[0][0], profile_rate)):
+                linked_results = compute_linked_dispersion_corrections(
+                    remaining, locations, gaussian_args, timer=timer, timeout=timeout, copy=copy,
+                    stop_file=stop_file,
+                )
+        except subprocess.TimeoutExpired:
+            logging.warning("Linked job from %s killed, molecules computed one by one",
+                            remaining[0][0])
+            linked_results = None
+        if linked_results is not None and cache is not None:
+            with timer.stage("cache"):
+                for (_, molecule), (_, energies) in zip(remaining, linked_results):
+                    if energies is not None and energies["scfenergy"] is not None:
+                        cache.put(molecule, gaussian_args, energies)
+        for file_id, _ in remaining:
+            for stage, seconds in timer.timings.items():
+                timers[file_id].add(stage, seconds / len(remaining))
+        if linked_results is not None:
+            for file_id, energies in linked_results:
+                if energies is None or energies["scfenergy"] is None:
+                    results.append(
+                        (file_id, None, "No result in linked job", None, timers[file_id].timings)
+                    )
+                else:
+                    results.append((file_id, energies, None, None, timers[file_id].timings))
+            return results
+
+    attempts = stragglers.attempts(gaussian_args) if stragglers is not None else [gaussian_args]
+    for file_id, molecule in remaining:
+        timer = timers[file_id]
+        for attempt, attempt_args in enumerate(attempts):
+            start = time.perf_counter()
+            timeout = timeouts.get(file_id)
+            if stragglers is not None:
+                timeout = stragglers.retry_timeout(timeout, attempt)
+            try:
+                with profiled(profile_path(profiles, file_id, profile_rate)):
+                    _, energies = compute_dispersion_correction(
+                        molecule, file_id, job_name(file_id, copy, attempt), locations,
+                        attempt_args, cache=cache, timer=timer, timeout=timeout,
+                        stop_file=stop_file,
+                    )
+            except JobStopped:
+                raise
+            except subprocess.TimeoutExpired as error:
+                seconds = time.perf_counter() - start
+                reason = "Killed after {:.0f} s, attempt {} of {}".format(
+                    error.timeout, attempt + 1, len(attempts)
+                )
+                logging.warning("Computation of %s: %s", str(file_id), reason)
+            except Exception as error:  # pylint: disable=broad-except
+                logging.error("Computation failed for %s: %s", str(file_id), str(error))
+                results.append((file_id, None, str(error), None, timer.timings))
+                break
+            else:
+                results.append(
+                    (file_id, energies, None, time.perf_counter() - start, timer.timings)
+                )
+                break
+        else:
+            # Killed: it takes at least as long as its last attempt, for the cost model
+            results.append((file_id, None, reason, seconds, timer.timings))
+    return results
+
+
+def chunked(iterable, size):
+    """Yield lists of size items from iterable, the last one possibly shorter"""
+    chunk = list()
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = list()
+    if chunk:
+        yield chunk
+
+
+def submit_bounded(executor, jobs, on_done, max_in_flight):
+    """
+    Submit jobs to executor, with at most max_in_flight of them not finished.
+
+    jobs yields (key, function, kwargs), and is only consumed as jobs finish.
+    on_done(key, future) is called from the calling thread for every job, as
+    soon as it ends; futures are then dropped, so that memory use does not
+    depend on the number of jobs.
+    """
+    pending = dict()
+    for key, function, kwargs in jobs:
+        if len(pending) >= max_in_flight:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                on_done(pending.pop(future), future)
+        pending[executor.submit(function, **kwargs)] = key
+    for future in as_completed(pending):
+        on_done(pending[future], future)
+
+
+def record_results(manifest, writer, file_ids, future, progress=None, metrics=None):
+    """
+    Record the outcome of compute_dispersion_corrections, for a chunk of molecules.
+
+    State goes to the manifest, energies to the ResultWriter, job wall
+    times to the ProgressEstimator and stage timings to the StageMetrics, if
+    any. Recording itself is timed as the "record" stage.
+    """
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        logging.error("Computation failed for %s: %s", " ".join(file_ids), str(error))
+        for file_id in file_ids:
+            manifest.mark_failed(file_id, error)
+            if progress is not None:
+                progress.finished(file_id)
+        return
+    for file_id, energies, error, seconds, timings in future.result():
+        start = time.perf_counter()
+        if progress is not None:
+            progress.finished(file_id, seconds)
+        if energies is None:
+            manifest.mark_failed(file_id, error)
+        else:
+            manifest.mark_done(file_id, energies)
+            writer.add(file_id, energies)
+        if metrics is not None:
+            metrics.add(timings)
+            metrics.observe("record", time.perf_counter() - start)
+    if metrics is not None:
+        metrics.maybe_write()
+
+
 def setup_logger():
     """Setup logging"""
     # Setup logging
@@ -152,6 +623,49 @@ def setup_logger():
     logger_general.addHandler(stream_handler)
 
 
+def init_worker():
+    """
+    Pool initializer: set a worker process up once, before its first task.
+
+    Logging is configured if the process has none (workers started by
+    forkserver or spawn do not inherit it), and lookup tables of parsing and
+    input writing are built, so that the first job does not pay for them.
+    """
+    if not logging.getLogger().handlers:
+        setup_logger()
+    warm_tables()
+
+
+def warm_tables():
+    """Build the cached lookup tables (and import cclib, which they come from)"""
+    element_symbols()
+    atomic_numbers()
+    xyz_line_formats()
+    hartree_to_ev()
+
+
+def make_executor(max_workers=None, start_method=None, preload=WORKER_PRELOAD):
+    """
+    ProcessPoolExecutor whose workers run init_worker once.
+
+    start_method is a multiprocessing start method ("fork", "spawn" or
+    "forkserver"), the default of the platform if None. With "fork", tables
+    are built in this process first, and workers inherit them. With
+    "forkserver", modules of preload are imported once in the fork server,
+    and workers are forked from it with them already loaded, instead of
+    importing them each; the fork server starts with the first forkserver
+    executor of the process, later ones keep its preload.
+    """
+    context = multiprocessing.get_context(start_method)
+    if context.get_start_method() == "fork":
+        warm_tables()
+    elif context.get_start_method() == "forkserver":
+        context.set_forkserver_preload(list(preload))
+    return ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=context, initializer=init_worker
+    )
+
+
 def main():
     """Launcher."""
     # Setup all variables
@@ -163,11 +677,53 @@ def main():
     folders["qm9"] = os.path.join(os.getcwd(), qm9_location)
     folders["data"] = os.path.join(os.getcwd(), data_location)
     folders["computations"] = os.path.join(os.getcwd(), computations_location)
+    # Job directories on scratch (SCRATCH_LOCATION, in RAM) with use_scratch, if it exists:
+    # faster than a shared filesystem, but taken from the memory of jobs. Output files
+    # kept in folders["logs"] with keep_logs set to "move" or "compress"
+    use_scratch = False
+    folders["scratch"] = None
+    folders["logs"] = os.path.join(folders["data"], "logs")
+    folders["keep_logs"] = None
+    # cProfile stats of a fraction profile_rate of jobs, 0 for none
+    folders["profiles"] = os.path.join(folders["data"], "profiles")
+    folders["profile_rate"] = 0.0
 
     # qm9_location = os.path.join(folders["qm9"], "qm9_test.tar.bz2")
     qm9_location = os.path.join(folders["qm9"], "qm9.tar.bz2")
+    # Converted once by pack_qm9_archive (python -m chemlearning_data.packed_qm9):
+    # read in place of the archive if present
+    if os.path.isfile(os.path.join(folders["qm9"], "qm9.pack")):
+        qm9_location = os.path.join(folders["qm9"], "qm9.pack")
     output_file = os.path.join(folders["data"], "qm9_dispersion.data")
-    output_file_raw = os.path.join(folders["data"], "qm9_dispersion_raw.data")
+    manifest_file = os.path.join(folders["data"], "qm9_dispersion.sqlite")
+    cache_location = os.path.join(folders["data"], "cache")
+    # Histograms of stage timings, as a Prometheus textfile (or JSON, with a .json name)
+    metrics_file = os.path.join(folders["data"], "metrics.prom")
+
+    # Number of tasks submitted to the executor and not finished yet
+    workers = os.cpu_count() or 1
+    max_in_flight = 2 * workers
+    # Molecules computed by each worker task, and whether they share a single g16 process
+    molecules_per_task = 8
+    link1 = False
+    # Submission order: "fifo", "lpt" (longest first) or "guided" (longest first,
+    # shrinking chunks), see schedule_chunks. Molecules are sorted by windows of a few
+    # times those in flight, so that memory use stays flat; None sorts them all, for the
+    # best balance and a projected finish of the whole run, but reads the whole archive
+    # before the first job starts.
+    scheduling = "lpt"
+    schedule_window = 4 * max_in_flight * molecules_per_task
+    # How worker processes start: None for the platform default (fork on Linux),
+    # "forkserver" to fork them from a process with all modules already imported
+    start_method = None
+    # Once the cost model is fitted, jobs over 4 times their estimated wall time (10 minutes
+    # at least) are killed, and tried once more with the fallback SCF options and twice the
+    # time. Once all tasks are submitted, idle workers run copies of tasks over 1.5 times
+    # their estimated time, the first to finish is kept, and the others stopped.
+    stragglers = StragglerPolicy(
+        factor=4.0, min_seconds=600.0, retries=1, fallback_args=FALLBACK_ARGUMENTS
+    )
+    speculative_copies = 1
 
     # Setup logging
     setup_logger()
@@ -175,59 +731,114 @@ def main():
     # Create all folders where necessary
     Path(folders["computations"]).mkdir(parents=True, exist_ok=True)
     Path(folders["data"]).mkdir(parents=True, exist_ok=True)
-
-    # Output file headers
-    with open(output_file_raw, mode="w") as out_file:
-        out_file.write("File_ID\tSCF_Energy\tEnthalpy\tFree_Energy\n")
-
-    with open(output_file, mode="w") as out_file:
-        out_file.write("File_ID\tSCF_Energy\tEnthalpy\tFree_Energy\n")
-
-    # Set up local Gaussian arguments
-    gaussian_arguments = get_gaussian_arguments()
-
-    # Iterate over contents of tar file and submit every job to the executor
-    results = list()
-    with tarfile.open(name=qm9_location, mode="r:bz2") as qm9_tar:
-        with ProcessPoolExecutor() as executor:
-            for xyz_file in qm9_tar:
-                # Extract proper file form tar, but only in RAM
-                extracted_xyz = qm9_tar.extractfile(xyz_file)
-                molecule = extract_xyz_geometries(extracted_xyz)
-
-                # Get useful data for building the Gaussian job
-                file_name = xyz_file.name.split("_")[1]  # Remove header dsgdb9nsd_
-                file_id = file_name.split(".")[0]  # Get file id. (Remove .xyz)
-
-                logging.info("Submitting %s", str(file_name))
-                future_result = executor.submit(
-                    compute_dispersion_correction,
-                    molecule=molecule,
-                    file_id=file_id,
-                    file_name=file_name,
-                    locations=folders,
-                    gaussian_args=gaussian_arguments,
-                    output_file=output_file_raw,
+    # Stop files of speculative copies that lost
+    stop_location = tempfile.mkdtemp(prefix="stop_", dir=folders["computations"])
+    if use_scratch and os.path.isdir(SCRATCH_LOCATION):
+        folders["scratch"] = tempfile.mkdtemp(prefix="chemlearning_", dir=SCRATCH_LOCATION)
+        logging.info("Job directories on scratch, in memory: %s", folders["scratch"])
+    try:
+        # Set up local Gaussian arguments
+        gaussian_arguments = get_gaussian_arguments()
+        # Result store of these arguments only
+        results_location = results_directory(
+            os.path.join(folders["data"], "qm9_dispersion"), gaussian_arguments
+        )
+
+        # Results of former campaigns: looked up here, before submitting jobs, and
+        # stored by workers; evicted here only, from sizes on disk
+        cache = ResultCache(cache_location, max_size=CACHE_MAX_SIZE)
+        cache.evict()
+
+        # The manifest keeps track of all jobs: resume from where a previous run stopped
+        with RunManifest(manifest_file, gaussian_arguments) as manifest, \
+                ResultWriter(results_location) as writer:
+            manifest.requeue_running()
+            completed = manifest.completed_ids()
+            logging.info("%d molecules already computed", len(completed))
+
+            # Results recorded in the manifest, but not written before a crash
+            written = writer.existing_ids()
+            for file_id, energies in manifest.results():
+                if int(file_id) not in written:
+                    writer.add(file_id, energies)
+
+            # Estimated job wall times, fitted as jobs end, for ordering and progress
+            cost_model = CostModel(gaussian_arguments)
+            progress = ProgressEstimator(cost_model, workers)
+            metrics = StageMetrics(metrics_file, interval=METRICS_INTERVAL)
+            metrics.load()  # Timings of former runs, when resuming
+
+            def molecules():
+                """Molecules still to compute, read from the archive as they are needed"""
+                for file_id, molecule in iter_qm9_archive(qm9_location):
+                    if file_id in completed:
+                        continue
+                    # Same molecule computed with the same arguments: no job at all
+                    energies = cache.get(molecule, gaussian_arguments)
+                    if energies is not None:
+                        manifest.mark_done(file_id, energies)
+                        writer.add(file_id, energies)
+                        continue
+                    progress.add(file_id, molecule)
+                    yield file_id, molecule
+
+            def jobs():
+                """Worker tasks, each computing a chunk of molecules packed in a MoleculeBatch"""
+                chunks = schedule_chunks(
+                    molecules(), cost_model, molecules_per_task, workers,
+                    policy=scheduling, window=schedule_window,
+                )
+                for i, chunk in enumerate(chunks):
+                    if i == 0:
+                        progress.report()
+                    file_ids = [file_id for file_id, _ in chunk]
+                    logging.info("Submitting %s", " ".join(file_ids))
+                    manifest.mark_running(file_ids)
+                    batch = MoleculeBatch.from_molecules(
+                        [molecule for _, molecule in chunk], file_ids=file_ids
+                    )
+                    kwargs = dict(
+                        batch=batch,
+                        locations=folders,
+                        gaussian_args=gaussian_arguments,
+                        cache=cache,
+                        link1=link1,
+                        timeouts=stragglers.timeouts(cost_model, batch),
+                        stragglers=stragglers,
+                    )
+                    yield file_ids, compute_dispersion_corrections, speculative_arguments(
+                        kwargs, 0, stop_location
+                    )
+
+            def expected_seconds(kwargs):
+                """Estimated wall time of a task: its molecules are computed one after the other"""
+                return float(cost_model.predict(cost_model.basis_sizes(kwargs["batch"])).sum())
+
+            # Iterate over contents of tar file and submit jobs to the executor as others end
+            # Molecules are decompressed and parsed in a separate pool, as they are needed
+            with make_executor(workers, start_method) as executor:
+                copies = submit_speculative(
+                    executor, jobs(),
+                    partial(record_results, manifest, writer, progress=progress, metrics=metrics),
+                    max_in_flight, workers, expected_seconds,
+                    partial(speculative_arguments, directory=stop_location),
+                    max_copies=speculative_copies, stop=stop_copy,
                 )
-                results.append(future_result)
-                logging.info("Submitted %s", str(file_name))
-            logging.info("All files submitted")
-        logging.info("All subprocesses terminated")
-
-    # Retrieve results
-    os.chdir(folders["basedir"])
-    # Iterate over all results to build the final table
-    with open(output_file, mode="a") as out_file:
-        for result in results:
-            # Careful for actual value extracting, dict are not ordered. Use actual keys.
-            file_id, energies = result.result()
-            values = [
-                energies["scfenergy"],
-                energies["enthalpy"],
-                energies["freeenergy"],
-            ]
-            values = [str(val) for val in values]
-            out_file.write(str(file_id) + "\t" + "\t".join(values) + "\n")
+                logging.info("All jobs finished, speculative copies: %s", str(copies))
+            logging.info("All subprocesses terminated")
+            logging.info("Jobs: %s", str(manifest.counts()))
+            cache.evict()
+            logging.info("Cache: %s", str(cache.stats))
+            metrics.report()
+            metrics.write()
+
+            # Build the final table from the manifest
+            manifest.export_tsv(output_file)
+    finally:
+        # Also after a crash or Ctrl-C: scratch is in memory
+        shutil.rmtree(stop_location, ignore_errors=True)
+        if folders["scratch"] is not None:
+            shutil.rmtree(folders["scratch"], ignore_errors=True)
 
 
 if __name__ == "__main__":
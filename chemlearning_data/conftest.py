@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Fixtures shared by all tests"""
+
+import os
+import stat
+import pytest
+
+QM9_TEST_ARCHIVE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "qm9", "qm9_test.tar.bz2"
+)
+
+# Stand-in for Gaussian: echoes its input, like g16 does, then prints the few
+# lines from which energies are parsed, and ends normally. Multi-step inputs
+# (--Link1--) give one such output per step.
+# FAKE_G16_SLEEP makes it last a bit, so that concurrent jobs actually overlap.
+# FAKE_G16_FAIL makes it fail in job directories matching this pattern.
+# FAKE_G16_HANG makes it hang in job directories matching this pattern.
+# FAKE_G16_MAX_SLEEP makes it sleep a random time, up to this number of seconds.
+FAKE_G16 = """#!/bin/sh
+if [ -n "$FAKE_G16_FAIL" ] && pwd | grep -q "$FAKE_G16_FAIL"; then exit 1; fi
+echo " Copyright (c) 1988-2017, Gaussian, Inc.  All Rights Reserved."
+echo " Gaussian 16:  ES64L-G16RevA.03 25-Dec-2016"
+if [ -n "$FAKE_G16_HANG" ] && pwd | grep -q "$FAKE_G16_HANG"; then sleep 3600; fi
+sleep "${FAKE_G16_SLEEP:-0}"
+if [ -n "$FAKE_G16_MAX_SLEEP" ]; then
+    sleep "$(od -An -N2 -tu2 /dev/urandom |
+        awk -v max="$FAKE_G16_MAX_SLEEP" '{print $1 / 65535 * max}')"
+fi
+awk '
+function results() {
+    print " SCF Done:  E(RB3LYP) =  -40.5183723401     A.U. after    9 cycles"
+    print " Sum of electronic and zero-point Energies=            -40.473587"
+    print " Sum of electronic and thermal Energies=               -40.470724"
+    print " Sum of electronic and thermal Enthalpies=             -40.469780"
+    print " Sum of electronic and thermal Free Energies=          -40.491059"
+    print " Normal termination of Gaussian 16"
+}
+/^--Link1--$/ { results(); next }
+{ print }
+END { results() }
+'
+"""
+
+
+@pytest.fixture
+def qm9_test_archive():
+    """Path to the small QM9 archive shipped with the repository"""
+    return QM9_TEST_ARCHIVE
+
+
+@pytest.fixture
+def fake_g16(tmp_path, monkeypatch):
+    """Put a fake g16 executable first in PATH, return its path"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    g16 = bin_dir / "g16"
+    g16.write_text(FAKE_G16)
+    g16.chmod(g16.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+    return str(g16)
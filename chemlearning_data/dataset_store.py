@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Versioned store of graph features, updated with new results without featurizing all again"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+import numpy
+from chemlearning_data.chemlearning_data import (
+    chunk_qm9_archive,
+    parse_chunks,
+    parse_xyz_members,
+)
+from chemlearning_data.graph_features import energy_labels, graph_features
+from chemlearning_data.molecule import MoleculeBatch
+from chemlearning_data.packed_qm9 import PackedQM9, is_packed
+from chemlearning_data.result_store import load_results
+
+# Arrays of every chunk; all but file_id are columns of the dataset
+ARRAYS = ("file_id", "atoms", "adjacency", "labels")
+# Chunks with fewer rows are merged by compact
+COMPACT_ROWS = 65536
+# Chunks not in any version are only removed by prune after this many seconds:
+# they may belong to a version being committed
+PRUNE_GRACE = 3600.0
+
+
+def latest_results(results):
+    """Results as loaded by load_results, keeping the last row of every file id only"""
+    # Result chunks are written in order: the last row is the latest computation
+    _, last = numpy.unique(results["file_id"][::-1], return_index=True)
+    rows = len(results["file_id"]) - 1 - last
+    return {name: numpy.asarray(column)[rows] for name, column in results.items()}
+
+
+def iter_members(archive, file_ids, chunk_size):
+    """
+    Lists of (file_id, raw bytes) of the molecules of file_ids (ints) in a tar archive or pack.
+
+    From a pack, only these molecules are read. A tar archive is decompressed
+    in full, but only these molecules are kept, hence parsed.
+    """
+    if is_packed(archive):
+        with PackedQM9(archive) as pack:
+            positions = [pack.position(file_id) for file_id in file_ids]
+            positions = [position for position in positions if position is not None]
+            yield from pack.chunks(chunk_size, pack.read(positions))
+        return
+    wanted = set(file_ids)
+    for chunk in chunk_qm9_archive(archive, chunk_size):
+        chunk = [member for member in chunk if int(member[0]) in wanted]
+        if chunk:
+            yield chunk
+
+
+class DatasetStore:
+    """
+    Graph features and energy labels of QM9 molecules, growing as results come in.
+
+    Molecules are stored in immutable chunks, folders of one .npy file per
+    array (see ARRAYS), and a version is a JSON manifest listing chunks in
+    order. update featurizes only molecules with results that are not in the
+    latest version, writes them as a new chunk, rewrites the chunks of
+    molecules whose labels changed since, and commits a new version; compact
+    merges small chunks, in a new version too. Versions keep their
+    chunks, so that a training run can load the exact dataset it used, until
+    prune removes them.
+    A version is committed by creating its manifest exclusively: a writer
+    (thread or process) finding that another one committed first starts again
+    from the new latest version, so that none is lost.
+    Settings are fixed when the store is created.
+
+    Attributes:
+        - directory (root of the store, str)
+        - label_names (energies used as labels, tuple of str)
+        - max_atoms (atoms per molecule after padding, None for the QM9 largest, int)
+        - explicit_hydrogens (whether hydrogens are kept, bool)
+        - mmap_mode (numpy.load mmap_mode of loaded chunks, None to read them in memory)
+
+    """
+
+    def __init__(self, directory, label_names=("enthalpy",), max_atoms=None,
+                 explicit_hydrogens=False, mmap_mode="r"):
+        """Open the store, creating it if necessary; ValueError if built with other settings."""
+        self.directory = directory
+        self.label_names = tuple(label_names)
+        self.max_atoms = max_atoms
+        self.explicit_hydrogens = explicit_hydrogens
+        self.mmap_mode = mmap_mode
+        os.makedirs(os.path.join(directory, "chunks"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "versions"), exist_ok=True)
+        settings = {"label_names": list(self.label_names), "max_atoms": max_atoms,
+                    "explicit_hydrogens": explicit_hydrogens}
+        path = os.path.join(directory, "settings.json")
+        if not os.path.isfile(path):
+            self._write_json(path, settings)
+        with open(path, mode="r") as settings_file:
+            stored = json.load(settings_file)
+        if stored != settings:
+            raise ValueError("Store built with other settings: " + str(stored))
+
+    @staticmethod
+    def _write_json(path, content):
+        """Write a JSON file under a temporary name, then rename it"""
+        tmp_path = path + "." + uuid.uuid4().hex + ".tmp"
+        with open(tmp_path, mode="w") as json_file:
+            json.dump(content, json_file, indent=1)
+        os.replace(tmp_path, path)
+
+    def _chunk_path(self, name):
+        """Folder of a chunk"""
+        return os.path.join(self.directory, "chunks", name)
+
+    def _version_path(self, version):
+        """Manifest of a version"""
+        return os.path.join(self.directory, "versions", str(version).zfill(6) + ".json")
+
+    def versions(self):
+        """Sorted numbers of all versions"""
+        return sorted(
+            int(name[:-len(".json")])
+            for name in os.listdir(os.path.join(self.directory, "versions"))
+            if name.endswith(".json") and name[:-len(".json")].isdigit()
+        )
+
+    @property
+    def latest(self):
+        """Number of the latest version, 0 for an empty store"""
+        versions = self.versions()
+        return versions[-1] if versions else 0
+
+    def manifest(self, version=None):
+        """Manifest of a version (the latest by default), as a dict"""
+        version = self.latest if version is None else version
+        if version == 0:
+            return {"version": 0, "parent": None, "rows": 0, "chunks": list()}
+        with open(self._version_path(version), mode="r") as manifest_file:
+            return json.load(manifest_file)
+
+    def _load_chunk(self, name):
+        """Arrays of a chunk, as a dict"""
+        return {
+            array: numpy.load(os.path.join(self._chunk_path(name), array + ".npy"),
+                              mmap_mode=self.mmap_mode)
+            for array in ARRAYS
+        }
+
+    def _concatenate(self, chunks, names):
+        """Arrays names of chunks (manifest entries), end to end"""
+        loaded = [self._load_chunk(chunk["name"]) for chunk in chunks]
+        if len(loaded) == 1:
+            # Memory-mapped as is, nothing read
+            return tuple(loaded[0][name] for name in names)
+        if not loaded:
+            return tuple(self._empty()[name] for name in names)
+        return tuple(numpy.concatenate([chunk[name] for chunk in loaded]) for name in names)
+
+    def _empty(self):
+        """Arrays of a chunk without rows"""
+        atoms, adjacency = graph_features(
+            MoleculeBatch.from_molecules([]), self.max_atoms, self.explicit_hydrogens
+        )
+        return {"file_id": numpy.empty(0, dtype=numpy.int64), "atoms": atoms,
+                "adjacency": adjacency,
+                "labels": numpy.empty((0, len(self.label_names)), dtype=numpy.float32)}
+
+    def file_ids(self, version=None):
+        """File ids of all molecules of a version (the latest by default), int64 array"""
+        return self._concatenate(self.manifest(version)["chunks"], ["file_id"])[0]
+
+    def load(self, version=None):
+        """(atoms, adjacency, labels) of a version (the latest by default), see graph_features"""
+        return self._concatenate(self.manifest(version)["chunks"], ARRAYS[1:])
+
+    def _write_chunk(self, arrays):
+        """Write a new chunk, return its manifest entry"""
+        # Random names: writers never pick the same one
+        name = "chunk_" + uuid.uuid4().hex[:16]
+        tmp_path = os.path.join(self.directory, "chunks", "." + name + ".tmp")
+        os.makedirs(tmp_path)
+        for array in ARRAYS:
+            numpy.save(os.path.join(tmp_path, array + ".npy"), arrays[array])
+        os.replace(tmp_path, self._chunk_path(name))
+        return {"name": name, "rows": int(len(arrays["file_id"]))}
+
+    def _commit(self, parent, chunks, note):
+        """Commit a version listing chunks after parent; its number, None if another came first"""
+        version = parent["version"] + 1
+        manifest = {"version": version, "parent": parent["version"], "created": time.time(),
+                    "note": note, "rows": sum(chunk["rows"] for chunk in chunks),
+                    "chunks": chunks}
+        path = self._version_path(version)
+        tmp_path = path + "." + uuid.uuid4().hex + ".tmp"
+        with open(tmp_path, mode="w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=1)
+        try:
+            # Fails if the version exists: complete manifests only, never overwritten
+            os.link(tmp_path, path)
+        except FileExistsError:
+            return None
+        finally:
+            os.remove(tmp_path)
+        logging.info("Dataset version %d: %d molecules in %d chunks (%s)", version,
+                     manifest["rows"], len(chunks), note)
+        return version
+
+    def featurize(self, archive, file_ids, results, max_workers=None, chunk_size=4096):
+        """
+        Arrays of a chunk for the molecules of file_ids, labelled from results.
+
+        results are as loaded by load_results; molecules without all labels,
+        or not in the archive, are left out. Returns None if none is left.
+        """
+        parts = list()
+        chunks = iter_members(archive, [int(file_id) for file_id in file_ids], chunk_size)
+        for batch, _ in parse_chunks(chunks, parse_xyz_members, max_workers=max_workers):
+            rows, labels = energy_labels(batch.file_ids, results, self.label_names)
+            atoms, adjacency = graph_features(batch, self.max_atoms, self.explicit_hydrogens)
+            ids = numpy.array([int(file_id) for file_id in batch.file_ids], dtype=numpy.int64)
+            parts.append((ids[rows], atoms[rows], adjacency[rows], labels))
+        if not parts or not sum(len(part[0]) for part in parts):
+            return None
+        return dict(zip(ARRAYS, (numpy.concatenate(arrays) for arrays in zip(*parts))))
+
+    def update(self, archive, results_directory, max_workers=None, chunk_size=4096):
+        """
+        Add molecules with results in results_directory and not in the store yet.
+
+        Only these molecules are parsed and featurized, from archive (a QM9
+        tar archive or pack). Molecules already in the store get the labels
+        of their latest results: chunks with other labels are rewritten.
+        Returns the number of the new version, or of the latest one if
+        nothing changed.
+        """
+        results = latest_results(load_results(results_directory))
+        labelled = numpy.ones(len(results["file_id"]), dtype=bool)
+        for name in self.label_names:
+            labelled &= numpy.isfinite(results[name])
+        candidates = results["file_id"][labelled]
+        chunk = None
+        relabelled = dict()
+        while True:
+            parent = self.manifest()
+            known = self.file_ids(parent["version"])
+            if chunk is not None and numpy.isin(chunk["ids"], known).any():
+                # Another writer added some of them: start again
+                chunk = None
+            if chunk is None:
+                chunk = {"entry": None, "ids": numpy.empty(0, dtype=numpy.int64)}
+                new_ids = numpy.setdiff1d(candidates, known)
+                if len(new_ids):
+                    logging.info("Featurizing %d new molecules", len(new_ids))
+                    arrays = self.featurize(archive, new_ids, results, max_workers, chunk_size)
+                    if arrays is not None:
+                        chunk = {"entry": self._write_chunk(arrays), "ids": arrays["file_id"]}
+            chunks = list()
+            changed = 0
+            for entry in parent["chunks"]:
+                if entry["name"] not in relabelled:
+                    relabelled[entry["name"]] = self._relabel(entry, results)
+                new_entry, rows = relabelled[entry["name"]]
+                chunks.append(new_entry)
+                changed += rows
+            if chunk["entry"] is not None:
+                chunks.append(chunk["entry"])
+            if chunks == parent["chunks"]:
+                return parent["version"]
+            added = chunk["entry"]["rows"] if chunk["entry"] is not None else 0
+            version = self._commit(parent, chunks, "update: {} molecules, {} relabelled".format(
+                added, changed
+            ))
+            if version is not None:
+                return version
+
+    def _relabel(self, entry, results):
+        """
+        Chunk (manifest entry) with the labels of results, and its number of changed rows.
+
+        The chunk is rewritten if labels changed, and returned as is otherwise.
+        Molecules without all labels in results keep theirs.
+        """
+        arrays = self._load_chunk(entry["name"])
+        rows, labels = energy_labels(arrays["file_id"], results, self.label_names)
+        changed = (arrays["labels"][rows] != labels).any(axis=1)
+        if not changed.any():
+            return entry, 0
+        arrays = {array: numpy.array(values) for array, values in arrays.items()}
+        arrays["labels"][rows] = labels
+        return self._write_chunk(arrays), int(changed.sum())
+
+    def compact(self, min_rows=COMPACT_ROWS):
+        """
+        Merge consecutive chunks of less than min_rows rows, in a new version.
+
+        Rows keep their order. Returns the number of the new version, or of
+        the latest one if there was nothing to merge.
+        """
+        merged = dict()
+        while True:
+            parent = self.manifest()
+            chunks = list()
+            run = list()
+            for chunk in parent["chunks"] + [None]:
+                if chunk is not None and chunk["rows"] < min_rows:
+                    run.append(chunk)
+                    continue
+                if len(run) > 1:
+                    names = tuple(small["name"] for small in run)
+                    if names not in merged:
+                        merged[names] = self._write_chunk(dict(zip(
+                            ARRAYS, self._concatenate(run, ARRAYS)
+                        )))
+                    chunks.append(merged[names])
+                else:
+                    chunks.extend(run)
+                run = list()
+                if chunk is not None:
+                    chunks.append(chunk)
+            if len(chunks) == len(parent["chunks"]):
+                return parent["version"]
+            version = self._commit(parent, chunks, "compaction")
+            if version is not None:
+                return version
+
+    def start_compaction(self, min_rows=COMPACT_ROWS):
+        """Run compact in a background thread, return the started thread"""
+        thread = threading.Thread(
+            target=self.compact, args=(min_rows,), name="compaction", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def prune(self, keep=1, grace=PRUNE_GRACE):
+        """
+        Remove all but the keep latest versions, and chunks in none of the remaining ones.
+
+        Chunks written less than grace seconds ago are kept: they may belong
+        to a version being committed.
+        """
+        versions = self.versions()
+        for version in versions[:-keep] if keep > 0 else versions:
+            os.remove(self._version_path(version))
+        used = set()
+        for version in self.versions():
+            used.update(chunk["name"] for chunk in self.manifest(version)["chunks"])
+        now = time.time()
+        with os.scandir(os.path.join(self.directory, "chunks")) as entries:
+            for entry in entries:
+                if entry.name in used or now - entry.stat().st_mtime < grace:
+                    continue
+                logging.info("Removing chunk %s", entry.name)
+                shutil.rmtree(entry.path, ignore_errors=True)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Geometric descriptors of whole batches of molecules, computed on padded arrays"""
+
+import os
+import shutil
+from functools import partial
+import numpy
+from chemlearning_data.chemlearning_data import chunk_qm9_archive, parse_chunks, parse_xyz_members
+from chemlearning_data.graph_features import QM9_MAX_ATOMS, molecule_indices
+from chemlearning_data.result_store import list_chunks
+
+DESCRIPTORS = ("distance", "coulomb", "eigenvalues", "bag_of_bonds")
+
+# Largest number of atoms of each element in a QM9 molecule, which sets bag sizes
+QM9_MAX_ELEMENT_COUNTS = {1: 20, 6: 9, 7: 7, 8: 5, 9: 6}
+
+
+def pad_batch(batch, max_atoms=QM9_MAX_ATOMS):
+    """
+    Padded arrays of a MoleculeBatch.
+
+    Returns coordinates (float64 (n, max_atoms, 3)) and nuclear charges
+    (float64 (n, max_atoms)), both 0 for padding atoms.
+    """
+    natoms = batch.natoms
+    if len(batch) and natoms.max() > max_atoms:
+        raise ValueError("Molecules larger than max_atoms: " + str(natoms.max()))
+    molecules = molecule_indices(batch.offsets)
+    local = numpy.arange(len(batch.elements)) - batch.offsets[molecules]
+    coordinates = numpy.zeros((len(batch), max_atoms, 3), dtype=numpy.float64)
+    coordinates[molecules, local] = batch.coordinates
+    charges = numpy.zeros((len(batch), max_atoms), dtype=numpy.float64)
+    charges[molecules, local] = batch.elements
+    return coordinates, charges
+
+
+def distance_matrices(coordinates, charges):
+    """Interatomic distances (n, max_atoms, max_atoms), 0 for padding atoms"""
+    # One axis at a time: no (n, max_atoms, max_atoms, 3) temporary array
+    distances = numpy.zeros(coordinates.shape[:2] + coordinates.shape[1:2])
+    for axis in range(3):
+        values = coordinates[:, :, axis]
+        delta = values[:, :, None] - values[:, None, :]
+        distances += delta * delta
+    numpy.sqrt(distances, out=distances)
+    real = charges > 0
+    distances *= real[:, :, None] & real[:, None, :]
+    return distances
+
+
+def coulomb_matrices(coordinates, charges, distances=None):
+    """
+    Coulomb matrices (n, max_atoms, max_atoms), 0 for padding atoms.
+
+    Off diagonal terms are Zi Zj / |Ri - Rj|, diagonal terms 0.5 Zi ** 2.4.
+    """
+    if distances is None:
+        distances = distance_matrices(coordinates, charges)
+    products = charges[:, :, None] * charges[:, None, :]
+    matrices = numpy.divide(products, distances, out=numpy.zeros_like(products),
+                            where=distances > 0)
+    diagonal = numpy.arange(charges.shape[1])
+    matrices[:, diagonal, diagonal] = 0.5 * charges ** 2.4
+    return matrices
+
+
+def coulomb_eigenvalues(matrices):
+    """Eigenvalues of Coulomb matrices, by decreasing absolute value (n, max_atoms)"""
+    eigenvalues = numpy.linalg.eigvalsh(matrices)
+    order = numpy.argsort(-numpy.abs(eigenvalues), axis=1, kind="stable")
+    return numpy.take_along_axis(eigenvalues, order, axis=1)
+
+
+def bag_layout(max_counts=None):
+    """
+    Bags of a bag of bonds vector: list of (Za, Zb, size), in the order of columns.
+
+    There is one bag per element, for diagonal Coulomb terms, with Zb = 0,
+    and one per pair of elements, sized for the largest possible molecule
+    given max_counts (element to maximum number of atoms, QM9 by default).
+    """
+    max_counts = max_counts or QM9_MAX_ELEMENT_COUNTS
+    elements = sorted(max_counts)
+    bags = [(element, 0, max_counts[element]) for element in elements]
+    for a, element_a in enumerate(elements):
+        for element_b in elements[a:]:
+            if element_a == element_b:
+                size = max_counts[element_a] * (max_counts[element_a] - 1) // 2
+            else:
+                size = max_counts[element_a] * max_counts[element_b]
+            if size:
+                bags.append((element_a, element_b, size))
+    return bags
+
+
+def bag_of_bonds(matrices, charges, max_counts=None):
+    """
+    Bag of bonds vectors (n, total bag size) from Coulomb matrices.
+
+    Coulomb terms are grouped by element (diagonal) or pair of elements (off
+    diagonal), each group sorted by decreasing value and padded with zeros
+    to the size of its bag (see bag_layout). All molecules are sorted at
+    once, with a single lexsort over (molecule, bag, value).
+    """
+    bags = bag_layout(max_counts)
+    sizes = numpy.array([size for _, _, size in bags], dtype=numpy.int64)
+    starts = numpy.cumsum(sizes) - sizes
+    # Bag index of every (Zi, Zj) pair, -1 for unknown elements and padding
+    bag_index = numpy.full((119, 119), -1, dtype=numpy.int64)
+    diagonal_index = numpy.full(119, -1, dtype=numpy.int64)
+    for index, (element_a, element_b, _) in enumerate(bags):
+        if element_b == 0:
+            diagonal_index[element_a] = index
+        else:
+            bag_index[element_a, element_b] = bag_index[element_b, element_a] = index
+
+    atomic_numbers = charges.astype(numpy.int64)
+    upper_i, upper_j = numpy.triu_indices(charges.shape[1], k=1)
+    pair_bags = bag_index[atomic_numbers[:, upper_i], atomic_numbers[:, upper_j]]
+    pair_values = matrices[:, upper_i, upper_j]
+    self_bags = diagonal_index[atomic_numbers]
+    self_bags[atomic_numbers == 0] = -1
+    self_values = numpy.diagonal(matrices, axis1=1, axis2=2)
+
+    all_bags = numpy.concatenate([self_bags, pair_bags], axis=1)
+    all_values = numpy.concatenate([self_values, pair_values], axis=1)
+    if numpy.any((all_bags < 0) & (all_values != 0)):
+        raise ValueError("Element not in bag layout")
+    molecules, columns = numpy.nonzero(all_bags >= 0)
+    bag = all_bags[molecules, columns]
+    values = all_values[molecules, columns]
+
+    # Sort by molecule, bag, then decreasing value; rank of each value in its bag
+    order = numpy.lexsort((-values, bag, molecules))
+    molecules, bag, values = molecules[order], bag[order], values[order]
+    group = molecules * len(bags) + bag
+    positions = numpy.arange(len(group))
+    new_group = numpy.r_[True, group[1:] != group[:-1]] if len(group) else positions > 0
+    rank = positions - numpy.maximum.accumulate(numpy.where(new_group, positions, 0))
+    if numpy.any(rank >= sizes[bag]):
+        raise ValueError("Molecule too large for bag layout")
+    vectors = numpy.zeros((matrices.shape[0], sizes.sum()), dtype=numpy.float64)
+    vectors[molecules, starts[bag] + rank] = values
+    return vectors
+
+
+def compute_descriptors(batch, names=DESCRIPTORS, max_atoms=QM9_MAX_ATOMS, max_counts=None):
+    """Descriptors of all molecules of a MoleculeBatch, as a dict of name to array"""
+    unknown = set(names) - set(DESCRIPTORS)
+    if unknown:
+        raise ValueError("Unknown descriptors: " + ", ".join(sorted(unknown)))
+    coordinates, charges = pad_batch(batch, max_atoms)
+    distances = distance_matrices(coordinates, charges)
+    descriptors = dict()
+    if "distance" in names:
+        descriptors["distance"] = distances
+    if set(names) & {"coulomb", "eigenvalues", "bag_of_bonds"}:
+        matrices = coulomb_matrices(coordinates, charges, distances)
+        if "coulomb" in names:
+            descriptors["coulomb"] = matrices
+        if "eigenvalues" in names:
+            descriptors["eigenvalues"] = coulomb_eigenvalues(matrices)
+        if "bag_of_bonds" in names:
+            descriptors["bag_of_bonds"] = bag_of_bonds(matrices, charges, max_counts)
+    return descriptors
+
+
+def descriptor_chunk(members, names=DESCRIPTORS, max_atoms=QM9_MAX_ATOMS):
+    """
+    Parse a chunk of xyz files and compute their descriptors.
+
+    Used by worker processes; returns a dict of name to array, with file ids
+    as integers under "file_id".
+    """
+    batch, _ = parse_xyz_members(members)
+    descriptors = compute_descriptors(batch, names, max_atoms)
+    descriptors["file_id"] = numpy.array([int(file_id) for file_id in batch.file_ids],
+                                         dtype=numpy.int64)
+    return descriptors
+
+
+def write_descriptors(archive, directory, names=DESCRIPTORS, max_workers=None,
+                      chunk_size=4096):
+    """
+    Compute descriptors of all molecules of a QM9 archive, streamed to disk.
+
+    Chunks are computed in max_workers processes (see parse_chunks) and
+    written as they come, as chunk_NNNNNN folders of one .npy file per
+    descriptor, under a temporary name then renamed.
+    Returns the number of molecules written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    parser = partial(descriptor_chunk, names=tuple(names))
+    count = 0
+    chunks = chunk_qm9_archive(archive, chunk_size)
+    for index, descriptors in enumerate(parse_chunks(chunks, parser, max_workers=max_workers)):
+        name = "chunk_" + str(index).zfill(6)
+        tmp_path = os.path.join(directory, "." + name + ".tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for descriptor, array in descriptors.items():
+            numpy.save(os.path.join(tmp_path, descriptor + ".npy"), array)
+        os.replace(tmp_path, os.path.join(directory, name))
+        count += len(descriptors["file_id"])
+    return count
+
+
+def iter_descriptors(directory, names=DESCRIPTORS, mmap_mode="r"):
+    """Yield every chunk written by write_descriptors as a dict of name to array"""
+    for chunk in list_chunks(directory):
+        yield {
+            name: numpy.load(os.path.join(chunk, name + ".npy"), mmap_mode=mmap_mode)
+            for name in ("file_id",) + tuple(names)
+        }
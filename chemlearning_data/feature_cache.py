@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""On-disk cache of preprocessed datasets, as uncompressed memory-mappable arrays"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import numpy
+
+# Bumped whenever the layout of cache entries changes
+CACHE_FORMAT = 1
+
+
+def file_hash(path, block_size=1024 ** 2):
+    """sha256 of the content of a file, read by blocks"""
+    digest = hashlib.sha256()
+    with open(path, mode="rb") as source:
+        for block in iter(lambda: source.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def feature_key(preprocessor, labels, source_hash, preprocessor_args=None):
+    """
+    Key of a preprocessed dataset: preprocessor, its arguments, labels and source data.
+
+    labels is a label name or a list of them; their order matters, as it is
+    the order of columns of the label array.
+    """
+    if isinstance(labels, str):
+        labels = [labels]
+    description = {
+        "format": CACHE_FORMAT,
+        "preprocessor": preprocessor,
+        "preprocessor_args": preprocessor_args or dict(),
+        "labels": list(labels) if labels is not None else None,
+        "source": source_hash,
+    }
+    serialized = json.dumps(description, sort_keys=True)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()[:32]
+
+
+class RaggedArray:
+    """
+    Array of arrays of different shapes, stored as one flat array (CSR layout).
+
+    Item i is values[offsets[i]:offsets[i + 1]] reshaped to shapes[i]. Indexing
+    with an int gives a view of values, indexing with a slice or an array of
+    indices gives an object array of views, as for numpy object arrays.
+
+    Attributes:
+        - values (items concatenated and flattened, numpy array)
+        - offsets (index in values of the first element of each item, int64 array (n + 1,))
+        - shapes (shape of each item, int64 array (n, ndim))
+
+    """
+
+    __slots__ = ("values", "offsets", "shapes")
+
+    def __init__(self, values, offsets, shapes):
+        """Build the RaggedArray class from already packed arrays."""
+        self.values = values
+        self.offsets = offsets
+        self.shapes = shapes
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Pack a sequence of arrays with the same dtype and number of dimensions"""
+        arrays = [numpy.asarray(array) for array in arrays]
+        ndim = arrays[0].ndim if arrays else 1
+        shapes = numpy.array([array.shape for array in arrays], dtype=numpy.int64)
+        shapes = shapes.reshape(len(arrays), ndim)
+        offsets = numpy.zeros(len(arrays) + 1, dtype=numpy.int64)
+        numpy.cumsum([array.size for array in arrays], out=offsets[1:])
+        if not arrays:
+            return cls(numpy.empty(0), offsets, shapes)
+        return cls(numpy.concatenate([array.ravel() for array in arrays]), offsets, shapes)
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, numpy.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("RaggedArray index out of range")
+            item = self.values[self.offsets[index]:self.offsets[index + 1]]
+            return item.reshape(tuple(self.shapes[index]))
+        indices = numpy.arange(len(self))[index]
+        items = numpy.empty(len(indices), dtype=object)
+        for i, item_index in enumerate(indices.tolist()):
+            items[i] = self[item_index]
+        return items
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+class FeatureCache:
+    """
+    Cache of preprocessed datasets, each a tuple of arrays, stored by key.
+
+    Every array is an uncompressed .npy file, so that loading is only
+    opening files: arrays are memory-mapped, and data is read from disk as
+    it is used. Arrays of objects (one array per molecule, of varying size,
+    as given by preprocessors without padding) are stored as RaggedArray.
+    Entries are written under a temporary name and renamed once complete.
+
+    Attributes:
+        - directory (root of the cache, str)
+        - mmap_mode (numpy.load mmap_mode of loaded arrays, None to read them in memory)
+
+    """
+
+    def __init__(self, directory, mmap_mode="r"):
+        """Open the cache, creating its directory if necessary."""
+        self.directory = directory
+        self.mmap_mode = mmap_mode
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        """Folder of an entry"""
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        return os.path.isfile(os.path.join(self._path(key), "index.json"))
+
+    def load(self, key):
+        """Tuple of arrays stored for key, or None"""
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, "index.json"), mode="r") as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            return None
+        logging.info("Loading preprocessed dataset %s", key)
+        arrays = list()
+        for i, kind in enumerate(index["arrays"]):
+            if kind == "ragged":
+                arrays.append(RaggedArray(*[
+                    self._load_array(path, str(i) + "_" + part)
+                    for part in ("values", "offsets", "shapes")
+                ]))
+            else:
+                arrays.append(self._load_array(path, str(i)))
+        return tuple(arrays)
+
+    def _load_array(self, path, name):
+        """Load a single array of an entry"""
+        return numpy.load(os.path.join(path, name + ".npy"), mmap_mode=self.mmap_mode)
+
+    def save(self, key, arrays):
+        """Store a tuple of arrays for key, return them as loaded from the cache"""
+        path = self._path(key)
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        index = {"arrays": list()}
+        for i, array in enumerate(arrays):
+            if not isinstance(array, RaggedArray):
+                array = numpy.asarray(array)
+                if array.dtype == object:
+                    array = RaggedArray.from_arrays(array)
+            if isinstance(array, RaggedArray):
+                for part in ("values", "offsets", "shapes"):
+                    numpy.save(os.path.join(tmp_path, str(i) + "_" + part + ".npy"),
+                               getattr(array, part))
+                index["arrays"].append("ragged")
+            else:
+                numpy.save(os.path.join(tmp_path, str(i) + ".npy"), array)
+                index["arrays"].append("array")
+        # Index last: an entry is complete once it has one
+        with open(os.path.join(tmp_path, "index.json"), mode="w") as index_file:
+            json.dump(index, index_file)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        logging.info("Stored preprocessed dataset %s", key)
+        return self.load(key)
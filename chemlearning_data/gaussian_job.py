@@ -3,11 +3,115 @@
 # Copyright (c) 2019, E. Nicolas
 
 """Gaussian Job class to start job, run it and analyze it"""
+import asyncio
 import logging
 import os
 import shutil
-from cclib.io import ccread
-from cclib.parser.utils import PeriodicTable
+import signal
+import subprocess
+import time
+from functools import lru_cache
+from chemlearning_data.gaussian_log import parse_gaussian_log, parse_gaussian_log_steps
+from chemlearning_data.molecule import MoleculeBatch, element_symbols
+from chemlearning_data.profiling import timed_stage
+
+# Seconds between two checks of the stop file of a running job
+STOP_POLL_INTERVAL = 1.0
+
+
+class JobStopped(Exception):
+    """A Gaussian job killed because its stop file was created (see GaussianJob.run)"""
+
+
+def wait_process(process, timeout=None, stop_file=None):
+    """
+    Wait for a subprocess.Popen, return its return code.
+
+    Raises subprocess.TimeoutExpired after timeout seconds, if given, and
+    JobStopped once stop_file exists, if given; the process is left running.
+    """
+    if stop_file is None:
+        return process.wait(timeout=timeout)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        poll = STOP_POLL_INTERVAL
+        if deadline is not None:
+            poll = max(0.0, min(poll, deadline - time.monotonic()))
+        try:
+            return process.wait(timeout=poll)
+        except subprocess.TimeoutExpired:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(process.args, timeout) from None
+        if os.path.exists(stop_file):
+            raise JobStopped(stop_file)
+
+
+def freeze_arguments(gaussian_args):
+    """Hashable version of gaussian_args, used as a cache key"""
+    return tuple(sorted(gaussian_args.items()))
+
+
+@lru_cache(maxsize=None)
+def build_route_section(frozen_args):
+    """
+    Builds the part of the header that only depends on gaussian_args.
+
+    Rendered once per set of arguments, given as returned by freeze_arguments.
+    """
+    gaussian_args = dict(frozen_args)
+    route_section = list()
+    route_section.append("%NProcShared=" + str(gaussian_args.get("nprocshared", 1)))
+    # route_section.append('%Mem=' + args['memory'])
+    route = "# " + gaussian_args["functional"] + " "
+    if gaussian_args["dispersion"] is not None:
+        route += "EmpiricalDispersion=" + gaussian_args["dispersion"] + " "
+    if gaussian_args.get("scf") is not None:
+        route += "SCF=(" + gaussian_args["scf"] + ") "
+    route += "gen freq"
+    route_section.append(route)
+    route_section.append("")
+    logging.debug("Route section: \n %s", "\n".join(route_section))
+    return tuple(route_section)
+
+
+@lru_cache(maxsize=None)
+def build_basis_section(elements, basisset):
+    """
+    Builds the basis set specification, for a tuple of atomic numbers.
+
+    Rendered once per combination of elements and basis set.
+    """
+    basis_section = list()
+    # Basis set is the same for all elements. No ECP either.
+    symbols = element_symbols()
+    basis_section.append(" ".join([symbols[el] for el in elements]) + " 0")
+    basis_section.append(basisset)
+    basis_section.append("****")
+    basis_section.append("")
+    logging.debug("Basis section: \n %s", "\n".join(basis_section))
+    return tuple(basis_section)
+
+
+def build_input_scripts(jobs):
+    """
+    Build input files of many jobs in one call.
+
+    Geometries of all molecules are rendered at once, headers and footers come
+    from the caches. Returns a list of strings, ready to be written.
+    """
+    jobs = list(jobs)
+    batch = MoleculeBatch.from_molecules([job.molecule for job in jobs])
+    return [
+        "\n".join(job.build_input_script(geometry))
+        for job, geometry in zip(jobs, batch.xyz_geometries())
+    ]
+
+
+def setup_computations(jobs):
+    """Set many computations up at once, as GaussianJob.setup_computation does"""
+    jobs = list(jobs)
+    for job, input_script in zip(jobs, build_input_scripts(jobs)):
+        job.setup_computation(input_script)
 
 
 class GaussianJob:
@@ -25,10 +129,14 @@ class GaussianJob:
                                output, (file_name.log, str)
                     )
         - input_script (input file, list of strings)
+        - workspace (pool of job directories, Workspace or None)
+        - fs_time (seconds spent creating, writing and removing job files, float)
+        - timer (wall time of setup, run, parse and cleanup stages, StageTimer or None)
 
     """
 
-    def __init__(self, basedir, name, molecule, job_id, gaussian_args):
+    def __init__(self, basedir, name, molecule, job_id, gaussian_args, workspace=None,
+                 timer=None):
         """Build  the GaussianJob class."""
         # Populate the class attributes
         self._name = name
@@ -39,17 +147,36 @@ class GaussianJob:
         self.filenames["input"] = self.name.replace(" ", "_") + ".com"
         self.filenames["output"] = self.name.replace(" ", "_") + ".log"
         self._gaussian_args = gaussian_args
+        self._log_data = None
+        self.workspace = workspace
+        self.fs_time = 0.0
+        self.timer = timer
+        self._workdir = None
 
     @property
     def path(self):
         """
         Computation path, calculated at will as: /basedir/my_name.00job_id/
+
+        With a workspace, the directory acquired from it once set up.
         """
+        if self._workdir is not None:
+            return self._workdir
         path = os.path.join(
             self.basedir, self.name.replace(" ", "_") + "." + str(self.job_id).zfill(8)
         )
         return path
 
+    @property
+    def input_path(self):
+        """Absolute path to the input file"""
+        return os.path.abspath(os.path.join(self.path, self.filenames["input"]))
+
+    @property
+    def output_path(self):
+        """Absolute path to the output file"""
+        return os.path.abspath(os.path.join(self.path, self.filenames["output"]))
+
     @property
     def molecule(self):
         """Molecule specification (coords, natoms, etc)"""
@@ -103,6 +230,8 @@ class GaussianJob:
             - Functional
             - Dispersion or not ?
             - Basis set (One for all atoms. Choose wisely !)
+            - nprocshared (optional, cores used by each job, 1 by default)
+            - scf (optional, SCF options such as "XQC", none by default)
         """
         return self._gaussian_args
 
@@ -110,62 +239,103 @@ class GaussianJob:
     def gaussian_args(self, value):
         self._gaussian_args = value
 
-    def run(self):
-        """Start the job."""
+    @timed_stage("run")
+    def run(self, timeout=None, stop_file=None):
+        """
+        Start the job.
+
+        With a timeout, in seconds, g16 and all the processes it started are
+        killed if it runs longer, and subprocess.TimeoutExpired is raised.
+        With a stop_file, they are killed as soon as that file exists, checked
+        every STOP_POLL_INTERVAL seconds, and JobStopped is raised.
+        """
         # Log computation start
         logging.info("Starting Gaussian: %s", str(self.name))
-        # Get into workdir, start gaussian, then back to basedir
-        os.chdir(self.path)
-        os.system("g16 < " + self.filenames["input"] + " > " + self.filenames["output"])
-        os.chdir(self.basedir)
+        self._log_data = None
+        # Start gaussian in workdir. The working directory of the process is untouched,
+        # so that many jobs can run at the same time from threads.
+        # g16 gets its own process group, to be killed with the link executables it starts.
+        with open(self.input_path, mode="r") as input_file:
+            with open(self.output_path, mode="w") as output_file:
+                process = subprocess.Popen(
+                    ["g16"], stdin=input_file, stdout=output_file, cwd=self.path,
+                    start_new_session=True,
+                )
+                try:
+                    returncode = wait_process(process, timeout, stop_file)
+                except BaseException as error:
+                    # Timeout, stop, or interrupted: signals to this process do not reach g16
+                    if isinstance(error, subprocess.TimeoutExpired):
+                        logging.warning("Gaussian killed after %.0f s: %s", timeout,
+                                        str(self.name))
+                    elif isinstance(error, JobStopped):
+                        logging.info("Gaussian stopped: %s", str(self.name))
+                    os.killpg(process.pid, signal.SIGKILL)
+                    process.wait()
+                    raise
+        if returncode != 0:
+            logging.warning("Gaussian returned %d: %s", returncode, str(self.name))
         # Log end of computation
         logging.info("Gaussian finished: %s", str(self.name))
         return
 
+    @timed_stage("run")
+    async def run_async(self, timeout=None):
+        """
+        Start the job from an asyncio event loop, without blocking it; return the g16 return code.
+
+        As with run, g16 gets its own process group, killed with all the
+        processes it started after timeout seconds, if given, raising
+        subprocess.TimeoutExpired, or when the coroutine is cancelled.
+        """
+        logging.info("Starting Gaussian: %s", str(self.name))
+        self._log_data = None
+        with open(self.input_path, mode="r") as input_file:
+            with open(self.output_path, mode="w") as output_file:
+                process = await asyncio.create_subprocess_exec(
+                    "g16", stdin=input_file, stdout=output_file, cwd=self.path,
+                    start_new_session=True,
+                )
+                try:
+                    returncode = await asyncio.wait_for(process.wait(), timeout)
+                except BaseException as error:
+                    # Timeout, or cancelled: cancelling the coroutine does not stop g16
+                    try:
+                        os.killpg(process.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                    await process.wait()
+                    if isinstance(error, asyncio.TimeoutError):
+                        logging.warning("Gaussian killed after %.0f s: %s", timeout,
+                                        str(self.name))
+                        raise subprocess.TimeoutExpired(["g16"], timeout) from None
+                    raise
+        if returncode != 0:
+            logging.warning("Gaussian returned %d: %s", returncode, str(self.name))
+        logging.info("Gaussian finished: %s", str(self.name))
+        return returncode
+
+    @timed_stage("parse")
+    def parse_output(self):
+        """
+        Parse the output file once, return a GaussianLogData.
+
+        The result is kept until the job is run again, so that energies,
+        coordinates and charges all come from a single pass over the file.
+        """
+        if self._log_data is None:
+            logging.debug("Parsing output of job %s", str(self.job_id))
+            self._log_data = parse_gaussian_log(self.output_path)
+        return self._log_data
+
     def extract_natural_charges(self):
         """Extract NBO Charges parsing the output file."""
         # Log start
         logging.info("Parsing results from computation %s", str(self.job_id))
-
-        # Get into working directory
-        os.chdir(self.path)
-
-        # Initialize charges list
-        charges = []
-
-        with open(self.filenames["output"], mode="r") as out_file:
-            line = "Foobar line"
-            while line:
-                line = out_file.readline()
-                if "Summary of Natural Population Analysis:" in line:
-                    logging.debug("ID %s: Found NPA table.", str(self.job_id))
-                    # We have the table we want for the charges
-                    # Read five lines to remove the header:
-                    # Summary of Natural Population Analysis:
-                    #
-                    # Natural Population
-                    # Natural    ---------------------------------------------
-                    # Atom No    Charge        Core      Valence    Rydberg      Total
-                    # ----------------------------------------------------------------
-                    for _ in range(0, 5):
-                        out_file.readline()
-                    # Then we read the actual table:
-                    for _ in range(0, self.molecule.natoms):
-                        # Each line follow the header with the form:
-                        # C  1    0.92349      1.99948     3.03282    0.04422     5.07651
-                        line = out_file.readline()
-                        line = line.split()
-                        charges.append(line[2])
-                    logging.debug(
-                        "ID %s: Charges = %s",
-                        str(self.job_id),
-                        " ".join([str(i) for i in charges]),
-                    )
-                    # We have reached the end of the table, we can break the while loop
-                    break
-                # End of if 'Summary of Natural Population Analysis:'
-        # Get back to the base directory
-        os.chdir(self.basedir)
+        charges = self.parse_output().natural_charges
+        logging.debug(
+            "ID %s: Charges = %s", str(self.job_id), " ".join([str(i) for i in charges])
+        )
         return charges
 
     def get_coordinates(self):
@@ -173,32 +343,32 @@ class GaussianJob:
         # Log start
         logging.info("Extracting coordinates for job %s", str(self.job_id))
 
-        # Get into working directory
-        os.chdir(self.path)
-
-        # Parse file with cclib
-        data = ccread(self.filenames["output"], loglevel=logging.WARNING)
-
-        #  Return the first coordinates, since it is a single point
-        return data.atomcoords[0]
+        #  Return the final coordinates, the only ones for a single point
+        return self.parse_output().atomcoords
 
-    def setup_computation(self):
+    @timed_stage("setup")
+    def setup_computation(self, input_script=None):
         """
         Set computation up before running it.
 
-        Create working directory, write input file
+        Create working directory, or take one from the workspace, write input
+        file. The input file content can be given, if already built (see
+        build_input_scripts).
         """
+        if input_script is None:
+            input_script = "\n".join(self.build_input_script())
+        start = time.perf_counter()
         # Create working directory
-        os.makedirs(self.path, mode=0o777, exist_ok=True)
+        if self.workspace is not None:
+            self._workdir = self.workspace.acquire()
+        else:
+            os.makedirs(self.path, mode=0o777, exist_ok=True)
         logging.info("Created directory %s", self.path)
-        # Go into working directory
-        os.chdir(self.path)
         # Write input file
-        with open(self.filenames["input"], mode="w") as input_file:
-            input_file.write("\n".join(self.build_input_script()))
-        logging.debug("Wrote file %s", self.filenames["input"])
-        # Get back to base directory
-        os.chdir(self.basedir)
+        with open(self.input_path, mode="w") as input_file:
+            input_file.write(input_script)
+        logging.debug("Wrote file %s", self.input_path)
+        self.fs_time += time.perf_counter() - start
 
     def get_energies(self):
         """
@@ -209,18 +379,10 @@ class GaussianJob:
         # Log start
         logging.info("Extracting energies from %s", self.name)
 
-        # Get into working directory
-        os.chdir(self.path)
-
-        # Parse file with cclib
-        data = ccread(self.filenames["output"], loglevel=logging.WARNING)
-
         #  Return the parsed energies as a dictionary
-        energies = dict.fromkeys(["scfenergy", "enthalpy", "freeenergy"])
-        energies["scfenergy"] = data.scfenergies[-1]
-        energies["enthalpy"] = data.enthalpy
-        energies["freeenergy"] = data.freeenergy
-
+        energies = self.parse_output().energies
+        if energies["scfenergy"] is None:
+            raise ValueError("No SCF energy found in " + self.output_path)
         return energies
 
     def build_header(self):
@@ -229,22 +391,12 @@ class GaussianJob:
 
         List of strings expected
         """
-        header = list()
-        header.append("%NProcShared=1")
-        # header.append('%Mem=' + args['memory'])
-        route = "# " + self.gaussian_args["functional"] + " "
-        if self.gaussian_args["dispersion"] is not None:
-            route += "EmpiricalDispersion=" + self.gaussian_args["dispersion"] + " "
-        route += "gen freq"
-        header.append(route)
-        header.append("")
+        header = list(build_route_section(freeze_arguments(self.gaussian_args)))
         # To update probably
         header.append(self.name)
         header.append("")
         # This is a singlet. Careful for other systems!
         header.append("0 1")
-
-        logging.debug("Header: \n %s", "\n".join(header))
         return header
 
     def build_footer(self):
@@ -253,19 +405,9 @@ class GaussianJob:
 
             List of strings.
             """
-        footer = []
-
-        # Basis set is the same for all elements. No ECP either.
-        # Remove duplicates, and convert to element name
-        periodic_table = PeriodicTable()
-        elements = [periodic_table.element[el] for el in list(set(self.molecule.elements_list))]
-
-        elements = " ".join(elements)
-        basisset = self.gaussian_args["basisset"]
-        footer.append(elements + " 0")
-        footer.append(basisset)
-        footer.append("****")
-        footer.append("")
+        # Remove duplicates, the basis set is then the same for all elements
+        elements = tuple(set(self.molecule.elements_list.tolist()))
+        footer = list(build_basis_section(elements, self.gaussian_args["basisset"]))
 
         # footer.append("$NBO")
         # # NBO_FILES should be updated to something more useful
@@ -273,17 +415,22 @@ class GaussianJob:
         # footer.append("PLOT")
         # footer.append("$END")
 
-        logging.debug("Footer: \n %s", "\n".join(footer))
         return footer
 
-    def build_input_script(self):
-        """Build full input script"""
+    def build_input_script(self, geometry=None):
+        """
+        Build full input script.
+
+        The geometry can be given, if already rendered (see build_input_scripts).
+        """
         script = []
         # Put header
         script.extend(self.header)
 
         # Add geometry + blank line
-        script.extend(self.molecule.xyz_geometry())
+        if geometry is None:
+            geometry = self.molecule.xyz_geometry()
+        script.extend(geometry)
         script.append("")
 
         # Add footer
@@ -295,8 +442,86 @@ class GaussianJob:
 
         return script
 
+    @timed_stage("cleanup")
     def cleanup(self):
-        """Removing folders and files once everything is run and extracted"""
-        logging.info("Removing directory: %s", str(self.path))
-        shutil.rmtree(self.path)
+        """
+        Removing folders and files once everything is run and extracted
+
+        With a workspace, the directory is given back to it instead, and the
+        output file kept if the workspace is set to.
+        """
+        start = time.perf_counter()
+        if self.workspace is not None and self._workdir is not None:
+            logging.info("Releasing directory: %s", str(self.path))
+            self.workspace.release(self._workdir, log_path=self.output_path)
+            self._workdir = None
+        else:
+            logging.info("Removing directory: %s", str(self.path))
+            shutil.rmtree(self.path)
+        self.fs_time += time.perf_counter() - start
+        logging.debug("Filesystem time for %s: %.6f s", str(self.name), self.fs_time)
         return
+
+
+class LinkedGaussianJob(GaussianJob):
+    """
+    Several Gaussian computations run by a single g16 process.
+
+    The input files of all steps are chained with --Link1--, so that the g16
+    start-up and the job directory are paid for once, and the output is split
+    back into one result per step.
+
+    Attributes (in addition to those of GaussianJob):
+        - steps (computations to chain, list of GaussianJob)
+
+    """
+
+    def __init__(self, basedir, name, steps, job_id, workspace=None, timer=None):
+        """Build the LinkedGaussianJob class."""
+        steps = list(steps)
+        super().__init__(
+            basedir, name, None, job_id, steps[0].gaussian_args, workspace=workspace,
+            timer=timer,
+        )
+        self.steps = steps
+
+    def build_input_script(self, geometry=None):
+        """Build full input script: input of each step, separated by --Link1--"""
+        script = []
+        geometries = MoleculeBatch.from_molecules([step.molecule for step in self.steps])
+        for i, (step, step_geometry) in enumerate(
+                zip(self.steps, geometries.xyz_geometries())):
+            if i > 0:
+                script.append("--Link1--")
+            script.extend(step.build_input_script(step_geometry))
+        return script
+
+    @timed_stage("parse")
+    def parse_output(self):
+        """Parse the output file once, return a list of GaussianLogData, one per step"""
+        if self._log_data is None:
+            logging.debug("Parsing output of linked job %s", str(self.job_id))
+            self._log_data = parse_gaussian_log_steps(self.output_path)
+        return self._log_data
+
+    def get_energies(self):
+        """
+        Retrieve energies of every step, as GaussianJob.get_energies does.
+
+        Steps without results (after a failed step) give None.
+        """
+        logging.info("Extracting energies from %s", self.name)
+        energies = [data.energies for data in self.parse_output()]
+        return energies + [None] * (len(self.steps) - len(energies))
+
+    def extract_natural_charges(self):
+        """NBO charges of every step, as a list; None for steps without results"""
+        logging.info("Parsing results from linked computation %s", str(self.job_id))
+        charges = [data.natural_charges for data in self.parse_output()]
+        return charges + [None] * (len(self.steps) - len(charges))
+
+    def get_coordinates(self):
+        """Final coordinates of every step, as a list; None for steps without results"""
+        logging.info("Extracting coordinates for linked job %s", str(self.job_id))
+        coordinates = [data.atomcoords for data in self.parse_output()]
+        return coordinates + [None] * (len(self.steps) - len(coordinates))
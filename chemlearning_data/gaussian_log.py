@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Targeted parser for the few values read from Gaussian output files"""
+
+import mmap
+import re
+from functools import lru_cache
+import numpy
+
+# Patterns are searched in the raw bytes of the whole file, so that the file is
+# scanned in C instead of being parsed line by line. They start with literals,
+# which the regex engine skips to quickly.
+SCF_DONE = re.compile(rb"SCF Done:\s+E\(\S+\)\s+=\s+(\S+)")
+ENTHALPY = re.compile(rb"Sum of electronic and thermal Enthalpies=\s+(\S+)")
+FREE_ENERGY = re.compile(rb"Sum of electronic and thermal Free Energies=\s+(\S+)")
+STANDARD_ORIENTATION = b"Standard orientation:"
+INPUT_ORIENTATION = b"Input orientation:"
+NPA_SUMMARY = b"Summary of Natural Population Analysis:"
+NORMAL_TERMINATION = b"Normal termination of Gaussian"
+TERMINATION = re.compile(rb"(Normal|Error) termination[^\n]*\n?")
+TABLE_SEPARATOR = re.compile(rb"^ -{10,}\s*$", re.MULTILINE)
+
+
+@lru_cache(maxsize=None)
+def hartree_to_ev():
+    """Hartree to eV factor of cclib, imported on first use only"""
+    # pylint: disable=import-outside-toplevel
+    from cclib.parser.utils import convertor
+    return convertor(1.0, "hartree", "eV")
+
+
+def _float(value):
+    """Convert Fortran numbers, such as 1.0D-03"""
+    return float(value.replace(b"D", b"E"))
+
+
+class GaussianLogData:
+    """
+    Values extracted from a Gaussian output file.
+
+    Attributes:
+        - scfenergies (energy of every SCF Done line, in eV as in cclib, list of floats)
+        - enthalpy (sum of electronic and thermal enthalpies, in hartree, float or None)
+        - freeenergy (sum of electronic and thermal free energies, in hartree, float or None)
+        - atomnos (atomic numbers of the last orientation block, numpy int array)
+        - atomcoords (coordinates of the last orientation block, numpy (natoms, 3) array)
+        - natural_charges (charges from the first NPA summary, list of floats)
+        - normal_termination (whether Gaussian ended normally, bool)
+
+    """
+
+    __slots__ = (
+        "scfenergies", "enthalpy", "freeenergy", "atomnos", "atomcoords",
+        "natural_charges", "normal_termination",
+    )
+
+    def __init__(self):
+        """Build an empty GaussianLogData."""
+        self.scfenergies = list()
+        self.enthalpy = None
+        self.freeenergy = None
+        self.atomnos = numpy.empty(0, dtype=numpy.int64)
+        self.atomcoords = numpy.empty((0, 3), dtype=numpy.float64)
+        self.natural_charges = list()
+        self.normal_termination = False
+
+    @property
+    def energies(self):
+        """Energies as returned by GaussianJob.get_energies"""
+        energies = dict.fromkeys(["scfenergy", "enthalpy", "freeenergy"])
+        energies["scfenergy"] = self.scfenergies[-1] if self.scfenergies else None
+        energies["enthalpy"] = self.enthalpy
+        energies["freeenergy"] = self.freeenergy
+        return energies
+
+
+def _table_rows(content, position):
+    """
+    Rows of a table such as the orientation one, starting the search at position.
+
+    Tables are made of a header, a dashed line, rows, and a closing dashed line.
+    Returns the list of rows as lists of fields, empty if the table is truncated.
+    """
+    separators = list()
+    for _ in range(3):
+        separator = TABLE_SEPARATOR.search(content, position)
+        if separator is None:
+            return list()
+        separators.append(separator)
+        position = separator.end()
+    rows = content[separators[1].end():separators[2].start()].split(b"\n")
+    return [row.split() for row in rows if row.strip()]
+
+
+def parse_content(content):
+    """Extract all values from the content of a Gaussian output file (bytes-like)"""
+    data = GaussianLogData()
+
+    factor = hartree_to_ev()
+    data.scfenergies = [_float(match.group(1)) * factor for match in SCF_DONE.finditer(content)]
+    # Thermochemistry comes once, at the end of frequency jobs
+    enthalpy = content.rfind(b"Sum of electronic and thermal Enthalpies=")
+    if enthalpy >= 0:
+        data.enthalpy = _float(ENTHALPY.match(content, enthalpy).group(1))
+    free_energy = content.rfind(b"Sum of electronic and thermal Free Energies=")
+    if free_energy >= 0:
+        data.freeenergy = _float(FREE_ENERGY.match(content, free_energy).group(1))
+
+    # Last geometry: Standard orientation, or Input orientation with nosymm
+    orientation = content.rfind(STANDARD_ORIENTATION)
+    if orientation < 0:
+        orientation = content.rfind(INPUT_ORIENTATION)
+    if orientation >= 0:
+        rows = _table_rows(content, orientation)
+        # Center, Atomic number, Atomic type, X, Y, Z
+        data.atomnos = numpy.array([int(row[1]) for row in rows], dtype=numpy.int64)
+        data.atomcoords = numpy.array([row[3:6] for row in rows], dtype=numpy.float64)
+        data.atomcoords = data.atomcoords.reshape(-1, 3)
+
+    # Natural charges: first NPA summary, table closed by a line of =
+    npa = content.find(NPA_SUMMARY)
+    separator = TABLE_SEPARATOR.search(content, npa) if npa >= 0 else None
+    end = content.find(b" ====", separator.end()) if separator is not None else -1
+    if end >= 0:  # Left out if truncated
+        for row in content[separator.end():end].split(b"\n"):
+            # C  1    0.92349      1.99948     3.03282    0.04422     5.07651
+            fields = row.split()
+            if len(fields) >= 3:
+                data.natural_charges.append(_float(fields[2]))
+
+    data.normal_termination = content.rfind(NORMAL_TERMINATION) >= 0
+    return data
+
+
+def split_steps(content):
+    """
+    Split the output of a multi-step (--Link1--) job into the output of each step.
+
+    Every step ends with a Normal or Error termination line. Gaussian stops
+    at the first failed step, so that later steps are missing from the list.
+    """
+    steps = list()
+    start = 0
+    for match in TERMINATION.finditer(content):
+        steps.append(content[start:match.end()])
+        start = match.end()
+        if match.group(1) == b"Error":
+            break
+    return steps
+
+
+def parse_gaussian_log(path):
+    """Extract all values from a Gaussian output file, memory-mapped"""
+    with open(path, mode="rb") as log_file:
+        try:
+            content = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file: cannot be mapped
+            return GaussianLogData()
+        with content:
+            return parse_content(content)
+
+
+def parse_gaussian_log_steps(path):
+    """Extract all values from each step of a multi-step Gaussian output file"""
+    with open(path, mode="rb") as log_file:
+        content = log_file.read()
+    return [parse_content(step) for step in split_steps(content)]
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Graph features (atom arrays and adjacency matrices) for NFP and other graph networks"""
+
+import numpy
+from chemlearning_data.chemlearning_data import (
+    chunk_qm9_archive,
+    parse_chunks,
+    parse_xyz_members,
+)
+from chemlearning_data.molecule import MoleculeBatch
+from chemlearning_data.result_store import load_results
+
+# Covalent radii in angstrom (Cordero et al., 2008), by atomic number
+COVALENT_RADII = {1: 0.31, 5: 0.84, 6: 0.76, 7: 0.71, 8: 0.66, 9: 0.57,
+                  14: 1.11, 15: 1.07, 16: 1.05, 17: 1.02, 35: 1.20, 53: 1.39}
+DEFAULT_RADIUS = 1.50
+# Two atoms are bonded if closer than the sum of their radii plus this, in angstrom
+BOND_TOLERANCE = 0.4
+
+# Largest QM9 molecules, with and without hydrogens
+QM9_MAX_ATOMS = 29
+QM9_MAX_HEAVY_ATOMS = 9
+
+_RADII = numpy.full(119, DEFAULT_RADIUS, dtype=numpy.float64)
+for _number, _radius in COVALENT_RADII.items():
+    _RADII[_number] = _radius
+
+# Offsets of the 27 cells around (and including) a cell
+_NEIGHBOUR_CELLS = numpy.array(
+    [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)],
+    dtype=numpy.int64,
+)
+
+
+def molecule_indices(offsets):
+    """Index of the molecule of every atom, from MoleculeBatch offsets"""
+    return numpy.repeat(numpy.arange(len(offsets) - 1), numpy.diff(offsets))
+
+
+def _expand_pairs(starts_a, counts_a, starts_b, counts_b):
+    """All (i, j) with i in range(start_a, start_a + count_a), j likewise, for every row"""
+    sizes = counts_a * counts_b
+    owners = numpy.repeat(numpy.arange(len(sizes)), sizes)
+    first = numpy.cumsum(sizes) - sizes
+    local = numpy.arange(sizes.sum()) - first[owners]
+    i = starts_a[owners] + local // counts_b[owners]
+    j = starts_b[owners] + local % counts_b[owners]
+    return i, j
+
+
+def find_bonds(batch, tolerance=BOND_TOLERANCE):
+    """
+    Bonded atoms of all molecules of a MoleculeBatch, by distance.
+
+    Neighbours are searched with cell lists, over the whole batch at once:
+    atoms are binned in cubic cells as large as the longest possible bond,
+    cells being distinct for each molecule, and only atoms in the same or
+    adjacent cells are compared. Everything is done with array operations.
+    Returns (i, j) arrays of indices of bonded atoms in the batch, with i < j.
+    """
+    coordinates = batch.coordinates
+    if len(coordinates) == 0:
+        empty = numpy.empty(0, dtype=numpy.int64)
+        return empty, empty
+    radii = _RADII[batch.elements]
+    cell_size = 2 * radii.max() + tolerance
+    molecules = molecule_indices(batch.offsets)
+
+    # Integer cell coordinates, from 1 in each molecule, so that neighbours of
+    # a cell never wrap around to another molecule
+    cells = numpy.floor(coordinates / cell_size).astype(numpy.int64)
+    natoms = batch.natoms
+    nonempty = natoms > 0
+    minimum = numpy.zeros((len(batch), 3), dtype=numpy.int64)
+    minimum[nonempty] = numpy.minimum.reduceat(cells, batch.offsets[:-1][nonempty])
+    cells -= minimum[molecules] - 1
+    size = int(cells.max()) + 2
+    strides = numpy.array([size * size, size, 1], dtype=numpy.int64)
+    keys = molecules * size ** 3 + cells @ strides
+
+    order = numpy.argsort(keys, kind="stable")
+    cell_keys, starts, counts = numpy.unique(keys[order], return_index=True, return_counts=True)
+
+    pairs_i = list()
+    pairs_j = list()
+    for offset in _NEIGHBOUR_CELLS @ strides:
+        neighbours = cell_keys + offset
+        found = numpy.searchsorted(cell_keys, neighbours)
+        found = numpy.minimum(found, len(cell_keys) - 1)
+        match = cell_keys[found] == neighbours
+        i, j = _expand_pairs(starts[match], counts[match], starts[found[match]],
+                             counts[found[match]])
+        i, j = order[i], order[j]
+        keep = i < j
+        pairs_i.append(i[keep])
+        pairs_j.append(j[keep])
+    i = numpy.concatenate(pairs_i)
+    j = numpy.concatenate(pairs_j)
+
+    distances = numpy.sqrt(((coordinates[i] - coordinates[j]) ** 2).sum(axis=1))
+    bonded = distances < radii[i] + radii[j] + tolerance
+    i, j = i[bonded], j[bonded]
+    order = numpy.lexsort((j, i))
+    return i[order], j[order]
+
+
+def remove_hydrogens(batch):
+    """MoleculeBatch without hydrogen atoms"""
+    heavy = batch.elements != 1
+    counts = numpy.bincount(molecule_indices(batch.offsets)[heavy], minlength=len(batch))
+    offsets = numpy.zeros(len(batch) + 1, dtype=numpy.int64)
+    numpy.cumsum(counts, out=offsets[1:])
+    return MoleculeBatch(
+        batch.coordinates[heavy], batch.elements[heavy], offsets, file_ids=batch.file_ids
+    )
+
+
+def graph_features(batch, max_atoms=None, explicit_hydrogens=False, self_connection=True,
+                   tolerance=BOND_TOLERANCE):
+    """
+    NFP inputs for all molecules of a MoleculeBatch, padded to max_atoms atoms.
+
+    As the chainer_chemistry NFP preprocessor, hydrogens are removed unless
+    explicit_hydrogens is set, but bonds are found from distances instead of
+    SMILES (see find_bonds). max_atoms defaults to the largest QM9 molecule.
+    Returns atoms (atomic numbers, 0 for padding, int32 (n, max_atoms)) and
+    adjacency matrices (float32 (n, max_atoms, max_atoms)), with ones on the
+    diagonal for real atoms if self_connection is set.
+    """
+    if max_atoms is None:
+        max_atoms = QM9_MAX_ATOMS if explicit_hydrogens else QM9_MAX_HEAVY_ATOMS
+    # Bonds between heavy atoms do not depend on hydrogens
+    if not explicit_hydrogens:
+        batch = remove_hydrogens(batch)
+    if len(batch) and batch.natoms.max() > max_atoms:
+        raise ValueError("Molecules larger than max_atoms: " + str(batch.natoms.max()))
+
+    molecules = molecule_indices(batch.offsets)
+    local = numpy.arange(len(batch.elements)) - batch.offsets[molecules]
+
+    atoms = numpy.zeros((len(batch), max_atoms), dtype=numpy.int32)
+    atoms[molecules, local] = batch.elements
+
+    adjacency = numpy.zeros((len(batch), max_atoms, max_atoms), dtype=numpy.float32)
+    i, j = find_bonds(batch, tolerance)
+    adjacency[molecules[i], local[i], local[j]] = 1.0
+    adjacency[molecules[i], local[j], local[i]] = 1.0
+    if self_connection:
+        adjacency[molecules, local, local] = 1.0
+    return atoms, adjacency
+
+
+def energy_labels(file_ids, results, label_names=("enthalpy",)):
+    """
+    Labels of molecules from computed energies, as loaded by load_results.
+
+    Returns the index in file_ids of molecules having all labels, and their
+    labels (float32 (n, len(label_names))).
+    """
+    ids = numpy.array([int(file_id) for file_id in file_ids], dtype=numpy.int64)
+    order = numpy.argsort(results["file_id"])
+    sorted_ids = results["file_id"][order]
+    found = numpy.searchsorted(sorted_ids, ids)
+    found = numpy.minimum(found, max(len(sorted_ids) - 1, 0))
+    known = sorted_ids[found] == ids if len(sorted_ids) else numpy.zeros(len(ids), dtype=bool)
+    rows = order[found[known]]
+    labels = numpy.stack(
+        [numpy.asarray(results[name])[rows] for name in label_names], axis=1
+    ).astype(numpy.float32)
+    complete = numpy.isfinite(labels).all(axis=1)
+    return numpy.flatnonzero(known)[complete], labels[complete]
+
+
+def featurize_archive(archive, results_directory, label_names=("enthalpy",), max_atoms=None,
+                      explicit_hydrogens=False, max_workers=None, chunk_size=4096):
+    """
+    Graph features of all molecules of a QM9 archive having computed energies.
+
+    Energies come from the result store in results_directory. Molecules are
+    parsed and featurized by chunks. Returns atoms, adjacency and labels
+    arrays (see graph_features and energy_labels).
+    """
+    results = load_results(results_directory)
+    features = list()
+    chunks = chunk_qm9_archive(archive, chunk_size)
+    for batch, _ in parse_chunks(chunks, parse_xyz_members, max_workers=max_workers):
+        rows, labels = energy_labels(batch.file_ids, results, label_names)
+        atoms, adjacency = graph_features(batch, max_atoms, explicit_hydrogens)
+        features.append((atoms[rows], adjacency[rows], labels))
+    if not features:
+        raise ValueError("No molecule in " + str(archive))
+    return tuple(numpy.concatenate(arrays) for arrays in zip(*features))
+
+
+def get_dispersion_dataset(archive, results_directory, label_names=("enthalpy",),
+                           max_atoms=None, explicit_hydrogens=False):
+    """
+    NumpyTupleDataset of (atoms, adjacency, labels), labelled with computed energies.
+
+    Needs chainer_chemistry, imported here only, so that the rest of this
+    module works without it.
+    """
+    # pylint: disable=import-outside-toplevel
+    from chainer_chemistry.datasets import NumpyTupleDataset
+    arrays = featurize_archive(
+        archive, results_directory, label_names, max_atoms, explicit_hydrogens
+    )
+    return NumpyTupleDataset(*arrays)
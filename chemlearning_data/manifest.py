@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Persistent record of the state and results of all jobs of a run"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+ENERGY_KEYS = ["scfenergy", "enthalpy", "freeenergy"]
+
+
+def hash_arguments(gaussian_args):
+    """Stable hash of gaussian_args, identifying a set of computations"""
+    serialized = json.dumps(gaussian_args, sort_keys=True)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()[:16]
+
+
+class RunManifest:
+    """
+    SQLite manifest of jobs, keyed by file_id and hash of gaussian_args.
+
+    Each job is pending, running, done or failed. Energies of done jobs are
+    stored along, so that the manifest is the reference for results of a run,
+    and a restarted run can skip everything already computed.
+    Methods are thread safe: they can be called from Future callbacks.
+
+    Attributes:
+        - path (path to the SQLite database, str)
+        - gaussian_args (arguments of the Gaussian computations, dict)
+        - args_hash (hash of gaussian_args, str)
+
+    """
+
+    def __init__(self, path, gaussian_args):
+        """Open the manifest, creating it if necessary."""
+        self.path = path
+        self.gaussian_args = gaussian_args
+        self.args_hash = hash_arguments(gaussian_args)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " file_id TEXT NOT NULL,"
+                " args_hash TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " scfenergy REAL,"
+                " enthalpy REAL,"
+                " freeenergy REAL,"
+                " error TEXT,"
+                " updated REAL NOT NULL,"
+                " PRIMARY KEY (file_id, args_hash))"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS arguments ("
+                " args_hash TEXT PRIMARY KEY, gaussian_args TEXT NOT NULL)"
+            )
+            self._connection.execute(
+                "INSERT OR IGNORE INTO arguments VALUES (?, ?)",
+                (self.args_hash, json.dumps(gaussian_args, sort_keys=True)),
+            )
+
+    def close(self):
+        """Close the database"""
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _set_status(self, file_ids, status, energies=None, error=None):
+        """Insert or update the status of jobs"""
+        energies = energies or dict()
+        values = [energies.get(key) for key in ENERGY_KEYS]
+        rows = [
+            (str(file_id), self.args_hash, status, *values, error, time.time())
+            for file_id in file_ids
+        ]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def mark_pending(self, file_ids):
+        """Record jobs as waiting to be run"""
+        self._set_status(file_ids, PENDING)
+
+    def mark_running(self, file_ids):
+        """Record jobs as started"""
+        self._set_status(file_ids, RUNNING)
+
+    def mark_done(self, file_id, energies):
+        """Record a finished job along with its energies"""
+        self._set_status([file_id], DONE, energies=energies)
+
+    def mark_failed(self, file_id, error):
+        """Record a failed job and the reason why"""
+        self._set_status([file_id], FAILED, error=str(error))
+
+    def requeue_running(self):
+        """
+        Put back jobs left running (by a crashed run) in the pending state.
+
+        Returns the number of jobs requeued.
+        """
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "UPDATE jobs SET status = ?, updated = ? WHERE args_hash = ? AND status = ?",
+                (PENDING, time.time(), self.args_hash, RUNNING),
+            )
+        if cursor.rowcount:
+            logging.info("Requeued %d jobs left running", cursor.rowcount)
+        return cursor.rowcount
+
+    def file_ids(self, status):
+        """Set of file_ids of jobs with the given status, for O(1) lookups"""
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT file_id FROM jobs WHERE args_hash = ? AND status = ?",
+                (self.args_hash, status),
+            )
+            return {row[0] for row in cursor}
+
+    def completed_ids(self):
+        """Set of file_ids of finished jobs"""
+        return self.file_ids(DONE)
+
+    def counts(self):
+        """Number of jobs in each state"""
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE args_hash = ? GROUP BY status",
+                (self.args_hash,),
+            )
+            counts = dict.fromkeys([PENDING, RUNNING, DONE, FAILED], 0)
+            counts.update(dict(cursor.fetchall()))
+            return counts
+
+    def results(self):
+        """List of (file_id, energies) for all finished jobs, sorted by file_id"""
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT file_id, scfenergy, enthalpy, freeenergy FROM jobs"
+                " WHERE args_hash = ? AND status = ? ORDER BY file_id",
+                (self.args_hash, DONE),
+            )
+            rows = cursor.fetchall()
+        return [(row[0], dict(zip(ENERGY_KEYS, row[1:]))) for row in rows]
+
+    def export_tsv(self, output_file):
+        """Write results of finished jobs as a tab separated table"""
+        with open(output_file, mode="w") as out_file:
+            out_file.write("File_ID\tSCF_Energy\tEnthalpy\tFree_Energy\n")
+            for file_id, energies in self.results():
+                values = [str(energies[key]) for key in ENERGY_KEYS]
+                out_file.write(str(file_id) + "\t" + "\t".join(values) + "\n")
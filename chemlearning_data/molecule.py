@@ -4,7 +4,48 @@
 
 """Class representing a molecule"""
 
-from cclib.parser.utils import PeriodicTable
+from functools import lru_cache
+import numpy
+
+
+@lru_cache(maxsize=None)
+def element_symbols():
+    """
+    Element symbols, indexed by atomic number, from cclib PeriodicTable.
+
+    Built once per process, on first use: importing cclib takes longer than
+    everything else a worker process imports.
+    """
+    # pylint: disable=import-outside-toplevel
+    from cclib.parser.utils import PeriodicTable
+    return PeriodicTable().element
+
+
+@lru_cache(maxsize=None)
+def atomic_numbers():
+    """Element symbol, as bytes, to atomic number"""
+    return {symbol.encode("utf-8"): number for number, symbol in enumerate(element_symbols())
+            if number > 0}
+
+
+@lru_cache(maxsize=None)
+def xyz_line_formats():
+    """Line template of XYZ geometries for each element: symbol, then x, y, z"""
+    return [str(symbol).ljust(5) + " %25.6f %25.6f %25.6f" for symbol in element_symbols()]
+
+
+def format_xyz_lines(elements, coordinates):
+    """
+    Format atoms as lines of XYZ geometry, all in a single formatting operation.
+
+    Each line is the element symbol padded to 5 characters, then the three
+    coordinates with 6 decimals, right-justified on 25 characters.
+    """
+    if len(elements) == 0:
+        return []
+    formats = xyz_line_formats()
+    template = "\n".join([formats[element] for element in elements.tolist()])
+    return (template % tuple(coordinates.ravel().tolist())).split("\n")
 
 
 class Molecule:
@@ -12,20 +53,40 @@ class Molecule:
     Class that represents a molecule
 
     Attributes:
-        - coordinates (list of XYZ coordinates)
+        - coordinates (XYZ coordinates, numpy float64 array of shape (natoms, 3))
         - natoms (number of atoms, int)
-        - elements_list (list of elements as in periodic table class from cclib)
+        - elements_list (atomic numbers as in periodic table class from cclib,
+                         numpy uint8 array of shape (natoms,))
 
     """
 
+    __slots__ = ("_coordinates", "_elements_list", "_natoms")
+
     def __init__(self, coordinates, elements_list):
         """Build  the Molecule class."""
+        coordinates = self._as_coordinates(coordinates)
+        elements_list = self._as_elements(elements_list)
         if not len(coordinates) == len(elements_list):
             raise ValueError("Coordinates and Elements are not the same size")
         self._coordinates = coordinates
         self._elements_list = elements_list
         self._natoms = len(elements_list)
 
+    @staticmethod
+    def _as_coordinates(value):
+        """Convert to a contiguous (n, 3) float64 array, without copy if possible"""
+        coordinates = numpy.ascontiguousarray(value, dtype=numpy.float64)
+        if coordinates.size == 0:
+            coordinates = coordinates.reshape(0, 3)
+        if coordinates.ndim != 2 or coordinates.shape[1] != 3:
+            raise ValueError("Coordinates must be a list of XYZ triplets")
+        return coordinates
+
+    @staticmethod
+    def _as_elements(value):
+        """Convert to a contiguous uint8 array, without copy if possible"""
+        return numpy.ascontiguousarray(value, dtype=numpy.uint8).reshape(-1)
+
     @property
     def coordinates(self):
         """Returns coordinates"""
@@ -33,6 +94,7 @@ class Molecule:
 
     @coordinates.setter
     def coordinates(self, value):
+        value = self._as_coordinates(value)
         if not len(value) == self.natoms:
             raise ValueError("Coordinates and Elements are not the same size")
         self._coordinates = value
@@ -44,6 +106,7 @@ class Molecule:
 
     @elements_list.setter
     def elements_list(self, value):
+        value = self._as_elements(value)
         if not len(value) == self.natoms:
             raise ValueError("Coordinates and Elements are not the same size")
         self._elements_list = value
@@ -59,14 +122,105 @@ class Molecule:
 
     def xyz_geometry(self):
         """Returns geometry in XYZ format"""
-        periodic_table = PeriodicTable()
+        return format_xyz_lines(self.elements_list, self.coordinates)
+
 
-        xyz_geometry = [
-            " ".join(
-                [periodic_table.element[self.elements_list[i]].ljust(5)]
-                + ["{:.6f}".format(s).rjust(25) for s in atom]
-            )
-            for i, atom in enumerate(self.coordinates)
-        ]
+class MoleculeBatch:
+    """
+    Class that packs many molecules into a few flat arrays (CSR layout)
 
-        return xyz_geometry
+    Atoms of molecule i are the rows offsets[i]:offsets[i + 1] of coordinates
+    and elements, so that a whole batch is pickled as a handful of buffers
+    instead of one object per molecule.
+
+    Attributes:
+        - coordinates (XYZ coordinates of all atoms, float64 array (total_atoms, 3))
+        - elements (atomic numbers of all atoms, uint8 array (total_atoms,))
+        - offsets (index of the first atom of each molecule, int64 array (n + 1,))
+        - file_ids (identifiers of the molecules, list of str or None)
+        - natoms (number of atoms of each molecule, int64 array (n,))
+
+    """
+
+    __slots__ = ("_coordinates", "_elements", "_offsets", "_file_ids")
+
+    def __init__(self, coordinates, elements, offsets, file_ids=None):
+        """Build the MoleculeBatch class from already packed arrays."""
+        coordinates = Molecule._as_coordinates(coordinates)
+        elements = Molecule._as_elements(elements)
+        offsets = numpy.ascontiguousarray(offsets, dtype=numpy.int64).reshape(-1)
+        if not len(coordinates) == len(elements):
+            raise ValueError("Coordinates and Elements are not the same size")
+        if len(offsets) == 0 or offsets[0] != 0 or offsets[-1] != len(elements):
+            raise ValueError("Offsets do not match the number of atoms")
+        if numpy.any(numpy.diff(offsets) < 0):
+            raise ValueError("Offsets must be sorted")
+        if file_ids is not None:
+            file_ids = list(file_ids)
+            if not len(file_ids) == len(offsets) - 1:
+                raise ValueError("File ids and Molecules are not the same size")
+        self._coordinates = coordinates
+        self._elements = elements
+        self._offsets = offsets
+        self._file_ids = file_ids
+
+    @classmethod
+    def from_molecules(cls, molecules, file_ids=None):
+        """Pack a list of Molecule objects"""
+        molecules = list(molecules)
+        offsets = numpy.zeros(len(molecules) + 1, dtype=numpy.int64)
+        numpy.cumsum([molecule.natoms for molecule in molecules], out=offsets[1:])
+        if molecules:
+            coordinates = numpy.concatenate([molecule.coordinates for molecule in molecules])
+            elements = numpy.concatenate([molecule.elements_list for molecule in molecules])
+        else:
+            coordinates = numpy.empty((0, 3), dtype=numpy.float64)
+            elements = numpy.empty(0, dtype=numpy.uint8)
+        return cls(coordinates, elements, offsets, file_ids)
+
+    @property
+    def coordinates(self):
+        """Returns coordinates of all atoms"""
+        return self._coordinates
+
+    @property
+    def elements(self):
+        """Returns atomic numbers of all atoms"""
+        return self._elements
+
+    @property
+    def offsets(self):
+        """Returns offsets of each molecule"""
+        return self._offsets
+
+    @property
+    def file_ids(self):
+        """Returns identifiers of the molecules"""
+        return self._file_ids
+
+    @property
+    def natoms(self):
+        """Returns number of atoms of each molecule"""
+        return numpy.diff(self._offsets)
+
+    def xyz_geometries(self):
+        """Returns geometries of all molecules in XYZ format, as in Molecule.xyz_geometry"""
+        lines = format_xyz_lines(self._elements, self._coordinates)
+        offsets = self._offsets.tolist()
+        return [lines[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        """Molecule at index. Its arrays are views on the batch, not copies."""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("MoleculeBatch index out of range")
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return Molecule(self._coordinates[start:end], self._elements[start:end])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
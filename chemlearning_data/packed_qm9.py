@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""
+Random-access container of QM9 xyz files: compressed blocks and an offset index.
+
+Layout of a pack file:
+    - MAGIC
+    - compressed blocks, each the concatenation of block_size xyz files
+    - index: a JSON header (codec, ids, arrays), then the index arrays, 8-byte aligned
+    - footer: offset of the index (little-endian uint64), then MAGIC
+
+The file is memory-mapped, and index arrays are views of the map: opening a
+pack reads nothing but the header, and processes opening the same pack share
+its pages in the page cache.
+"""
+
+import json
+import mmap
+import os
+import struct
+import zlib
+from collections import OrderedDict
+import numpy
+
+MAGIC = b"QM9PACK1"
+FOOTER = struct.Struct("<Q8s")
+CODECS = ("zlib", "zstd", "lz4", "none")
+# Digits of QM9 file ids, as in dsgdb9nsd_012503.xyz
+ID_WIDTH = 6
+
+
+def _compressor(codec, level):
+    """Function compressing bytes with codec; zstd and lz4 need their packages"""
+    if codec == "zlib":
+        return lambda data: zlib.compress(data, level)
+    if codec == "zstd":
+        # pylint: disable=import-outside-toplevel
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress
+    if codec == "lz4":
+        # pylint: disable=import-outside-toplevel
+        import lz4.frame
+        return lambda data: lz4.frame.compress(data, compression_level=level)
+    if codec == "none":
+        return bytes
+    raise ValueError("Unknown codec: " + str(codec))
+
+
+def _decompressor(codec):
+    """Function decompressing bytes compressed with codec"""
+    if codec == "zlib":
+        return zlib.decompress
+    if codec == "zstd":
+        # pylint: disable=import-outside-toplevel
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress
+    if codec == "lz4":
+        # pylint: disable=import-outside-toplevel
+        import lz4.frame
+        return lz4.frame.decompress
+    if codec == "none":
+        return bytes
+    raise ValueError("Unknown codec: " + str(codec))
+
+
+def is_packed(path):
+    """Whether path is a pack file"""
+    try:
+        with open(path, mode="rb") as pack_file:
+            return pack_file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def write_pack(members, path, block_size=64, codec="zlib", level=6):
+    """
+    Write (file_id, raw bytes) members to a pack file, return the number of members.
+
+    Members are stored in the order given, block_size of them per compressed
+    block: small blocks make single reads cheaper, large ones compress better.
+    The file is written under a temporary name, then renamed.
+    """
+    compress = _compressor(codec, level)
+    file_ids = list()
+    raw_offsets = [0]
+    block_offsets = [len(MAGIC)]
+    block = list()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, mode="wb") as pack_file:
+        pack_file.write(MAGIC)
+
+        def flush():
+            pack_file.write(compress(b"".join(block)))
+            block_offsets.append(pack_file.tell())
+            block.clear()
+
+        for file_id, content in members:
+            file_ids.append(int(file_id))
+            raw_offsets.append(raw_offsets[-1] + len(content))
+            block.append(content)
+            if len(block) == block_size:
+                flush()
+        if block:
+            flush()
+
+        ids = numpy.array(file_ids, dtype=numpy.int64)
+        if len(numpy.unique(ids)) != len(ids):
+            raise ValueError("Duplicate file ids")
+        min_id = int(ids.min()) if len(ids) else 0
+        lookup = numpy.full(int(ids.max()) - min_id + 1 if len(ids) else 0, -1,
+                            dtype=numpy.int64)
+        lookup[ids - min_id] = numpy.arange(len(ids))
+        arrays = {
+            "file_ids": ids,
+            "raw_offsets": numpy.array(raw_offsets, dtype=numpy.int64),
+            "block_offsets": numpy.array(block_offsets, dtype=numpy.int64),
+            "lookup": lookup,
+        }
+        _write_index(pack_file, arrays, codec, block_size, min_id)
+    os.replace(tmp_path, path)
+    return len(file_ids)
+
+
+def _write_index(pack_file, arrays, codec, block_size, min_id):
+    """Write the index and the footer at the current position of pack_file"""
+    index_offset = pack_file.tell()
+    layout = dict()
+    position = 0
+    for name, array in arrays.items():
+        layout[name] = [position, str(array.dtype), len(array)]
+        position += array.nbytes
+    header = json.dumps({
+        "codec": codec, "block_size": block_size, "min_id": min_id, "arrays": layout,
+    }).encode("utf-8")
+    padding = -(index_offset + 8 + len(header)) % 8
+    pack_file.write(struct.pack("<Q", len(header) + padding))
+    pack_file.write(header + b" " * padding)
+    for array in arrays.values():
+        pack_file.write(array.tobytes())
+    pack_file.write(FOOTER.pack(index_offset, MAGIC))
+
+
+class PackedQM9:
+    """
+    Read access to a pack file: single molecules, ranges of ids and random samples.
+
+    get is O(1): an array maps file ids to positions, and positions to their
+    block. Decompressed blocks are kept in a small LRU cache, and bulk reads
+    (members, read, sample) go through blocks in file order, decompressing
+    each block once. A PackedQM9 can be sent to worker processes: it is
+    pickled as its path, and opened again there.
+
+    Attributes:
+        - path (pack file, str)
+        - codec (compression of blocks, str)
+        - block_size (number of molecules per block, int)
+        - file_ids (file id of each molecule, in pack order, int64 array)
+        - cache_blocks (number of decompressed blocks kept, int)
+
+    """
+
+    def __init__(self, path, cache_blocks=16):
+        """Open a pack file, reading only its index."""
+        self.path = path
+        self.cache_blocks = cache_blocks
+        self._file = open(path, mode="rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        index_offset, magic = FOOTER.unpack(self._map[-FOOTER.size:])
+        if magic != MAGIC or self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a QM9 pack: " + str(path))
+        (header_size,) = struct.unpack("<Q", self._map[index_offset:index_offset + 8])
+        header = json.loads(bytes(self._map[index_offset + 8:index_offset + 8 + header_size]))
+        self.codec = header["codec"]
+        self.block_size = header["block_size"]
+        self._min_id = header["min_id"]
+        arrays_offset = index_offset + 8 + header_size
+        arrays = dict()
+        for name, (position, dtype, count) in header["arrays"].items():
+            arrays[name] = numpy.frombuffer(
+                self._map, dtype=dtype, count=count, offset=arrays_offset + position
+            )
+        self.file_ids = arrays["file_ids"]
+        self._raw_offsets = arrays["raw_offsets"]
+        self._block_offsets = arrays["block_offsets"]
+        self._lookup = arrays["lookup"]
+        self._decompress = _decompressor(self.codec)
+        self._blocks = OrderedDict()
+
+    def __getstate__(self):
+        return {"path": self.path, "cache_blocks": self.cache_blocks}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["cache_blocks"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Release the memory map and the file"""
+        self._blocks.clear()
+        self.file_ids = self._raw_offsets = self._block_offsets = self._lookup = None
+        try:
+            self._map.close()
+        except BufferError:
+            # Index arrays still used elsewhere: the map goes when they do
+            pass
+        self._file.close()
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    def __contains__(self, file_id):
+        return self.position(file_id) is not None
+
+    @property
+    def nblocks(self):
+        """Number of compressed blocks"""
+        return len(self._block_offsets) - 1
+
+    def position(self, file_id):
+        """Position of a file id in the pack, None if absent"""
+        slot = int(file_id) - self._min_id
+        if not 0 <= slot < len(self._lookup):
+            return None
+        position = int(self._lookup[slot])
+        return position if position >= 0 else None
+
+    def _block(self, block):
+        """Decompressed content of a block, through the LRU cache"""
+        content = self._blocks.get(block)
+        if content is not None:
+            self._blocks.move_to_end(block)
+            return content
+        start, end = self._block_offsets[block], self._block_offsets[block + 1]
+        content = self._decompress(self._map[start:end])
+        self._blocks[block] = content
+        if len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+        return content
+
+    def _member(self, position):
+        """(file_id, raw bytes) of the molecule at a position"""
+        block = position // self.block_size
+        content = self._block(block)
+        first = self._raw_offsets[block * self.block_size]
+        start = self._raw_offsets[position] - first
+        end = self._raw_offsets[position + 1] - first
+        return str(int(self.file_ids[position])).zfill(ID_WIDTH), content[start:end]
+
+    def get(self, file_id):
+        """Raw bytes of the xyz file of file_id; KeyError if absent"""
+        position = self.position(file_id)
+        if position is None:
+            raise KeyError(file_id)
+        return self._member(position)[1]
+
+    def read(self, positions):
+        """Yield (file_id, raw bytes) for positions, in pack order, each block read once"""
+        for position in numpy.unique(numpy.asarray(positions, dtype=numpy.int64)).tolist():
+            yield self._member(position)
+
+    def members(self, start=None, stop=None):
+        """
+        Yield (file_id, raw bytes) of all molecules, or of ids in [start, stop), in pack order.
+        """
+        if start is None and stop is None:
+            return self.read(numpy.arange(len(self)))
+        low = max(int(start if start is not None else self._min_id) - self._min_id, 0)
+        high = int(stop) - self._min_id if stop is not None else len(self._lookup)
+        positions = self._lookup[low:max(high, low)]
+        return self.read(positions[positions >= 0])
+
+    def sample(self, count=None, fraction=None, seed=0):
+        """Yield (file_id, raw bytes) of a random sample of count molecules, or a fraction"""
+        if count is None:
+            count = int(round(len(self) * fraction))
+        rng = numpy.random.default_rng(seed)
+        return self.read(rng.choice(len(self), size=min(count, len(self)), replace=False))
+
+    def chunks(self, chunk_size, members=None):
+        """Lists of chunk_size members (all by default), as chunk_qm9_archive yields"""
+        chunk = list()
+        for member in members if members is not None else self.members():
+            chunk.append(member)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = list()
+        if chunk:
+            yield chunk
+
+
+def main():
+    """Convert a QM9 tar archive to a pack file, once."""
+    # pylint: disable=import-outside-toplevel
+    import argparse
+    from chemlearning_data.chemlearning_data import pack_qm9_archive
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("archive", help="QM9 tar archive, such as qm9/qm9.tar.bz2")
+    parser.add_argument("destination", help="pack file to write, such as qm9/qm9.pack")
+    parser.add_argument("--block-size", type=int, default=64, help="molecules per block")
+    parser.add_argument("--codec", choices=CODECS, default="zlib")
+    parser.add_argument("--level", type=int, default=6, help="compression level")
+    args = parser.parse_args()
+    count = pack_qm9_archive(args.archive, args.destination, args.block_size, args.codec,
+                             args.level)
+    print("Packed", count, "molecules in", args.destination)
+
+
+if __name__ == "__main__":
+    main()
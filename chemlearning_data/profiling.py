@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Time spent in each stage of Gaussian jobs, aggregated into histograms and written out"""
+
+import asyncio
+import contextlib
+import cProfile
+import functools
+import json
+import logging
+import os
+import re
+import time
+import zlib
+import numpy
+
+# Upper bounds of histogram buckets in seconds: 4 per decade, from 100 us to a bit over a day
+HISTOGRAM_BUCKETS = tuple(float(bound) for bound in numpy.logspace(-4, 5, 37))
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_NAME = "chemlearning_stage_seconds"
+JOBS_METRIC_NAME = "chemlearning_jobs_total"
+# A sample of the Prometheus text format: name, labels if any, value
+PROMETHEUS_SAMPLE = re.compile(r"^(\w+)(?:\{(.*)\})? (\S+)$")
+PROMETHEUS_LABEL = re.compile(r'(\w+)="([^"]*)"')
+
+
+class StageTimer:
+    """
+    Wall time of the stages of a job, summed by stage name.
+
+    Attributes:
+        - timings (seconds spent in each stage, dict of str to float)
+
+    """
+
+    def __init__(self):
+        """Build the StageTimer class."""
+        self.timings = dict()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager timing the enclosed code as stage name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        """Add seconds to stage name"""
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+
+def timed_stage(name):
+    """
+    Decorator of methods, timed as stage name in the timer attribute of their object.
+
+    Nothing is timed when timer is None. Coroutine methods are timed until
+    they return, not only until they yield.
+    """
+    def decorator(method):
+        if asyncio.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                if getattr(self, "timer", None) is None:
+                    return await method(self, *args, **kwargs)
+                with self.timer.stage(name):
+                    return await method(self, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if getattr(self, "timer", None) is None:
+                return method(self, *args, **kwargs)
+            with self.timer.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profile_path(directory, file_id, rate):
+    """
+    Where to write the cProfile stats of a job, or None if it is not profiled.
+
+    A fraction rate of file ids is profiled, chosen by hash, so that the same
+    jobs are profiled in every run and in every process.
+    """
+    if directory is None or rate <= 0.0:
+        return None
+    if zlib.crc32(str(file_id).encode("utf-8")) >= rate * 2 ** 32:
+        return None
+    return os.path.join(directory, str(file_id) + ".prof")
+
+
+@contextlib.contextmanager
+def profiled(path):
+    """Profile the enclosed code with cProfile, stats written to path; nothing if path is None"""
+    if path is None:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        profile.dump_stats(path)
+        logging.debug("Wrote profile %s", path)
+
+
+class StageMetrics:
+    """
+    Histograms of stage timings of many jobs, written out as JSON or Prometheus textfile.
+
+    Timings are counted in fixed buckets (HISTOGRAM_BUCKETS by default), so
+    that memory does not grow with the number of jobs; quantiles are
+    interpolated within buckets. The output format follows the extension of
+    path: .json, or Prometheus text exposition format otherwise (as read by
+    the node_exporter textfile collector). Files are written under a
+    temporary name, then renamed, so that readers never see half a file.
+    load reads such a file back, so that a resumed run adds to the
+    histograms of the former ones instead of overwriting them.
+
+    Attributes:
+        - path (file written by write, str or None)
+        - interval (seconds between two writes of maybe_write, float)
+        - buckets (upper bounds of histogram buckets in seconds, float array)
+        - counts (number of timings in each bucket and above the last one, per stage,
+                  dict of str to int array)
+        - sums (total seconds per stage, dict of str to float)
+        - maxima (longest timing per stage, dict of str to float)
+        - jobs (number of jobs added, int)
+
+    """
+
+    def __init__(self, path=None, interval=60.0, buckets=HISTOGRAM_BUCKETS):
+        """Build the StageMetrics class."""
+        self.path = path
+        self.interval = interval
+        self.buckets = numpy.asarray(buckets, dtype=numpy.float64)
+        self.counts = dict()
+        self.sums = dict()
+        self.maxima = dict()
+        self.jobs = 0
+        self._last_write = time.monotonic()
+
+    def observe(self, stage, seconds):
+        """Count a single timing of stage"""
+        if stage not in self.counts:
+            self.counts[stage] = numpy.zeros(len(self.buckets) + 1, dtype=numpy.int64)
+            self.sums[stage] = 0.0
+            self.maxima[stage] = 0.0
+        self.counts[stage][numpy.searchsorted(self.buckets, seconds)] += 1
+        self.sums[stage] += seconds
+        self.maxima[stage] = max(self.maxima[stage], seconds)
+
+    def add(self, timings):
+        """Count the timings of a job, as given by StageTimer.timings; None is ignored"""
+        if timings is None:
+            return
+        self.jobs += 1
+        for stage, seconds in timings.items():
+            self.observe(stage, seconds)
+
+    def quantile(self, stage, fraction):
+        """Estimated quantile of timings of stage, None if there are none"""
+        counts = self.counts.get(stage)
+        if counts is None or not counts.sum():
+            return None
+        cumulative = numpy.cumsum(counts)
+        rank = fraction * cumulative[-1]
+        bucket = int(numpy.searchsorted(cumulative, rank))
+        if bucket == len(self.buckets):
+            return self.maxima[stage]
+        lower = self.buckets[bucket - 1] if bucket else 0.0
+        upper = self.buckets[bucket]
+        below = cumulative[bucket - 1] if bucket else 0
+        estimate = lower + (upper - lower) * (rank - below) / counts[bucket]
+        return float(min(estimate, self.maxima[stage]))
+
+    def summary(self):
+        """Dict of stage to count, total, mean and quantiles (p50, p95, p99) of timings"""
+        summary = dict()
+        for stage in sorted(self.counts):
+            count = int(self.counts[stage].sum())
+            summary[stage] = {
+                "count": count,
+                "sum": self.sums[stage],
+                "mean": self.sums[stage] / count,
+                "max": self.maxima[stage],
+            }
+            for fraction in QUANTILES:
+                summary[stage]["p" + str(int(round(fraction * 100)))] = self.quantile(
+                    stage, fraction
+                )
+        return summary
+
+    def to_json(self):
+        """Summary and histograms, as a JSON string"""
+        return json.dumps({
+            "jobs": self.jobs,
+            "stages": self.summary(),
+            "buckets": self.buckets.tolist(),
+            "histograms": {stage: counts.tolist() for stage, counts in self.counts.items()},
+        }, indent=1, sort_keys=True)
+
+    def to_prometheus(self, name=METRIC_NAME):
+        """Histograms in Prometheus text exposition format"""
+        lines = [
+            "# HELP " + name + " Wall time of the stages of Gaussian jobs.",
+            "# TYPE " + name + " histogram",
+        ]
+        for stage in sorted(self.counts):
+            label = 'stage="' + stage + '"'
+            cumulative = numpy.cumsum(self.counts[stage])
+            for bound, count in zip(self.buckets, cumulative):
+                lines.append("{}_bucket{{{},le=\"{:g}\"}} {:d}".format(name, label, bound, count))
+            lines.append("{}_bucket{{{},le=\"+Inf\"}} {:d}".format(name, label, cumulative[-1]))
+            lines.append("{}_sum{{{}}} {!r}".format(name, label, self.sums[stage]))
+            lines.append("{}_count{{{}}} {:d}".format(name, label, cumulative[-1]))
+        lines.append("# HELP " + name + "_max Longest wall time of the stages of Gaussian jobs.")
+        lines.append("# TYPE " + name + "_max gauge")
+        for stage in sorted(self.counts):
+            lines.append("{}_max{{stage=\"{}\"}} {!r}".format(name, stage, self.maxima[stage]))
+        lines.append("# HELP " + JOBS_METRIC_NAME + " Jobs with stage timings.")
+        lines.append("# TYPE " + JOBS_METRIC_NAME + " counter")
+        lines.append(JOBS_METRIC_NAME + " " + str(self.jobs))
+        return "\n".join(lines) + "\n"
+
+    def load(self, path=None):
+        """
+        Add the timings of a file written by write (self.path by default), if it exists.
+
+        Files with other buckets are left out. Returns whether timings were added.
+        """
+        path = path or self.path
+        if path is None or not os.path.isfile(path):
+            return False
+        with open(path, mode="r") as metrics_file:
+            content = metrics_file.read()
+        if path.endswith(".json"):
+            buckets, jobs, stages = _parse_json_metrics(content)
+        else:
+            buckets, jobs, stages = _parse_prometheus_metrics(content)
+        if len(buckets) != len(self.buckets) or not numpy.allclose(buckets, self.buckets,
+                                                                   rtol=1e-5):
+            logging.warning("Metrics of %s have other buckets, not loaded", path)
+            return False
+        self.jobs += jobs
+        for stage, (counts, total, maximum) in stages.items():
+            if stage not in self.counts:
+                self.counts[stage] = numpy.zeros(len(self.buckets) + 1, dtype=numpy.int64)
+                self.sums[stage] = 0.0
+                self.maxima[stage] = 0.0
+            self.counts[stage] += counts
+            self.sums[stage] += total
+            self.maxima[stage] = max(self.maxima[stage], maximum)
+        logging.info("Loaded timings of %d jobs from %s", jobs, path)
+        return True
+
+    def write(self, path=None):
+        """Write metrics to path (self.path by default), return the path written"""
+        path = path or self.path
+        if path is None:
+            return None
+        content = self.to_json() if path.endswith(".json") else self.to_prometheus()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, mode="w") as metrics_file:
+            metrics_file.write(content)
+        os.replace(tmp_path, path)
+        self._last_write = time.monotonic()
+        return path
+
+    def maybe_write(self):
+        """Write metrics if interval seconds have passed since the last write"""
+        if self.path is not None and time.monotonic() - self._last_write >= self.interval:
+            self.write()
+
+    def report(self):
+        """Log quantiles of every stage"""
+        for stage, values in self.summary().items():
+            logging.info(
+                "Stage %s: %d timings, p50 %.3f s, p95 %.3f s, p99 %.3f s, total %.1f s",
+                stage, values["count"], values["p50"], values["p95"], values["p99"],
+                values["sum"],
+            )
+
+
+def _parse_json_metrics(content):
+    """(buckets, jobs, {stage: (counts, sum, max)}) of StageMetrics.to_json output"""
+    metrics = json.loads(content)
+    stages = {
+        stage: (numpy.array(counts, dtype=numpy.int64), metrics["stages"][stage]["sum"],
+                metrics["stages"][stage]["max"])
+        for stage, counts in metrics["histograms"].items()
+    }
+    return metrics["buckets"], metrics["jobs"], stages
+
+
+def _parse_prometheus_metrics(content, name=METRIC_NAME):
+    """(buckets, jobs, {stage: (counts, sum, max)}) of StageMetrics.to_prometheus output"""
+    bounds = dict()
+    cumulative = dict()
+    sums = dict()
+    maxima = dict()
+    jobs = 0
+    for line in content.splitlines():
+        match = PROMETHEUS_SAMPLE.match(line)
+        if match is None:
+            continue
+        metric, labels, value = match.groups()
+        labels = dict(PROMETHEUS_LABEL.findall(labels or ""))
+        if metric == name + "_bucket":
+            cumulative.setdefault(labels["stage"], list()).append(int(value))
+            if labels["le"] != "+Inf":
+                bounds.setdefault(labels["stage"], list()).append(float(labels["le"]))
+        elif metric == name + "_sum":
+            sums[labels["stage"]] = float(value)
+        elif metric == name + "_max":
+            maxima[labels["stage"]] = float(value)
+        elif metric == JOBS_METRIC_NAME:
+            jobs = int(value)
+    stages = {
+        stage: (numpy.diff(counts, prepend=0), sums.get(stage, 0.0), maxima.get(stage, 0.0))
+        for stage, counts in cumulative.items()
+    }
+    buckets = next(iter(bounds.values())) if bounds else list(HISTOGRAM_BUCKETS)
+    return buckets, jobs, stages
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""On-disk cache of Gaussian results, addressed by molecule and arguments"""
+
+import gzip
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import tempfile
+import numpy
+
+
+def cache_key(molecule, gaussian_args, decimals=6):
+    """
+    Canonical hash of a computation: elements, rounded coordinates and gaussian_args.
+
+    Coordinates are rounded to the precision written in input files, so that
+    two geometries giving the same input give the same key.
+    """
+    coordinates = numpy.round(molecule.coordinates, decimals) + 0.0  # No negative zeros
+    digest = hashlib.sha256()
+    digest.update(numpy.ascontiguousarray(molecule.elements_list, dtype=numpy.uint8).tobytes())
+    digest.update(numpy.ascontiguousarray(coordinates, dtype="<f8").tobytes())
+    digest.update(json.dumps(gaussian_args, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed cache of parsed energies, and optionally compressed logs.
+
+    Entries are files named after cache_key, in a two-level directory tree,
+    written atomically so that several processes can share the cache. Last
+    access times are kept as file modification times, and evict removes the
+    least recently used entries once the cache is over max_size bytes. It
+    reads sizes from disk: a single process (the one submitting jobs) calls
+    it, while workers only read and store entries. Missing energies are
+    stored as NaN, and read back as None.
+
+    Attributes:
+        - directory (root of the cache, str)
+        - max_size (maximum size in bytes, enforced by evict, None for no limit)
+        - keep_logs (whether output files are stored along with energies, bool)
+        - stats (hits, misses, stores and evictions counters of this process, dict)
+
+    """
+
+    def __init__(self, directory, max_size=None, keep_logs=False):
+        """Open the cache, creating its directory if necessary."""
+        self.directory = directory
+        self.max_size = max_size
+        self.keep_logs = keep_logs
+        self.stats = dict.fromkeys(["hits", "misses", "stores", "evictions"], 0)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, extension):
+        """Path to an entry file"""
+        return os.path.join(self.directory, key[:2], key + extension)
+
+    def _entries(self):
+        """List of (last access time, size, [paths]) for all entries"""
+        entries = dict()
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith(".tmp"):  # Being written
+                    continue
+                key = entry.name.split(".")[0]
+                stat = entry.stat()
+                access, size, paths = entries.get(key, (0.0, 0, []))
+                if entry.name.endswith(".json"):
+                    access = stat.st_mtime
+                entries[key] = (access, size + stat.st_size, paths + [entry.path])
+        return list(entries.values())
+
+    def size(self):
+        """Total size of the cache in bytes"""
+        return sum(size for _, size, _ in self._entries())
+
+    def get(self, molecule, gaussian_args):
+        """Energies stored for this computation, or None"""
+        path = self._path(cache_key(molecule, gaussian_args), ".json")
+        try:
+            with open(path, mode="r") as entry:
+                energies = json.load(entry)["energies"]
+        except (OSError, ValueError, KeyError):
+            self.stats["misses"] += 1
+            return None
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.stats["hits"] += 1
+        return {
+            name: None if value is None or math.isnan(value) else value
+            for name, value in energies.items()
+        }
+
+    def get_log(self, molecule, gaussian_args):
+        """Content of the output file stored for this computation, or None"""
+        path = self._path(cache_key(molecule, gaussian_args), ".log.gz")
+        try:
+            with gzip.open(path, mode="rb") as log:
+                return log.read()
+        except OSError:
+            return None
+
+    def put(self, molecule, gaussian_args, energies, log_path=None):
+        """Store energies, and the output file at log_path if keep_logs is set"""
+        key = cache_key(molecule, gaussian_args)
+        os.makedirs(os.path.dirname(self._path(key, "")), exist_ok=True)
+        # Log first: an entry is only visible once its json file exists
+        if self.keep_logs and log_path is not None:
+            with open(log_path, mode="rb") as log:
+                self._write(key, ".log.gz", log, compress=True)
+        entry = {
+            "energies": {
+                name: math.nan if value is None else float(value)
+                for name, value in energies.items()
+            },
+            "gaussian_args": gaussian_args,
+        }
+        content = json.dumps(entry, sort_keys=True).encode("utf-8")
+        self._write(key, ".json", content)
+        self.stats["stores"] += 1
+
+    def _write(self, key, extension, content, compress=False):
+        """Write an entry file atomically, return its size"""
+        path = self._path(key, extension)
+        handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with open(handle, mode="wb") as tmp_file:
+                if compress:
+                    with gzip.GzipFile(fileobj=tmp_file, mode="wb") as gz_file:
+                        shutil.copyfileobj(content, gz_file)
+                else:
+                    tmp_file.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return os.path.getsize(path)
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_size"""
+        if self.max_size is None:
+            return
+        entries = sorted(self._entries(), key=lambda entry: entry[0])
+        total = sum(size for _, size, _ in entries)
+        for _, size, paths in entries:
+            if total <= self.max_size:
+                break
+            for path in sorted(paths, key=lambda path: path.endswith(".json"), reverse=True):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            total -= size
+            self.stats["evictions"] += 1
+        logging.debug("Cache evicted down to %d bytes", total)
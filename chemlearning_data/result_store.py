@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Columnar binary storage of computed energies"""
+
+import os
+import shutil
+import threading
+import numpy
+from chemlearning_data.manifest import hash_arguments
+
+# Column name and dtype. Missing energies are stored as NaN.
+COLUMNS = [
+    ("file_id", numpy.int64),
+    ("scfenergy", numpy.float64),
+    ("enthalpy", numpy.float64),
+    ("freeenergy", numpy.float64),
+]
+
+
+def results_directory(base, gaussian_args):
+    """
+    Folder of the result store of computations run with gaussian_args.
+
+    base is suffixed with the hash of gaussian_args (as in RunManifest), so
+    that runs with other arguments never write to, or read from, the same store.
+    """
+    return base + "_" + hash_arguments(gaussian_args)
+
+
+def list_chunks(directory):
+    """Sorted paths of all complete chunks of a result store"""
+    if not os.path.isdir(directory):
+        return list()
+    return sorted(
+        entry.path for entry in os.scandir(directory)
+        if entry.is_dir() and entry.name.startswith("chunk_")
+    )
+
+
+def iter_chunks(directory, mmap_mode="r"):
+    """
+    Yield every chunk of a result store as a dict of column name to array.
+
+    Columns are uncompressed .npy files, memory-mapped by default, so that
+    data is only read from disk when used.
+    """
+    for chunk in list_chunks(directory):
+        yield {
+            name: numpy.load(os.path.join(chunk, name + ".npy"), mmap_mode=mmap_mode)
+            for name, _ in COLUMNS
+        }
+
+
+def load_results(directory):
+    """All results of a store as a dict of column name to array, in memory"""
+    chunks = list(iter_chunks(directory, mmap_mode="r"))
+    if not chunks:
+        return {name: numpy.empty(0, dtype=dtype) for name, dtype in COLUMNS}
+    return {
+        name: numpy.concatenate([chunk[name] for chunk in chunks]) for name, _ in COLUMNS
+    }
+
+
+class ResultWriter:
+    """
+    Buffer results in memory and write them as chunks of columnar arrays.
+
+    Each chunk is a folder holding one .npy file per column. It is written
+    under a temporary name and renamed once complete, so that readers never
+    see partial chunks. Meant to be used from the parent process only;
+    methods are thread safe, for Future callbacks.
+
+    Attributes:
+        - directory (folder of the store, str)
+        - chunk_size (number of rows per chunk, int)
+
+    """
+
+    def __init__(self, directory, chunk_size=4096):
+        """Open the store for writing, creating its folder if necessary."""
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self._rows = list()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._next_chunk = len(list_chunks(directory))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def existing_ids(self):
+        """Set of file ids already written to disk"""
+        file_ids = set()
+        for chunk in iter_chunks(self.directory):
+            file_ids.update(chunk["file_id"].tolist())
+        return file_ids
+
+    def add(self, file_id, energies):
+        """Add a result, writing a chunk when enough rows are buffered"""
+        row = [int(file_id)] + [
+            numpy.nan if energies.get(name) is None else float(energies[name])
+            for name, _ in COLUMNS[1:]
+        ]
+        with self._lock:
+            self._rows.append(row)
+            if len(self._rows) >= self.chunk_size:
+                self._flush()
+
+    def flush(self):
+        """Write all buffered rows"""
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """Write remaining rows"""
+        self.flush()
+
+    def _flush(self):
+        """Write buffered rows as a new chunk. Lock must be held."""
+        if not self._rows:
+            return
+        name = "chunk_" + str(self._next_chunk).zfill(6)
+        tmp_path = os.path.join(self.directory, "." + name + ".tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        columns = list(zip(*self._rows))
+        for (column, dtype), values in zip(COLUMNS, columns):
+            numpy.save(os.path.join(tmp_path, column + ".npy"), numpy.array(values, dtype=dtype))
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        self._next_chunk += 1
+        self._rows = list()
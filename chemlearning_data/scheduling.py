@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Cost model of Gaussian jobs, and submission order balancing the load of workers"""
+
+import heapq
+import logging
+import math
+import threading
+import time
+import numpy
+
+POLICIES = ("fifo", "lpt", "guided")
+
+# Number of basis functions per atomic number, as counted by Gaussian (6D 10F)
+BASIS_FUNCTIONS = {
+    "STO-3G": {1: 1, 6: 5, 7: 5, 8: 5, 9: 5},
+    "3-21G": {1: 2, 6: 9, 7: 9, 8: 9, 9: 9},
+    "6-31G": {1: 2, 6: 9, 7: 9, 8: 9, 9: 9},
+    "6-31G*": {1: 2, 6: 15, 7: 15, 8: 15, 9: 15},
+    "6-31G**": {1: 5, 6: 15, 7: 15, 8: 15, 9: 15},
+    "6-311G*": {1: 3, 6: 19, 7: 19, 8: 19, 9: 19},
+    "6-311G**": {1: 6, 6: 19, 7: 19, 8: 19, 9: 19},
+}
+DEFAULT_BASIS = "6-31G*"
+
+# Prior for seconds = scale * basis_size ** exponent, before any timing is known:
+# about 5 minutes for a 9 heavy atom molecule in 6-31G* on one core
+DEFAULT_SCALE = 9e-5
+DEFAULT_EXPONENT = 3.0
+
+
+def simulate_makespan(durations, workers):
+    """
+    Time to run jobs of given durations, in this order, on workers workers.
+
+    Each job goes to the first worker to be free, as with a shared queue.
+    """
+    finish_times = [0.0] * min(workers, max(len(durations), 1))
+    for duration in durations:
+        heapq.heapreplace(finish_times, finish_times[0] + duration)
+    return max(finish_times)
+
+
+class CostModel:
+    """
+    Estimate of the wall time of Gaussian jobs, from the size of their basis set.
+
+    Costs follow seconds = scale * basis_size ** exponent, with basis_size the
+    number of basis functions of the molecule for gaussian_args["basisset"]:
+    it grows with the number of atoms, and more so with heavy atoms. The two
+    parameters start from a prior, and are fitted on timings of finished jobs
+    with a least squares fit in log space.
+
+    Attributes:
+        - gaussian_args (arguments of the Gaussian computations, dict)
+        - scale (seconds for a single basis function, float)
+        - exponent (scaling with the basis set size, float)
+        - min_timings (number of timings needed before fitting, int)
+        - fitted (whether parameters were fitted on timings, not the prior, bool)
+
+    """
+
+    def __init__(self, gaussian_args, min_timings=16):
+        """Build the CostModel class, with prior parameters."""
+        self.gaussian_args = gaussian_args
+        self.scale = DEFAULT_SCALE / max(1, int(gaussian_args.get("nprocshared", 1)))
+        self.exponent = DEFAULT_EXPONENT
+        self.min_timings = min_timings
+        self.fitted = False
+        self._sizes = list()
+        self._seconds = list()
+        self._lock = threading.Lock()
+        basisset = gaussian_args.get("basisset")
+        if basisset not in BASIS_FUNCTIONS:
+            logging.warning("Unknown basis set %s, sizes of %s used", basisset, DEFAULT_BASIS)
+            basisset = DEFAULT_BASIS
+        # Atomic number to number of functions, unknown elements as heavy atoms
+        self._functions = numpy.full(119, BASIS_FUNCTIONS[basisset][6], dtype=numpy.int64)
+        for number, functions in BASIS_FUNCTIONS[basisset].items():
+            self._functions[number] = functions
+
+    def basis_size(self, molecule):
+        """Number of basis functions of a Molecule"""
+        return int(self._functions[molecule.elements_list].sum())
+
+    def basis_sizes(self, batch):
+        """Number of basis functions of every molecule of a MoleculeBatch, as an array"""
+        functions = self._functions[batch.elements]
+        return numpy.add.reduceat(functions, batch.offsets[:-1]) if len(batch) else functions
+
+    def predict(self, basis_sizes):
+        """Estimated seconds for jobs of the given basis sizes (number or array)"""
+        return self.scale * numpy.asarray(basis_sizes, dtype=numpy.float64) ** self.exponent
+
+    def estimate(self, molecule):
+        """Estimated seconds for a Molecule"""
+        return float(self.predict(self.basis_size(molecule)))
+
+    def add_timing(self, basis_size, seconds):
+        """Record the wall time of a finished job, or a lower bound of that of a killed one"""
+        if seconds is None or seconds <= 0.0:
+            return
+        with self._lock:
+            self._sizes.append(basis_size)
+            self._seconds.append(seconds)
+
+    @property
+    def timings(self):
+        """Number of recorded timings"""
+        return len(self._seconds)
+
+    def fit(self):
+        """
+        Fit the parameters on recorded timings.
+
+        With timings for a single basis size, only the scale is fitted.
+        Returns whether parameters were updated.
+        """
+        with self._lock:
+            if len(self._seconds) < self.min_timings:
+                return False
+            log_sizes = numpy.log(numpy.array(self._sizes, dtype=numpy.float64))
+            log_seconds = numpy.log(numpy.array(self._seconds, dtype=numpy.float64))
+        if numpy.ptp(log_sizes) > 0.0:
+            exponent, log_scale = numpy.polyfit(log_sizes, log_seconds, 1)
+        else:
+            exponent = self.exponent
+            log_scale = numpy.mean(log_seconds - exponent * log_sizes)
+        self.exponent = float(exponent)
+        self.scale = float(numpy.exp(log_scale))
+        self.fitted = True
+        logging.debug("Cost model: %.3g * size ** %.3f", self.scale, self.exponent)
+        return True
+
+    def projected_finish(self, basis_sizes, workers):
+        """Estimated seconds to run jobs of basis_sizes on workers, longest first"""
+        durations = numpy.sort(self.predict(basis_sizes))[::-1]
+        return simulate_makespan(durations.tolist(), workers)
+
+
+def schedule_chunks(molecules, cost_model, chunk_size, workers, policy="lpt", window=None):
+    """
+    Group (file_id, Molecule) into chunks, in the order in which to submit them.
+
+    Policies are:
+        - fifo: source order, chunks of chunk_size
+        - lpt: longest estimated jobs first, chunks of chunk_size
+        - guided: longest first, chunks shrinking with the remaining number of
+          molecules, down to single molecules, so that the last tasks are short
+    Molecules are sorted by windows of window molecules (None for all of
+    them), which bounds the memory used for reordering.
+    """
+    if policy not in POLICIES:
+        raise ValueError("policy should be one of " + str(POLICIES))
+    buffer = list()
+    for item in molecules:
+        buffer.append(item)
+        if policy == "fifo" and len(buffer) == chunk_size:
+            yield buffer
+            buffer = list()
+        elif window is not None and len(buffer) == window:
+            yield from _ordered_chunks(buffer, cost_model, chunk_size, workers, policy)
+            buffer = list()
+    if buffer:
+        yield from _ordered_chunks(buffer, cost_model, chunk_size, workers, policy)
+
+
+def _ordered_chunks(items, cost_model, chunk_size, workers, policy):
+    """Chunks of items, sorted as set by policy (see schedule_chunks)"""
+    if policy != "fifo":
+        # Same size molecules keep their source order
+        items = sorted(items, key=lambda item: -cost_model.basis_size(item[1]))
+    start = 0
+    while start < len(items):
+        size = chunk_size
+        if policy == "guided":
+            size = min(chunk_size, math.ceil((len(items) - start) / (2 * workers)))
+        yield items[start:start + size]
+        start += size
+
+
+class ProgressEstimator:
+    """
+    Projected finish time of a run, refined as jobs end.
+
+    Thread safe, for Future callbacks.
+
+    Attributes:
+        - cost_model (estimate of job wall times, CostModel)
+        - workers (number of jobs running at the same time, int)
+        - refit_every (number of new timings between two fits and reports, int)
+
+    """
+
+    def __init__(self, cost_model, workers, refit_every=64):
+        """Build the ProgressEstimator class."""
+        self.cost_model = cost_model
+        self.workers = workers
+        self.refit_every = refit_every
+        self._pending = dict()
+        self._new_timings = 0
+        self._lock = threading.Lock()
+
+    def add(self, file_id, molecule):
+        """Record a job still to run"""
+        with self._lock:
+            self._pending[file_id] = self.cost_model.basis_size(molecule)
+
+    def finished(self, file_id, seconds=None):
+        """Record a job as finished, with its wall time if known"""
+        with self._lock:
+            basis_size = self._pending.pop(file_id, None)
+            self._new_timings += 1
+            refit = self._new_timings >= self.refit_every
+            if refit:
+                self._new_timings = 0
+        if basis_size is not None:
+            self.cost_model.add_timing(basis_size, seconds)
+        if refit and self.cost_model.fit():
+            self.report()
+
+    def projected_finish(self):
+        """Estimated seconds before all jobs still to run are done"""
+        with self._lock:
+            sizes = list(self._pending.values())
+        return self.cost_model.projected_finish(sizes, self.workers)
+
+    def report(self):
+        """Log the projected finish time"""
+        remaining = self.projected_finish()
+        logging.info(
+            "%d jobs left, projected finish in %.0f s, at %s",
+            len(self._pending),
+            remaining,
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time() + remaining)),
+        )
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Straggling Gaussian jobs: timeouts from their estimated wall time, and speculative copies"""
+
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+# Gaussian arguments of retried jobs: quadratically convergent SCF, when DIIS goes nowhere
+FALLBACK_ARGUMENTS = {"scf": "XQC"}
+
+
+class StragglerPolicy:
+    """
+    When to give up on a Gaussian job, and how to try it again.
+
+    A job is killed once it has run factor times its estimated wall time (see
+    CostModel), bounded by min_seconds and max_seconds: estimates are poor
+    for small molecules. Before the cost model is fitted, the prior may be
+    far off, and jobs are not killed. A killed job is run again, up to
+    retries times, with fallback_args merged into its Gaussian arguments, and
+    a timeout growth times longer at each attempt.
+
+    Attributes:
+        - factor (timeout, in estimated wall times, float)
+        - min_seconds (shortest timeout, float)
+        - max_seconds (longest timeout, None for no limit, float)
+        - retries (number of new attempts after a timeout, int)
+        - fallback_args (Gaussian arguments changed for new attempts, dict or None)
+        - growth (timeout of each attempt, in timeouts of the previous one, float)
+
+    """
+
+    def __init__(self, factor=4.0, min_seconds=600.0, max_seconds=None, retries=1,
+                 fallback_args=None, growth=2.0):
+        """Build the StragglerPolicy class."""
+        self.factor = factor
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.retries = retries
+        self.fallback_args = fallback_args
+        self.growth = growth
+
+    def timeout(self, expected):
+        """Timeout, in seconds, of a job expected to last expected seconds"""
+        timeout = max(self.min_seconds, self.factor * expected)
+        return timeout if self.max_seconds is None else min(timeout, self.max_seconds)
+
+    def timeouts(self, cost_model, batch):
+        """Timeouts of every molecule of a MoleculeBatch, as a list (None until cost_model fits)"""
+        if not cost_model.fitted:
+            return [None] * len(batch)
+        expected = cost_model.predict(cost_model.basis_sizes(batch))
+        return [self.timeout(seconds) for seconds in expected.tolist()]
+
+    def retry_timeout(self, timeout, attempt):
+        """Timeout of attempt (0 for the first one) of a job with timeout, None for no limit"""
+        if timeout is None:
+            return None
+        timeout *= self.growth ** attempt
+        return timeout if self.max_seconds is None else min(timeout, self.max_seconds)
+
+    def attempts(self, gaussian_args):
+        """Gaussian arguments of the first attempt, then of each retry"""
+        retry_args = dict(gaussian_args, **(self.fallback_args or dict()))
+        return [gaussian_args] + [retry_args] * self.retries
+
+
+def submit_speculative(executor, jobs, on_done, max_in_flight, workers, expected, copy,
+                       min_ratio=1.5, max_copies=1, poll_interval=5.0, stop=None):
+    """
+    Submit jobs as submit_bounded does, with speculative copies of stragglers at the end.
+
+    Once all jobs are submitted and fewer than workers tasks run, idle
+    workers run copies of the tasks that have run longest compared to their
+    expected(kwargs) seconds, if over min_ratio times, at most max_copies per
+    job. Copies get copy(kwargs, number) as arguments. For each job, the first
+    task to end without an exception goes to on_done(key, future), and the
+    others are cancelled if not started; those already running get
+    stop(kwargs) with their arguments, if given, to end them early (see
+    speculative_arguments), and their results are dropped.
+    Tasks are timed from when they are seen running, checked at least every
+    poll_interval seconds at the end of the run.
+    Returns the number of copies submitted, and of those that ended first.
+    """
+    jobs = iter(jobs)
+    stats = {"copies": 0, "won": 0}
+    # Future to (job, copy number, kwargs); jobs are dicts, in submission order
+    pending = dict()
+    unfinished = list()
+    exhausted = False
+    while True:
+        while not exhausted and len(unfinished) < max_in_flight:
+            job = next(jobs, None)
+            if job is None:
+                exhausted = True
+                break
+            key, function, kwargs = job
+            job = {"key": key, "function": function, "kwargs": kwargs, "started": None,
+                   "expected": expected(kwargs), "copies": 0, "running": 1, "done": False}
+            unfinished.append(job)
+            pending[executor.submit(function, **kwargs)] = (job, 0, kwargs)
+        if exhausted and not unfinished:
+            # Copies that lost may still run, stopped: their results are not waited for
+            break
+        now = time.monotonic()
+        for future, (job, _, _) in pending.items():
+            if job["started"] is None and future.running():
+                job["started"] = now
+        if exhausted:
+            _submit_copies(executor, pending, unfinished, workers - len(pending), copy,
+                           min_ratio, max_copies, stats)
+        done, _ = wait(pending, timeout=poll_interval if exhausted else None,
+                       return_when=FIRST_COMPLETED)
+        for future in done:
+            job, number, _ = pending.pop(future)
+            job["running"] -= 1
+            if job["done"]:
+                continue
+            if future.exception() is not None and job["running"] > 0:
+                # Another copy may still succeed
+                continue
+            job["done"] = True
+            unfinished.remove(job)
+            for other in [other for other, (owner, _, _) in pending.items() if owner is job]:
+                if other.cancel():
+                    del pending[other]
+                elif stop is not None:
+                    stop(pending[other][2])
+            if number > 0:
+                stats["won"] += 1
+                logging.info("Speculative copy %d of %s finished first", number, str(job["key"]))
+            on_done(job["key"], future)
+    return stats
+
+
+def _submit_copies(executor, pending, unfinished, idle, copy, min_ratio, max_copies, stats):
+    """Give idle workers copies of the jobs furthest over their expected time"""
+    if idle <= 0:
+        return
+    now = time.monotonic()
+    late = list()
+    for job in unfinished:
+        if job["copies"] >= max_copies or job["started"] is None or job["expected"] <= 0.0:
+            continue
+        ratio = (now - job["started"]) / job["expected"]
+        if ratio >= min_ratio:
+            late.append((ratio, job))
+    late.sort(key=lambda item: -item[0])
+    for ratio, job in late[:idle]:
+        job["copies"] += 1
+        job["running"] += 1
+        kwargs = copy(job["kwargs"], job["copies"])
+        pending[executor.submit(job["function"], **kwargs)] = (job, job["copies"], kwargs)
+        stats["copies"] += 1
+        logging.info("Speculative copy %d of %s: %.1f times over its expected %.0f s",
+                     job["copies"], str(job["key"]), ratio, job["expected"])
+
+
+def speculative_arguments(kwargs, number, directory):
+    """
+    Arguments of copy number (0 for the original) of a compute_dispersion_corrections task.
+
+    Each copy gets a stop file of its own in directory, created by stop_copy.
+    """
+    name = kwargs["batch"].file_ids[0] + ".copy" + str(number)
+    return dict(kwargs, copy=number, stop_file=os.path.join(directory, name))
+
+
+def stop_copy(kwargs):
+    """Stop the task running with kwargs (see speculative_arguments): its job is killed"""
+    with open(kwargs["stop_file"], mode="a"):
+        pass
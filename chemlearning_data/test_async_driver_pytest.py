@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for the asyncio job driver"""
+
+import asyncio
+import os
+import subprocess
+from chemlearning_data.async_driver import AsyncJobDriver
+from chemlearning_data.chemlearning_data import get_gaussian_arguments, iter_qm9_archive
+from chemlearning_data.gaussian_job import GaussianJob
+import pytest
+
+
+def test_async_driver(qm9_test_archive, fake_g16, monkeypatch, tmp_path):
+    """All molecules are computed, never more than the core budget at once"""
+    monkeypatch.setenv("FAKE_G16_SLEEP", "0.2")
+    gaussian_args = dict(get_gaussian_arguments(), nprocshared=2)
+    driver = AsyncJobDriver(str(tmp_path), gaussian_args, cores=8, report_interval=0.1)
+    results = dict()
+
+    stats = driver.run(
+        iter_qm9_archive(qm9_test_archive, max_workers=0),
+        on_result=lambda file_id, energies: results.update({file_id: energies}),
+    )
+
+    assert driver.slots == 4
+    assert stats["done"] == stats["submitted"] == 10
+    assert stats["failed"] == 0
+    assert stats["peak_running"] == 4
+    assert stats["jobs_per_second"] > 0
+    assert sorted(results) == [str(i).zfill(6) for i in range(1, 11)]
+    assert results["000001"]["enthalpy"] == -40.469780
+    # Jobs are cleaned up
+    assert os.listdir(str(tmp_path)) == ["bin"]
+
+
+def test_async_driver_failures(qm9_test_archive, fake_g16, monkeypatch, tmp_path):
+    """A job whose g16 fails is counted, and does not stop the others"""
+    monkeypatch.setenv("FAKE_G16_FAIL", "000003.xyz")
+    driver = AsyncJobDriver(str(tmp_path / "computation"), get_gaussian_arguments(), cores=3)
+    results = dict()
+    stats = driver.run(
+        iter_qm9_archive(qm9_test_archive, max_workers=0),
+        on_result=lambda file_id, energies: results.update({file_id: energies}),
+    )
+    assert stats["done"] == 9
+    assert stats["failed"] == 1
+    assert "000003" not in results
+
+
+def test_async_driver_timeout(qm9_test_archive, fake_g16, monkeypatch, tmp_path):
+    """Jobs over job_timeout are killed, and counted as failed"""
+    monkeypatch.setenv("FAKE_G16_HANG", "000003.xyz")
+    driver = AsyncJobDriver(str(tmp_path / "computation"), get_gaussian_arguments(), cores=4,
+                            job_timeout=1.0)
+    stats = driver.run(iter_qm9_archive(qm9_test_archive, max_workers=0))
+    assert stats["done"] == 9
+    assert stats["failed"] == 1
+
+
+@pytest.mark.parametrize("cancel", [False, True])
+def test_run_async_kill(qm9_test_archive, fake_g16, monkeypatch, tmp_path, cancel):
+    """g16 is killed, with the processes it started, on timeout or cancellation"""
+    # Unique duration, to find the sleep started by g16 among all processes
+    sleep = "61.{}".format(int(cancel))
+    monkeypatch.setenv("FAKE_G16_SLEEP", sleep)
+    file_id, molecule = next(iter_qm9_archive(qm9_test_archive, max_workers=0))
+    job = GaussianJob(str(tmp_path), file_id, molecule, file_id, get_gaussian_arguments())
+    job.setup_computation()
+    if cancel:
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(asyncio.wait_for(job.run_async(), 0.5))
+    else:
+        with pytest.raises(subprocess.TimeoutExpired):
+            asyncio.run(job.run_async(timeout=0.5))
+    assert "sleep " + sleep not in subprocess.run(
+        ["ps", "-eo", "args"], capture_output=True, text=True, check=True
+    ).stdout
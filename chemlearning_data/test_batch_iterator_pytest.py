@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for the prefetching minibatch iterator"""
+
+import pickle
+import numpy
+from chemlearning_data.batch_iterator import (
+    BlockShuffleIterator,
+    TimedIterator,
+    concat_arrays,
+    split_blocks,
+)
+from chemlearning_data.feature_cache import FeatureCache
+import pytest
+
+
+@pytest.fixture
+def arrays(tmp_path):
+    """Memory-mapped features and labels of 1000 molecules; labels are row numbers"""
+    features = numpy.arange(1000 * 3, dtype=numpy.float32).reshape(1000, 3)
+    labels = numpy.arange(1000, dtype=numpy.int64)
+    numpy.save(str(tmp_path / "features.npy"), features)
+    numpy.save(str(tmp_path / "labels.npy"), labels)
+    return (numpy.load(str(tmp_path / "features.npy"), mmap_mode="r"),
+            numpy.load(str(tmp_path / "labels.npy"), mmap_mode="r"))
+
+
+def epoch_rows(iterator):
+    """Row numbers of the batches of one epoch"""
+    rows = list()
+    while True:
+        features, labels = iterator.next()
+        assert numpy.array_equal(features[:, 0], labels * 3)
+        rows.append(labels)
+        if iterator.is_new_epoch:
+            return numpy.concatenate(rows)
+
+
+def test_epochs(arrays):
+    """Each epoch covers every row once, in a new order, in full batches but the last"""
+    iterator = BlockShuffleIterator(arrays, 64, block_size=100, buffer_blocks=3, seed=1)
+    first = epoch_rows(iterator)
+    assert iterator.epoch == 1
+    assert numpy.array_equal(numpy.sort(first), numpy.arange(1000))
+    assert not numpy.array_equal(first, numpy.arange(1000))
+    second = epoch_rows(iterator)
+    assert iterator.epoch == 2
+    assert numpy.array_equal(numpy.sort(second), numpy.arange(1000))
+    assert not numpy.array_equal(first, second)
+    iterator.finalize()
+
+
+def test_blocks(arrays):
+    """Rows of a buffer come from buffer_blocks whole blocks"""
+    iterator = BlockShuffleIterator(arrays, 100, block_size=100, buffer_blocks=2, seed=3)
+    rows = epoch_rows(iterator)
+    iterator.finalize()
+    for start in range(0, 1000, 200):
+        assert len(set(rows[start:start + 200] // 100)) == 2
+
+
+def test_deterministic(arrays):
+    """Same seed, same batches, also after reset; another seed, another order"""
+    first = BlockShuffleIterator(arrays, 64, block_size=100, seed=5)
+    second = BlockShuffleIterator(arrays, 64, block_size=100, seed=5)
+    other = BlockShuffleIterator(arrays, 64, block_size=100, seed=6)
+    rows = epoch_rows(first)
+    assert numpy.array_equal(rows, epoch_rows(second))
+    assert not numpy.array_equal(rows, epoch_rows(other))
+    first.next()
+    first.reset()
+    assert first.epoch == 0
+    assert numpy.array_equal(rows, epoch_rows(first))
+    for iterator in (first, second, other):
+        iterator.finalize()
+
+
+def test_shards(arrays):
+    """Shards are disjoint, as large as each other, and cover all but extra blocks"""
+    shards = [
+        BlockShuffleIterator(arrays, 32, block_size=100, seed=2, shard=shard, num_shards=3)
+        for shard in range(3)
+    ]
+    rows = [epoch_rows(shard) for shard in shards]
+    assert [len(shard_rows) for shard_rows in rows] == [300, 300, 300]
+    assert len(numpy.unique(numpy.concatenate(rows))) == 900
+    assert shards[0].rows_per_epoch == 300
+    for shard in shards:
+        shard.finalize()
+    with pytest.raises(ValueError):
+        BlockShuffleIterator(arrays, 32, shard=3, num_shards=3)
+
+
+def test_indices(arrays):
+    """Split by whole blocks, then iterate over a part without repeating"""
+    train, validation = split_blocks(1000, 0.7, seed=4, block_size=100)
+    assert len(train) == 700 and len(validation) == 300
+    assert len(numpy.intersect1d(train, validation)) == 0
+    iterator = BlockShuffleIterator(arrays, 64, indices=validation, block_size=100,
+                                    shuffle=False, repeat=False)
+    rows = numpy.concatenate([labels for _, labels in iterator])
+    assert numpy.array_equal(rows, validation)
+    assert iterator.epoch == 1
+    iterator.finalize()
+
+
+def test_errors(arrays):
+    """Arrays of different lengths are refused, reading errors reach the caller"""
+    with pytest.raises(ValueError):
+        BlockShuffleIterator((arrays[0], arrays[1][:10]), 16)
+    iterator = BlockShuffleIterator(arrays, 16, indices=numpy.array([0, 5000]))
+    with pytest.raises(IndexError):
+        iterator.next()
+    iterator.finalize()
+
+
+def test_pickle(arrays):
+    """A copy, as sent to another process, starts again from its epoch"""
+    iterator = BlockShuffleIterator(arrays, 64, block_size=100, seed=7)
+    rows = epoch_rows(iterator)
+    copy = pickle.loads(pickle.dumps(iterator))
+    iterator.finalize()
+    assert copy.epoch == 1
+    copy.reset()
+    assert numpy.array_equal(rows, epoch_rows(copy))
+    copy.finalize()
+
+
+def test_timed(arrays):
+    """Counters of batches taken, reset by take_stats; other attributes are passed on"""
+    timed = TimedIterator(BlockShuffleIterator(arrays, 64, block_size=100))
+    rows = epoch_rows(timed)
+    assert timed.epoch == 1
+    stats = timed.take_stats()
+    assert stats["samples"] == len(rows) == 1000
+    assert stats["batches"] == 16
+    assert stats["wait_time"] > 0
+    assert timed.take_stats() == {"samples": 0, "batches": 0, "wait_time": 0.0}
+    timed.finalize()
+
+
+def test_concat_arrays(tmp_path):
+    """Ragged columns, as loaded from the feature cache, are padded in batches"""
+    cache = FeatureCache(str(tmp_path))
+    atoms = numpy.empty(4, dtype=object)
+    atoms[:] = [numpy.arange(1, natoms + 1, dtype=numpy.int32) for natoms in (2, 4, 1, 3)]
+    dataset = cache.save("key", (atoms, numpy.arange(4, dtype=numpy.float32)))
+    iterator = BlockShuffleIterator(dataset, 4, shuffle=False, repeat=False)
+    padded, labels = concat_arrays(iterator.next())
+    iterator.finalize()
+    assert padded.dtype == numpy.int32
+    assert padded.tolist() == [[1, 2, 0, 0], [1, 2, 3, 4], [1, 0, 0, 0], [1, 2, 3, 0]]
+    assert labels.tolist() == [0, 1, 2, 3]
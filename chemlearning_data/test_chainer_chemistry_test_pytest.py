@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for training with chainer, skipped without chainer and chainer_chemistry"""
+
+import numpy
+import pytest
+
+pytest.importorskip("chainer")
+pytest.importorskip("chainer_chemistry")
+
+# pylint: disable=wrong-import-position
+from chainer_chemistry.models import MLP, NFP
+from chemlearning_data.chainer_chemistry_test import graph_conv_predictor_class, train
+
+
+def test_train(tmp_path):
+    """One epoch on CPU, with throughput reported"""
+    rng = numpy.random.RandomState(0)
+    atoms = rng.randint(1, 10, size=(16, 5)).astype(numpy.int32)
+    adjacency = (rng.rand(16, 5, 5) < 0.3).astype(numpy.float32)
+    labels = rng.rand(16, 1).astype(numpy.float32)
+    model = graph_conv_predictor_class()(NFP(4, 4, 1), MLP(4, 1))
+    trainer = train(model, (atoms, adjacency, labels), numpy.arange(12), numpy.arange(12, 16),
+                    batch_size=4, epochs=1, out=str(tmp_path))
+    log = trainer.get_extension("LogReport").log
+    assert len(log) == 1
+    assert log[0]["samples_per_second"] > 0.0
+    assert 0.0 <= log[0]["stall_fraction"]
+    assert "validation/main/mae" in log[0]
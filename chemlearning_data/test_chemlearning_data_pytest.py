@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for QM9 reading tools"""
+
+import io
+import logging
+import os
+import re
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cclib.parser.utils import PeriodicTable
+from chemlearning_data.molecule import MoleculeBatch
+from chemlearning_data.chemlearning_data import (
+    QM9_PROPERTIES,
+    compute_dispersion_corrections,
+    get_gaussian_arguments,
+    extract_xyz_geometries,
+    iter_qm9_archive,
+    iter_qm9_directory,
+    make_executor,
+    parse_qm9_xyz,
+    submit_bounded,
+)
+from chemlearning_data.molecule import element_symbols
+import pytest
+
+
+@pytest.fixture
+def reference_molecules(qm9_test_archive):
+    """Molecules parsed member by member from the test archive"""
+    molecules = list()
+    with tarfile.open(name=qm9_test_archive, mode="r:bz2") as qm9_tar:
+        for xyz_file in qm9_tar:
+            file_id = xyz_file.name.split("_")[1].split(".")[0]
+            molecule = extract_xyz_geometries(qm9_tar.extractfile(xyz_file))
+            molecules.append((file_id, molecule))
+    return molecules
+
+
+def assert_same_molecules(molecules, reference):
+    """Compare two lists of (file_id, Molecule)"""
+    assert [file_id for file_id, _ in molecules] == [file_id for file_id, _ in reference]
+    for (_, molecule), (_, expected) in zip(molecules, reference):
+        assert list(molecule.elements_list) == list(expected.elements_list)
+        assert [list(atom) for atom in molecule.coordinates] == [
+            list(atom) for atom in expected.coordinates
+        ]
+
+
+@pytest.mark.parametrize("max_workers", [0, 2])
+def test_iter_qm9_archive(qm9_test_archive, reference_molecules, max_workers):
+    """Streaming reader gives the same molecules, in the same order, as the tar walk"""
+    molecules = list(iter_qm9_archive(qm9_test_archive, max_workers=max_workers, chunk_size=3))
+    assert_same_molecules(molecules, reference_molecules)
+
+
+@pytest.mark.parametrize("max_workers", [0, 2])
+def test_iter_qm9_directory(qm9_test_archive, reference_molecules, max_workers, tmp_path):
+    """Reading an extracted folder gives the same molecules as the archive"""
+    with tarfile.open(name=qm9_test_archive, mode="r:bz2") as qm9_tar:
+        qm9_tar.extractall(str(tmp_path))
+    molecules = list(iter_qm9_directory(str(tmp_path), max_workers=max_workers, chunk_size=4))
+    assert_same_molecules(molecules, reference_molecules)
+
+
+def legacy_extract_xyz_geometries(xyz_file):
+    """Line by line parser formerly used by extract_xyz_geometries, kept as reference"""
+    coordinates = list()
+    atoms = list()
+    n_atoms = int(xyz_file.readline())
+    xyz_file.readline()
+    for line in xyz_file.readlines()[0:n_atoms]:
+        line = [elem.decode("utf-8") for elem in line.split(b"\t")]
+        atoms.append(str(line[0]))
+        coords = line[1:4]
+        for j, word in enumerate(coords):
+            if "*^" in word:
+                values = re.split(r"\*\^", word)
+                coords[j] = float(values[0]) * pow(10, int(values[1]))
+            else:
+                coords[j] = float(word)
+        coordinates.append(coords)
+    periodic_table = PeriodicTable()
+    return coordinates, [periodic_table.number[atom] for atom in atoms]
+
+
+def test_extract_xyz_geometries_matches_legacy(qm9_test_archive):
+    """Fast parser gives exactly the same geometries as the line by line parser"""
+    with tarfile.open(name=qm9_test_archive, mode="r:bz2") as qm9_tar:
+        for xyz_file in qm9_tar:
+            content = qm9_tar.extractfile(xyz_file).read()
+            coordinates, elements_list = legacy_extract_xyz_geometries(io.BytesIO(content))
+            molecule = extract_xyz_geometries(io.BytesIO(content))
+            assert molecule.coordinates.shape == (len(elements_list), 3)
+            assert molecule.coordinates.tolist() == coordinates
+            assert list(molecule.elements_list) == elements_list
+
+
+def test_parse_qm9_xyz():
+    """Properties, SMILES and InChI are parsed along with the geometry"""
+    content = (
+        b"3\n"
+        b"gdb 3\t799.58812\t437.90386\t282.94545\t1.8511\t6.31\t-0.2928\t0.0687\t"
+        b"0.3615\t19.0002\t0.021375\t-76.404702\t-76.401867\t-76.400922\t"
+        b"-76.422349\t6.002\t\n"
+        b"O\t-0.0343604951\t 0.9775395708\t 0.0076015923\t-0.589706\n"
+        b"H\t 0.0647664923\t 0.0205721989\t 0.0015346341\t 0.294853\n"
+        b"H\t 0.8717903737\t 1.3007924048\t 1.999*^-6\t 0.294853\n"
+        b"1591.1049\t3710.9279\t3814.6513\n"
+        b"O\tO\t\n"
+        b"InChI=1S/H2O/h1H2\tInChI=1S/H2O/h1H2\n"
+    )
+    molecule, properties, identifiers = parse_qm9_xyz(content)
+    assert list(molecule.elements_list) == [8, 1, 1]
+    assert molecule.coordinates[2, 2] == pytest.approx(1.999e-6)
+    assert len(properties) == len(QM9_PROPERTIES) == 15
+    assert properties["A"] == 799.58812
+    assert properties["homo"] == -0.2928
+    assert properties["Cv"] == 6.002
+    assert identifiers == {
+        "smiles_gdb": "O",
+        "smiles_relaxed": "O",
+        "inchi_gdb": "InChI=1S/H2O/h1H2",
+        "inchi_relaxed": "InChI=1S/H2O/h1H2",
+    }
+
+
+def test_submit_bounded():
+    """Jobs are submitted as others end, never more than the window at once"""
+    state = {"running": 0, "peak": 0, "submitted": 0}
+    lock = threading.Lock()
+
+    def job(value):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.01)
+        with lock:
+            state["running"] -= 1
+        return value * 2
+
+    def jobs():
+        for value in range(50):
+            state["submitted"] += 1
+            yield value, job, {"value": value}
+
+    results = dict()
+
+    def on_done(key, future):
+        # Jobs are pulled lazily: the window, plus the one waiting for a slot
+        assert state["submitted"] - len(results) <= 4 + 1
+        results[key] = future.result()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        submit_bounded(executor, jobs(), on_done, max_in_flight=4)
+    assert results == {value: value * 2 for value in range(50)}
+    assert state["peak"] <= 4
+
+
+@pytest.mark.parametrize("link1", [False, True])
+def test_compute_dispersion_corrections(qm9_test_archive, fake_g16, monkeypatch, tmp_path, link1):
+    """A chunk of molecules is computed in one task, failures reported per molecule"""
+    monkeypatch.setenv("FAKE_G16_FAIL", "000003.xyz")
+    molecules = list(iter_qm9_archive(qm9_test_archive, max_workers=0))
+    batch = MoleculeBatch.from_molecules(
+        [molecule for _, molecule in molecules], file_ids=[file_id for file_id, _ in molecules]
+    )
+    locations = {"computations": str(tmp_path / "computation"),
+                 "profiles": str(tmp_path / "profiles"), "profile_rate": 1.0}
+    results = compute_dispersion_corrections(
+        batch, locations, get_gaussian_arguments(), link1=link1
+    )
+    assert [result[0] for result in results] == batch.file_ids
+    for file_id, energies, error, seconds, timings in results:
+        assert timings["run"] > 0
+        if link1 or file_id != "000003":
+            assert energies["enthalpy"] == -40.469780
+            assert error is None
+            assert (seconds is None) == link1
+            assert {"setup", "run", "parse", "cleanup"} <= set(timings)
+        else:
+            assert energies is None
+            assert error
+    profiles = os.listdir(str(tmp_path / "profiles"))
+    assert len(profiles) == (1 if link1 else len(batch))
+
+
+def worker_state():
+    """Run in pool workers: whether init_worker ran before the task"""
+    return element_symbols.cache_info().currsize == 1 and bool(logging.getLogger().handlers)
+
+
+def test_lazy_imports():
+    """cclib is only imported when a lookup table is first used"""
+    code = ("import sys, chemlearning_data.chemlearning_data as c; a = 'cclib' in sys.modules; "
+            "c.parse_qm9_xyz; c.atomic_numbers(); print(a, 'cclib' in sys.modules)")
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True,
+                            cwd=os.path.dirname(os.path.dirname(__file__)), text=True).stdout
+    assert output.split() == ["False", "True"]
+
+
+@pytest.mark.parametrize("start_method", [None, "forkserver"])
+def test_make_executor(start_method):
+    """Workers are set up by init_worker before their first task"""
+    with make_executor(2, start_method) as executor:
+        assert all(executor.submit(worker_state).result() for _ in range(4))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for the incremental, versioned dataset store"""
+
+import os
+import numpy
+from chemlearning_data.chemlearning_data import pack_qm9_archive
+from chemlearning_data.dataset_store import DatasetStore
+from chemlearning_data.graph_features import featurize_archive
+from chemlearning_data.result_store import ResultWriter
+import pytest
+
+
+def add_results(directory, file_ids):
+    """Write results for file_ids, their enthalpy being minus their id"""
+    with ResultWriter(directory) as writer:
+        for file_id in file_ids:
+            writer.add(file_id, {"scfenergy": -1.0, "enthalpy": -float(file_id),
+                                 "freeenergy": None})
+
+
+def assert_same(arrays, expected):
+    """Same dataset columns"""
+    assert len(arrays) == len(expected)
+    for array, expected_array in zip(arrays, expected):
+        assert numpy.array_equal(array, expected_array)
+
+
+@pytest.fixture(params=["tar", "pack"])
+def archive(request, qm9_test_archive, tmp_path):
+    """Test archive, as is or packed"""
+    if request.param == "tar":
+        return qm9_test_archive
+    path = str(tmp_path / "qm9.pack")
+    pack_qm9_archive(qm9_test_archive, path, block_size=4)
+    return path
+
+
+def test_update(archive, tmp_path):
+    """Only new results are featurized, and former versions stay as they were"""
+    results = str(tmp_path / "results")
+    store = DatasetStore(str(tmp_path / "dataset"))
+    assert store.latest == 0
+    assert len(store.load()[0]) == 0
+
+    add_results(results, ["000002", "000004"])
+    assert store.update(archive, results, max_workers=0) == 1
+    first = store.load()
+    assert store.file_ids().tolist() == [2, 4]
+
+    add_results(results, ["000001", "000009", "000004"])
+    assert store.update(archive, results, max_workers=0) == 2
+    manifest = store.manifest()
+    assert [chunk["rows"] for chunk in manifest["chunks"]] == [2, 2]
+    assert store.file_ids().tolist() == [2, 4, 1, 9]
+    assert store.load()[2][:, 0].tolist() == [-2.0, -4.0, -1.0, -9.0]
+    # Same features as featurizing everything at once, in another order
+    expected = featurize_archive(archive, results, max_workers=0)
+    order = numpy.argsort(store.file_ids())
+    assert_same([array[order] for array in store.load()], expected)
+    assert_same(store.load(1), first)
+
+    # Nothing new: no new version
+    assert store.update(archive, results, max_workers=0) == 2
+
+
+def test_update_labels(qm9_test_archive, tmp_path):
+    """Recomputed energies replace the labels in the store, in a new version"""
+    results = str(tmp_path / "results")
+    store = DatasetStore(str(tmp_path / "dataset"))
+    add_results(results, ["000002", "000004"])
+    add_results(results, ["000005"])
+    store.update(qm9_test_archive, results, max_workers=0)
+    add_results(results, ["000003"])
+    assert store.update(qm9_test_archive, results, max_workers=0) == 2
+    first = store.manifest()["chunks"]
+
+    with ResultWriter(results) as writer:
+        writer.add("000004", {"scfenergy": -1.0, "enthalpy": -40.0, "freeenergy": None})
+        writer.add("000003", {"scfenergy": -1.0, "enthalpy": None, "freeenergy": None})
+    assert store.update(qm9_test_archive, results, max_workers=0) == 3
+    # Only the chunk with a changed label is rewritten; missing labels are kept
+    chunks = store.manifest()["chunks"]
+    assert chunks[0]["name"] != first[0]["name"]
+    assert chunks[1] == first[1]
+    assert store.file_ids().tolist() == [2, 4, 5, 3]
+    assert store.load()[2][:, 0].tolist() == [-2.0, -40.0, -5.0, -3.0]
+    assert store.load(2)[2][:, 0].tolist() == [-2.0, -4.0, -5.0, -3.0]
+    assert store.manifest()["note"] == "update: 0 molecules, 1 relabelled"
+    assert store.update(qm9_test_archive, results, max_workers=0) == 3
+
+
+def test_compact(qm9_test_archive, tmp_path):
+    """Small chunks are merged in a new version, same rows in the same order"""
+    results = str(tmp_path / "results")
+    store = DatasetStore(str(tmp_path / "dataset"))
+    for file_id in ["000003", "000001", "000007", "000005"]:
+        add_results(results, [file_id])
+        store.update(qm9_test_archive, results, max_workers=0)
+    before = store.load()
+    assert store.latest == 4
+    assert store.compact(min_rows=3) == 5
+    assert [chunk["rows"] for chunk in store.manifest()["chunks"]] == [4]
+    assert_same(store.load(), before)
+    assert_same(store.load(4), before)
+    assert store.compact(min_rows=3) == 5
+
+    # Compaction in the background, while another update commits first
+    add_results(results, ["000002"])
+    store.update(qm9_test_archive, results, max_workers=0)
+    add_results(results, ["000008"])
+    store.update(qm9_test_archive, results, max_workers=0)
+    write_chunk = store._write_chunk
+
+    def write_and_update(arrays):
+        store._write_chunk = write_chunk
+        add_results(results, ["000006"])
+        store.update(qm9_test_archive, results, max_workers=0)
+        return write_chunk(arrays)
+
+    store._write_chunk = write_and_update
+    thread = store.start_compaction(min_rows=3)
+    thread.join()
+    assert store.latest == 9
+    assert [chunk["rows"] for chunk in store.manifest()["chunks"]] == [4, 3]
+    assert store.file_ids().tolist() == [3, 1, 7, 5, 2, 8, 6]
+
+
+def test_prune(qm9_test_archive, tmp_path):
+    """Old versions go, with the chunks only they used"""
+    results = str(tmp_path / "results")
+    store = DatasetStore(str(tmp_path / "dataset"))
+    for file_id in ["000003", "000001", "000007"]:
+        add_results(results, [file_id])
+        store.update(qm9_test_archive, results, max_workers=0)
+    store.compact(min_rows=10)
+    latest = store.load()
+    store.prune(keep=1, grace=0.0)
+    assert store.versions() == [4]
+    assert len(os.listdir(str(tmp_path / "dataset" / "chunks"))) == 1
+    assert_same(store.load(), latest)
+
+
+def test_settings(tmp_path):
+    """A store is reopened with the settings it was built with"""
+    DatasetStore(str(tmp_path), label_names=("enthalpy", "freeenergy"))
+    DatasetStore(str(tmp_path), label_names=["enthalpy", "freeenergy"])
+    with pytest.raises(ValueError):
+        DatasetStore(str(tmp_path))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for batched descriptors"""
+
+import numpy
+from chemlearning_data.chemlearning_data import iter_qm9_archive
+from chemlearning_data.descriptors import (
+    DESCRIPTORS,
+    bag_layout,
+    compute_descriptors,
+    iter_descriptors,
+    write_descriptors,
+)
+from chemlearning_data.molecule import Molecule, MoleculeBatch
+import pytest
+
+
+@pytest.fixture
+def molecules(qm9_test_archive):
+    """Molecules of the test archive"""
+    return [molecule for _, molecule in iter_qm9_archive(qm9_test_archive, max_workers=0)]
+
+
+def naive_coulomb_matrix(molecule):
+    """Reference: Coulomb matrix of a single molecule, element by element"""
+    charges = molecule.elements_list.astype(float)
+    matrix = numpy.zeros((molecule.natoms, molecule.natoms))
+    for i in range(molecule.natoms):
+        for j in range(molecule.natoms):
+            if i == j:
+                matrix[i, j] = 0.5 * charges[i] ** 2.4
+            else:
+                distance = numpy.linalg.norm(molecule.coordinates[i] - molecule.coordinates[j])
+                matrix[i, j] = charges[i] * charges[j] / distance
+    return matrix
+
+
+def naive_bag_of_bonds(molecule):
+    """Reference: bag of bonds of a single molecule, bag by bag"""
+    matrix = naive_coulomb_matrix(molecule)
+    elements = molecule.elements_list.tolist()
+    vector = list()
+    for element_a, element_b, size in bag_layout():
+        if element_b == 0:
+            values = [matrix[i, i] for i, element in enumerate(elements) if element == element_a]
+        else:
+            values = [
+                matrix[i, j] for i in range(len(elements)) for j in range(i + 1, len(elements))
+                if sorted([elements[i], elements[j]]) == [element_a, element_b]
+            ]
+        values = sorted(values, reverse=True)
+        vector.extend(values + [0.0] * (size - len(values)))
+    return numpy.array(vector)
+
+
+def test_descriptors(molecules):
+    """Batched descriptors match per molecule computations"""
+    batch = MoleculeBatch.from_molecules(molecules)
+    descriptors = compute_descriptors(batch)
+    assert set(descriptors) == set(DESCRIPTORS)
+    for index, molecule in enumerate(molecules):
+        natoms = molecule.natoms
+        reference = naive_coulomb_matrix(molecule)
+        coulomb = descriptors["coulomb"][index]
+        assert numpy.allclose(coulomb[:natoms, :natoms], reference)
+        assert not coulomb[natoms:].any() and not coulomb[:, natoms:].any()
+        eigenvalues = numpy.linalg.eigvalsh(reference)
+        eigenvalues = eigenvalues[numpy.argsort(-numpy.abs(eigenvalues))]
+        assert numpy.allclose(descriptors["eigenvalues"][index][:natoms], eigenvalues)
+        assert numpy.allclose(descriptors["eigenvalues"][index][natoms:], 0.0)
+        distances = descriptors["distance"][index][:natoms, :natoms]
+        assert numpy.allclose(distances[0, 1:], numpy.linalg.norm(
+            molecule.coordinates[1:] - molecule.coordinates[0], axis=1))
+        assert numpy.allclose(descriptors["bag_of_bonds"][index], naive_bag_of_bonds(molecule))
+
+
+def test_unknown_element():
+    """Elements outside of the bag layout are refused"""
+    batch = MoleculeBatch.from_molecules([Molecule([[0.0, 0.0, 0.0], [0.0, 0.0, 1.4]], [1, 17])])
+    with pytest.raises(ValueError):
+        compute_descriptors(batch, names=["bag_of_bonds"])
+    assert compute_descriptors(batch, names=["coulomb"])["coulomb"].shape == (1, 29, 29)
+
+
+def test_write_descriptors(qm9_test_archive, molecules, tmp_path):
+    """Chunks on disk hold the same descriptors, in archive order"""
+    count = write_descriptors(
+        qm9_test_archive, str(tmp_path), names=["eigenvalues"], max_workers=0, chunk_size=4
+    )
+    assert count == 10
+    chunks = list(iter_descriptors(str(tmp_path), names=["eigenvalues"]))
+    assert len(chunks) == 3
+    file_ids = numpy.concatenate([chunk["file_id"] for chunk in chunks])
+    assert file_ids.tolist() == list(range(1, 11))
+    eigenvalues = numpy.concatenate([chunk["eigenvalues"] for chunk in chunks])
+    expected = compute_descriptors(MoleculeBatch.from_molecules(molecules), ["eigenvalues"])
+    assert numpy.allclose(eigenvalues, expected["eigenvalues"])
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for the preprocessed dataset cache"""
+
+import numpy
+from chemlearning_data.feature_cache import FeatureCache, RaggedArray, feature_key, file_hash
+import pytest
+
+
+@pytest.fixture
+def arrays():
+    """A dataset as made by preprocessors: ragged atom arrays, padded matrices, labels"""
+    atoms = numpy.empty(3, dtype=object)
+    for i, natoms in enumerate([2, 5, 3]):
+        atoms[i] = numpy.arange(natoms, dtype=numpy.int32) + i
+    adjacency = numpy.arange(3 * 4 * 4, dtype=numpy.float32).reshape(3, 4, 4)
+    labels = numpy.array([[0.1], [0.2], [0.3]], dtype=numpy.float32)
+    return atoms, adjacency, labels
+
+
+def test_round_trip(arrays, tmp_path):
+    """Arrays come back equal, memory-mapped"""
+    cache = FeatureCache(str(tmp_path))
+    assert cache.load("key") is None
+    cache.save("key", arrays)
+    assert "key" in cache
+    atoms, adjacency, labels = cache.load("key")
+    assert isinstance(atoms, RaggedArray)
+    assert isinstance(adjacency, numpy.memmap)
+    assert numpy.array_equal(adjacency, arrays[1])
+    assert numpy.array_equal(labels, arrays[2])
+    for loaded, original in zip(atoms, arrays[0]):
+        assert numpy.array_equal(loaded, original)
+        assert loaded.dtype == numpy.int32
+    assert [len(item) for item in atoms[1:]] == [5, 3]
+    assert numpy.array_equal(atoms[-1], arrays[0][-1])
+    with pytest.raises(IndexError):
+        atoms[3]
+
+
+def test_ragged_shapes():
+    """Items keep their shape"""
+    matrices = [numpy.ones((n, n)) * n for n in (1, 3, 2)]
+    ragged = RaggedArray.from_arrays(matrices)
+    assert [item.shape for item in ragged] == [(1, 1), (3, 3), (2, 2)]
+    assert ragged[numpy.array([2, 0])][0][0, 0] == 2.0
+
+
+def test_feature_key(tmp_path):
+    """Keys depend on preprocessor, its arguments, labels and source"""
+    source = tmp_path / "qm9.csv"
+    source.write_text("gdb_idx,homo\n1,-0.38\n")
+    source_hash = file_hash(str(source))
+    key = feature_key("nfp", "homo", source_hash)
+    assert key == feature_key("nfp", ["homo"], source_hash)
+    assert key != feature_key("ggnn", "homo", source_hash)
+    assert key != feature_key("nfp", ["homo", "lumo"], source_hash)
+    assert key != feature_key("nfp", "homo", source_hash, {"out_size": 9})
+    source.write_text("gdb_idx,homo\n1,-0.39\n")
+    assert key != feature_key("nfp", "homo", file_hash(str(source)))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for Gaussian job class"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from cclib.parser.utils import PeriodicTable
+from chemlearning_data.chemlearning_data import get_gaussian_arguments, iter_qm9_archive
+from chemlearning_data.gaussian_job import (
+    GaussianJob,
+    LinkedGaussianJob,
+    build_input_scripts,
+)
+from chemlearning_data.gaussian_log import parse_content, split_steps
+import pytest
+
+
+def legacy_input_script(name, molecule, gaussian_args):
+    """Input file as formerly rendered by GaussianJob, kept as reference"""
+    periodic_table = PeriodicTable()
+    script = ["%NProcShared=1"]
+    route = "# " + gaussian_args["functional"] + " "
+    if gaussian_args["dispersion"] is not None:
+        route += "EmpiricalDispersion=" + gaussian_args["dispersion"] + " "
+    script.extend([route + "gen freq", "", name, "", "0 1"])
+    script.extend(
+        " ".join(
+            [periodic_table.element[molecule.elements_list.tolist()[i]].ljust(5)]
+            + ["{:.6f}".format(s).rjust(25) for s in atom.tolist()]
+        )
+        for i, atom in enumerate(molecule.coordinates)
+    )
+    script.append("")
+    elements = [periodic_table.element[el] for el in set(molecule.elements_list.tolist())]
+    script.extend([" ".join(elements) + " 0", gaussian_args["basisset"], "****", ""])
+    script.extend(["", ""])
+    return "\n".join(script)
+
+
+@pytest.fixture(params=[get_gaussian_arguments(), dict(get_gaussian_arguments(), dispersion=None)])
+def qm9_jobs(request, tmp_path, qm9_test_archive):
+    """Gaussian jobs for all molecules of the test archive"""
+    return [
+        GaussianJob(
+            basedir=str(tmp_path),
+            name=file_id + ".xyz",
+            molecule=molecule,
+            job_id=file_id,
+            gaussian_args=request.param,
+        )
+        for file_id, molecule in iter_qm9_archive(qm9_test_archive, max_workers=0)
+    ]
+
+
+def test_build_input_script(qm9_jobs):
+    """Input files are the same, byte for byte, as with the former rendering"""
+    for job in qm9_jobs:
+        expected = legacy_input_script(job.name, job.molecule, job.gaussian_args)
+        assert "\n".join(job.build_input_script()) == expected
+
+
+def test_build_input_scripts(qm9_jobs):
+    """Batch rendering gives the same input files as job by job rendering"""
+    expected = ["\n".join(job.build_input_script()) for job in qm9_jobs]
+    assert build_input_scripts(qm9_jobs) == expected
+
+
+def test_concurrent_jobs(qm9_jobs, fake_g16, monkeypatch):
+    """Many jobs run at once from threads, each in its own directory"""
+    monkeypatch.setenv("FAKE_G16_SLEEP", "0.2")
+    cwd = os.getcwd()
+    jobs = [
+        GaussianJob(job.basedir, job.name, job.molecule, i, job.gaussian_args)
+        for i, job in enumerate(qm9_jobs * 4)
+    ]
+
+    def run_job(job):
+        job.setup_computation()
+        job.run()
+        with open(job.output_path, mode="r") as out_file:
+            return out_file.read()
+
+    with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+        outputs = list(executor.map(run_job, jobs))
+
+    assert os.getcwd() == cwd
+    for job, output in zip(jobs, outputs):
+        assert "\n".join(job.build_input_script()) in output
+        assert "Normal termination" in output
+        job.cleanup()
+        assert not os.path.exists(job.path)
+
+
+def test_linked_job(qm9_jobs, fake_g16, tmp_path):
+    """Steps are chained in one input, and energies split back per step"""
+    job = LinkedGaussianJob(str(tmp_path), "linked", qm9_jobs, job_id=1)
+    script = "\n".join(job.build_input_script())
+    assert script.split("\n--Link1--\n") == [
+        "\n".join(step.build_input_script()) for step in qm9_jobs
+    ]
+    job.setup_computation()
+    job.run()
+    energies = job.get_energies()
+    assert len(energies) == len(qm9_jobs)
+    assert all(step["enthalpy"] == -40.469780 for step in energies)
+    # No orientation nor NPA blocks in the fake output
+    assert job.extract_natural_charges() == [[]] * len(qm9_jobs)
+    shapes = [coordinates.shape for coordinates in job.get_coordinates()]
+    assert shapes == [(0, 3)] * len(qm9_jobs)
+
+    # Output ending after a failed second step: no results for the next ones
+    with open(job.output_path, mode="wb") as output:
+        output.write(b" SCF Done:  E(RB3LYP) =  -1.0     A.U. after    9 cycles\n"
+                     b" Normal termination of Gaussian 16\n"
+                     b" Error termination via Lnk1e in l502.exe\n")
+    truncated = LinkedGaussianJob(str(tmp_path), "linked", qm9_jobs, job_id=1)
+    missing = [None] * (len(qm9_jobs) - 2)
+    assert truncated.extract_natural_charges() == [[], []] + missing
+    assert truncated.get_coordinates()[2:] == missing
+    job.cleanup()
+
+
+def test_split_steps():
+    """A failed step ends the output of a linked job"""
+    content = (
+        b" SCF Done:  E(RB3LYP) =  -1.0     A.U. after    9 cycles\n"
+        b" Normal termination of Gaussian 16\n"
+        b" Error termination via Lnk1e in l502.exe\n"
+    )
+    steps = split_steps(content)
+    assert len(steps) == 2
+    assert parse_content(steps[0]).energies["scfenergy"] is not None
+    assert parse_content(steps[1]).energies["scfenergy"] is None
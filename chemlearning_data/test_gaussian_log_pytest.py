@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for the Gaussian output parser"""
+
+import logging
+from cclib.io import ccread
+from chemlearning_data.gaussian_log import parse_gaussian_log
+import numpy
+import pytest
+
+SAMPLE_LOG = """ Copyright (c) 1988-2017, Gaussian, Inc.  All Rights Reserved.
+ Gaussian 16:  ES64L-G16RevA.03 25-Dec-2016
+                         Standard orientation:
+ ---------------------------------------------------------------------
+ Center     Atomic      Atomic             Coordinates (Angstroms)
+ Number     Number       Type             X           Y           Z
+ ---------------------------------------------------------------------
+      1          6           0       -0.012000    1.085000    0.008000
+      2          7           0        0.002000   -0.006000    0.001000
+      3          1           0        1.011000    1.463000    0.000000
+ ---------------------------------------------------------------------
+ SCF Done:  E(RB3LYP) =  -93.4000000000     A.U. after   12 cycles
+                         Standard orientation:
+ ---------------------------------------------------------------------
+ Center     Atomic      Atomic             Coordinates (Angstroms)
+ Number     Number       Type             X           Y           Z
+ ---------------------------------------------------------------------
+      1          6           0       -0.013324    1.132466    0.008276
+      2          7           0        0.002311   -0.019159    0.001929
+      3          1           0       -0.027803    2.198949    0.014154
+ ---------------------------------------------------------------------
+ SCF Done:  E(RB3LYP) =  -93.4188253020     A.U. after    9 cycles
+ Summary of Natural Population Analysis:
+
+                                     Natural Population
+              Natural  -----------------------------------------------
+    Atom No    Charge         Core      Valence    Rydberg      Total
+ -----------------------------------------------------------------------
+      C    1    0.09230      1.99919     3.86873    0.03978     5.90770
+      N    2   -0.31442      1.99957     5.28883    0.02602     7.31442
+      H    3    0.22212      0.00000     0.77546    0.00242     0.77788
+ =======================================================================
+ Sum of electronic and zero-point Energies=            -93.402213
+ Sum of electronic and thermal Energies=               -93.399588
+ Sum of electronic and thermal Enthalpies=             -93.398644
+ Sum of electronic and thermal Free Energies=          -93.421871
+ Normal termination of Gaussian 16 at Mon Jan  1 00:00:00 2019.
+"""
+
+
+@pytest.fixture
+def sample_log(tmp_path):
+    """Path to a small optimization log"""
+    path = tmp_path / "sample.log"
+    path.write_text(SAMPLE_LOG)
+    return str(path)
+
+
+def test_parse_gaussian_log(sample_log):
+    """All values are extracted in one pass"""
+    data = parse_gaussian_log(sample_log)
+    assert len(data.scfenergies) == 2
+    assert data.enthalpy == -93.398644
+    assert data.freeenergy == -93.421871
+    assert data.atomnos.tolist() == [6, 7, 1]
+    assert data.atomcoords[2].tolist() == [-0.027803, 2.198949, 0.014154]
+    assert data.natural_charges == [0.09230, -0.31442, 0.22212]
+    assert data.normal_termination
+
+
+def test_parse_gaussian_log_matches_cclib(sample_log):
+    """Values are the same as with a full parse by cclib"""
+    data = parse_gaussian_log(sample_log)
+    reference = ccread(sample_log, loglevel=logging.ERROR)
+    numpy.testing.assert_array_equal(data.scfenergies, reference.scfenergies)
+    assert data.enthalpy == reference.enthalpy
+    assert data.freeenergy == reference.freeenergy
+    numpy.testing.assert_array_equal(data.atomnos, reference.atomnos)
+    numpy.testing.assert_array_equal(data.atomcoords, reference.atomcoords[-1])
+    numpy.testing.assert_array_equal(data.natural_charges, reference.atomcharges["natural"])
+
+
+def test_parse_empty_log(tmp_path):
+    """A job that died before writing anything gives empty results"""
+    path = tmp_path / "empty.log"
+    path.write_text("")
+    data = parse_gaussian_log(str(path))
+    assert data.energies == {"scfenergy": None, "enthalpy": None, "freeenergy": None}
+    assert not data.normal_termination
+
+
+
+@pytest.mark.parametrize("end, scf_count, atomnos", [
+    # In the last orientation table
+    ("      3          1           0       -0.027803", 1, []),
+    # Before and in the NPA table
+    (" Summary of Natural Population Analysis:\n", 2, [6, 7, 1]),
+    ("      N    2   -0.31442", 2, [6, 7, 1]),
+])
+def test_parse_truncated_log(tmp_path, end, scf_count, atomnos):
+    """A job killed while writing a table gives no values from that table"""
+    path = tmp_path / "truncated.log"
+    path.write_text(SAMPLE_LOG[:SAMPLE_LOG.index(end) + len(end)])
+    data = parse_gaussian_log(str(path))
+    assert len(data.scfenergies) == scf_count
+    assert data.atomnos.tolist() == atomnos
+    assert data.atomcoords.shape == (len(atomnos), 3)
+    assert data.natural_charges == []
+    assert not data.normal_termination
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for graph features"""
+
+import numpy
+from chemlearning_data.chemlearning_data import iter_qm9_archive
+from chemlearning_data.graph_features import (
+    BOND_TOLERANCE,
+    _RADII,
+    energy_labels,
+    featurize_archive,
+    find_bonds,
+    graph_features,
+)
+from chemlearning_data.molecule import MoleculeBatch
+from chemlearning_data.result_store import ResultWriter, load_results
+import pytest
+
+
+@pytest.fixture
+def batch(qm9_test_archive):
+    """All molecules of the test archive"""
+    molecules = list(iter_qm9_archive(qm9_test_archive, max_workers=0))
+    return MoleculeBatch.from_molecules(
+        [molecule for _, molecule in molecules], file_ids=[file_id for file_id, _ in molecules]
+    )
+
+
+def brute_force_bonds(batch):
+    """Reference: compare all pairs of atoms of each molecule"""
+    bonds = list()
+    for start, end in zip(batch.offsets[:-1].tolist(), batch.offsets[1:].tolist()):
+        for i in range(start, end):
+            for j in range(i + 1, end):
+                distance = numpy.linalg.norm(batch.coordinates[i] - batch.coordinates[j])
+                limit = _RADII[batch.elements[i]] + _RADII[batch.elements[j]] + BOND_TOLERANCE
+                if distance < limit:
+                    bonds.append((i, j))
+    return bonds
+
+
+def test_find_bonds(batch):
+    """Cell lists give the same bonds as comparing all pairs, even for shifted molecules"""
+    i, j = find_bonds(batch)
+    assert list(zip(i.tolist(), j.tolist())) == brute_force_bonds(batch)
+    # Same molecules, far away and in random places: nothing changes
+    rng = numpy.random.default_rng(0)
+    shifts = rng.uniform(-1000.0, 1000.0, size=(len(batch), 3))
+    moved = MoleculeBatch(
+        batch.coordinates + numpy.repeat(shifts, batch.natoms, axis=0),
+        batch.elements,
+        batch.offsets,
+    )
+    moved_i, moved_j = find_bonds(moved)
+    assert numpy.array_equal(moved_i, i) and numpy.array_equal(moved_j, j)
+
+
+def test_graph_features(batch):
+    """Padded atom arrays and symmetric adjacency matrices, as NFP expects"""
+    atoms, adjacency = graph_features(batch)
+    assert atoms.shape == (10, 9) and adjacency.shape == (10, 9, 9)
+    # Ethane, hydrogens removed: two bonded carbons
+    assert atoms[3].tolist() == [6, 6] + [0] * 7
+    assert adjacency[3, :2, :2].tolist() == [[1.0, 1.0], [1.0, 1.0]]
+    assert adjacency[3, 2:].sum() == 0.0
+    assert numpy.array_equal(adjacency, adjacency.transpose(0, 2, 1))
+
+    atoms, adjacency = graph_features(batch, explicit_hydrogens=True, self_connection=False)
+    assert atoms.shape == (10, 29)
+    # Methane: carbon bonded to 4 hydrogens
+    assert adjacency[0, 0].sum() == 4.0
+    with pytest.raises(ValueError):
+        graph_features(batch, max_atoms=4, explicit_hydrogens=True)
+
+
+def test_energy_labels(batch, qm9_test_archive, tmp_path):
+    """Labels are joined on file ids; molecules without results are left out"""
+    with ResultWriter(str(tmp_path)) as writer:
+        for file_id in ["000009", "000002", "000004"]:
+            writer.add(file_id, {"scfenergy": -1.0, "enthalpy": -float(file_id),
+                                 "freeenergy": None})
+    results = load_results(str(tmp_path))
+    rows, labels = energy_labels(batch.file_ids, results)
+    assert rows.tolist() == [1, 3, 8]
+    assert labels[:, 0].tolist() == [-2.0, -4.0, -9.0]
+    rows, labels = energy_labels(batch.file_ids, results, ("scfenergy", "freeenergy"))
+    assert len(rows) == 0 and labels.shape == (0, 2)
+
+    atoms, adjacency, labels = featurize_archive(qm9_test_archive, str(tmp_path), max_workers=0)
+    assert len(atoms) == len(adjacency) == len(labels) == 3
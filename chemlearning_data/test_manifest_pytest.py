@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for the run manifest"""
+
+from chemlearning_data.chemlearning_data import get_gaussian_arguments
+from chemlearning_data.manifest import DONE, FAILED, PENDING, RUNNING, RunManifest
+
+ENERGIES = {"scfenergy": -1102.56, "enthalpy": -40.46978, "freeenergy": -40.491059}
+
+
+def test_manifest_resume(tmp_path):
+    """A reopened manifest knows finished jobs, and requeues the running ones"""
+    path = str(tmp_path / "manifest.sqlite")
+    with RunManifest(path, get_gaussian_arguments()) as manifest:
+        manifest.mark_running(["000001", "000002", "000003", "000004"])
+        manifest.mark_done("000001", ENERGIES)
+        manifest.mark_done("000002", ENERGIES)
+        manifest.mark_failed("000003", RuntimeError("g16 returned 1"))
+
+    # Simulated crash: 000004 was left running
+    with RunManifest(path, get_gaussian_arguments()) as manifest:
+        assert manifest.requeue_running() == 1
+        assert manifest.completed_ids() == {"000001", "000002"}
+        assert manifest.counts() == {PENDING: 1, RUNNING: 0, DONE: 2, FAILED: 1}
+        assert manifest.results() == [("000001", ENERGIES), ("000002", ENERGIES)]
+
+
+def test_manifest_arguments(tmp_path):
+    """Jobs computed with other arguments are not considered done"""
+    path = str(tmp_path / "manifest.sqlite")
+    with RunManifest(path, get_gaussian_arguments()) as manifest:
+        manifest.mark_done("000001", ENERGIES)
+    other_args = dict(get_gaussian_arguments(), basisset="6-311G**")
+    with RunManifest(path, other_args) as manifest:
+        assert manifest.completed_ids() == set()
+
+
+def test_manifest_export(tmp_path):
+    """Results are exported as the tab separated table formerly written by main()"""
+    with RunManifest(str(tmp_path / "manifest.sqlite"), get_gaussian_arguments()) as manifest:
+        manifest.mark_done("000002", ENERGIES)
+        manifest.mark_done("000001", ENERGIES)
+        manifest.export_tsv(str(tmp_path / "qm9_dispersion.data"))
+    with open(str(tmp_path / "qm9_dispersion.data")) as data:
+        assert data.read() == (
+            "File_ID\tSCF_Energy\tEnthalpy\tFree_Energy\n"
+            "000001\t-1102.56\t-40.46978\t-40.491059\n"
+            "000002\t-1102.56\t-40.46978\t-40.491059\n"
+        )
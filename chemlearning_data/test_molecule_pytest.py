@@ -4,7 +4,9 @@
 
 """Tests for molecule class"""
 
-from chemlearning_data.molecule import Molecule
+import pickle
+import numpy
+from chemlearning_data.molecule import Molecule, MoleculeBatch
 import pytest
 
 
@@ -47,3 +49,49 @@ def test_xyz_geometry(molecule_hydrogen, molecule_platinum_hydride):
     assert xyz_geometry_hydrogen == geometry_hydrogen
     xyz_geometry_platinum_hydride = molecule_platinum_hydride.xyz_geometry()
     assert xyz_geometry_platinum_hydride == geometry_platinum_hydride
+
+
+def test_molecule_arrays(molecule_platinum_hydride):
+    """Coordinates and elements are stored as contiguous arrays"""
+    assert molecule_platinum_hydride.coordinates.shape == (5, 3)
+    assert molecule_platinum_hydride.coordinates.dtype == numpy.float64
+    assert molecule_platinum_hydride.elements_list.dtype == numpy.uint8
+    assert molecule_platinum_hydride.natoms == 5
+    with pytest.raises(AttributeError):
+        molecule_platinum_hydride.charge = 0
+
+
+def test_molecule_validation(molecule_hydrogen):
+    """Sizes of coordinates and elements are checked"""
+    with pytest.raises(ValueError):
+        Molecule([[0.0, 0.0, 0.0]], [1, 1])
+    with pytest.raises(ValueError):
+        molecule_hydrogen.coordinates = [[0.0, 0.0, 0.0]]
+    with pytest.raises(ValueError):
+        molecule_hydrogen.elements_list = [1]
+
+
+def test_molecule_batch(molecule_hydrogen, molecule_platinum_hydride):
+    """Molecules packed in a batch come back unchanged, including after pickling"""
+    molecules = [molecule_hydrogen, molecule_platinum_hydride, molecule_hydrogen]
+    batch = MoleculeBatch.from_molecules(molecules, file_ids=["1", "2", "3"])
+    assert len(batch) == 3
+    assert batch.offsets.tolist() == [0, 2, 7, 9]
+    assert batch.natoms.tolist() == [2, 5, 2]
+    assert batch.coordinates.shape == (9, 3)
+
+    batch = pickle.loads(pickle.dumps(batch))
+    assert batch.file_ids == ["1", "2", "3"]
+    for molecule, expected in zip(batch, molecules):
+        assert molecule.xyz_geometry() == expected.xyz_geometry()
+    assert batch[-1].natoms == 2
+    with pytest.raises(IndexError):
+        batch[3]  # pylint: disable=pointless-statement
+
+
+def test_molecule_batch_validation():
+    """Offsets must be consistent with the packed arrays"""
+    with pytest.raises(ValueError):
+        MoleculeBatch(numpy.zeros((3, 3)), [1, 1, 1], [0, 2])
+    with pytest.raises(ValueError):
+        MoleculeBatch(numpy.zeros((3, 3)), [1, 1, 1], [0, 3], file_ids=["1", "2"])
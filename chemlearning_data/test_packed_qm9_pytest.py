@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for the random-access QM9 container"""
+
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from chemlearning_data.chemlearning_data import (
+    chunk_qm9_archive,
+    iter_qm9_archive,
+    pack_qm9_archive,
+)
+from chemlearning_data.packed_qm9 import PackedQM9, is_packed, write_pack
+import pytest
+
+
+@pytest.fixture
+def members():
+    """Fake xyz files with sparse ids, of different sizes"""
+    return [(str(file_id).zfill(6), ("molecule " + str(file_id) + "\n").encode() * file_id)
+            for file_id in list(range(3, 40)) + [57, 58, 100]]
+
+
+@pytest.fixture
+def pack_path(members, tmp_path):
+    """Pack of members, with blocks of 8"""
+    path = str(tmp_path / "members.pack")
+    assert write_pack(members, path, block_size=8) == len(members)
+    return path
+
+
+def first_member(pack):
+    """Used in worker processes: pack was sent by pickling"""
+    return pack.get(3)
+
+
+def test_get(members, pack_path):
+    """Every member comes back, by int or str id; absent ids raise KeyError"""
+    assert is_packed(pack_path)
+    with PackedQM9(pack_path, cache_blocks=2) as pack:
+        assert len(pack) == len(members)
+        assert pack.nblocks == 5
+        for file_id, content in reversed(members):
+            assert pack.get(file_id) == content
+            assert pack.get(int(file_id)) == content
+        assert 57 in pack and "000040" not in pack and 2 not in pack and 101 not in pack
+        with pytest.raises(KeyError):
+            pack.get(40)
+
+
+def test_bulk_reads(members, pack_path):
+    """All members, ranges and samples come in pack order"""
+    with PackedQM9(pack_path) as pack:
+        assert list(pack.members()) == members
+        assert [file_id for file_id, _ in pack.members(38, 60)] == ["000038", "000039",
+                                                                   "000057", "000058"]
+        assert list(pack.members(stop=5)) == members[:2]
+        assert list(pack.members(start=99)) == members[-1:]
+        sample = list(pack.sample(count=10, seed=1))
+        assert len(sample) == 10
+        assert sample == sorted(sample)
+        assert all(member in members for member in sample)
+        assert sample == list(pack.sample(count=10, seed=1))
+        assert len(list(pack.sample(fraction=0.5))) == 20
+        assert [len(chunk) for chunk in pack.chunks(16)] == [16, 16, 8]
+
+
+def test_workers(pack_path):
+    """A pack is sent to worker processes by path"""
+    with PackedQM9(pack_path) as pack:
+        copy = pickle.loads(pickle.dumps(pack))
+        assert copy.get(58) == pack.get(58)
+        copy.close()
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            assert executor.submit(first_member, pack).result() == pack.get(3)
+
+
+def test_qm9_archive(qm9_test_archive, tmp_path):
+    """A packed archive reads as the archive, in place of it"""
+    pack_path = str(tmp_path / "qm9.pack")
+    assert pack_qm9_archive(qm9_test_archive, pack_path, block_size=4) == 10
+    assert not is_packed(qm9_test_archive)
+    expected = [member for chunk in chunk_qm9_archive(qm9_test_archive, 3) for member in chunk]
+    assert [member for chunk in chunk_qm9_archive(pack_path, 3) for member in chunk] == expected
+    from_archive = list(iter_qm9_archive(qm9_test_archive, max_workers=0))
+    from_pack = list(iter_qm9_archive(pack_path, max_workers=0))
+    assert [file_id for file_id, _ in from_pack] == [file_id for file_id, _ in from_archive]
+    for (_, molecule), (_, reference) in zip(from_pack, from_archive):
+        assert (molecule.coordinates == reference.coordinates).all()
+    with PackedQM9(pack_path) as pack:
+        assert pack.get(expected[4][0]) == expected[4][1]
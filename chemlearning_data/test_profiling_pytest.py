@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for stage timings and their histograms"""
+
+import asyncio
+import json
+import pstats
+import time
+import numpy
+from chemlearning_data.profiling import (
+    StageMetrics,
+    StageTimer,
+    profile_path,
+    profiled,
+    timed_stage,
+)
+import pytest
+
+
+class Job:
+    """Object with timed methods, as GaussianJob"""
+
+    def __init__(self, timer=None):
+        self.timer = timer
+
+    @timed_stage("work")
+    def work(self, seconds):
+        time.sleep(seconds)
+        return seconds
+
+    @timed_stage("wait")
+    async def wait(self, seconds):
+        await asyncio.sleep(seconds)
+        return seconds
+
+
+def test_timed_stage():
+    """Methods are timed in the timer of their object, coroutines until they return"""
+    job = Job(StageTimer())
+    assert job.work(0.01) == 0.01
+    job.work(0.01)
+    assert asyncio.run(job.wait(0.02)) == 0.02
+    assert 0.02 <= job.timer.timings["work"] < 0.5
+    assert 0.02 <= job.timer.timings["wait"] < 0.5
+    assert Job().work(0.0) == 0.0
+
+
+def test_quantiles():
+    """Quantiles from buckets are close to exact ones"""
+    metrics = StageMetrics()
+    durations = numpy.random.default_rng(0).lognormal(mean=3.0, sigma=1.0, size=5000)
+    for seconds in durations:
+        metrics.add({"run": seconds, "setup": seconds / 1000})
+    summary = metrics.summary()
+    assert metrics.jobs == 5000
+    assert summary["run"]["count"] == 5000
+    assert numpy.isclose(summary["run"]["sum"], numpy.sum(durations))
+    for fraction, name in ((0.5, "p50"), (0.95, "p95"), (0.99, "p99")):
+        exact = numpy.quantile(durations, fraction)
+        # Buckets are 4 per decade: within a factor 10 ** 0.25
+        assert exact / 1.8 < summary["run"][name] < exact * 1.8
+    assert summary["setup"]["p50"] < summary["run"]["p50"] / 100
+    assert metrics.quantile("unknown", 0.5) is None
+
+
+def test_write(tmp_path):
+    """JSON and Prometheus outputs, written periodically"""
+    metrics = StageMetrics(str(tmp_path / "metrics.prom"), interval=3600.0)
+    metrics.add({"run": 2.0, "parse": 0.01})
+    metrics.add({"run": 3.0})
+    metrics.maybe_write()
+    assert not (tmp_path / "metrics.prom").exists()
+    metrics.interval = 0.0
+    metrics.maybe_write()
+    text = (tmp_path / "metrics.prom").read_text()
+    assert 'chemlearning_stage_seconds_count{stage="run"} 2' in text
+    assert 'chemlearning_stage_seconds_bucket{stage="run",le="+Inf"} 2' in text
+    assert 'chemlearning_stage_seconds_sum{stage="parse"} 0.01' in text
+    assert "chemlearning_jobs_total 2" in text
+
+    metrics.write(str(tmp_path / "metrics.json"))
+    content = json.loads((tmp_path / "metrics.json").read_text())
+    assert content["jobs"] == 2
+    assert content["stages"]["run"]["count"] == 2
+    assert 2.0 <= content["stages"]["run"]["p50"] <= 3.0
+    assert sum(content["histograms"]["run"]) == 2
+
+
+@pytest.mark.parametrize("name", ["metrics.prom", "metrics.json"])
+def test_load(tmp_path, name):
+    """A resumed run adds to the timings written by the former one"""
+    path = str(tmp_path / name)
+    assert not StageMetrics(path).load()
+    metrics = StageMetrics(path)
+    metrics.add({"run": 2.0, "parse": 0.01})
+    metrics.add({"run": 300.0})
+    metrics.write()
+
+    resumed = StageMetrics(path)
+    assert resumed.load()
+    assert resumed.jobs == 2
+    for stage in ("run", "parse"):
+        assert numpy.array_equal(resumed.counts[stage], metrics.counts[stage])
+        assert numpy.isclose(resumed.sums[stage], metrics.sums[stage])
+        assert resumed.maxima[stage] == metrics.maxima[stage]
+    resumed.add({"run": 4.0})
+    assert resumed.summary()["run"]["count"] == 3
+    assert not StageMetrics(path, buckets=[1.0, 10.0]).load()
+
+
+def test_profiles(tmp_path):
+    """A fixed fraction of jobs is profiled, the same ones every time"""
+    directory = str(tmp_path)
+    assert profile_path(None, "000001", 1.0) is None
+    assert profile_path(directory, "000001", 0.0) is None
+    sampled = [file_id for file_id in range(1000) if profile_path(directory, file_id, 0.1)]
+    assert 50 < len(sampled) < 150
+    assert sampled == [file_id for file_id in range(1000)
+                       if profile_path(directory, file_id, 0.1)]
+
+    path = profile_path(directory, "000001", 1.0)
+    with profiled(path):
+        Job().work(0.0)
+    assert "work" in str(pstats.Stats(path).stats)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for the result cache"""
+
+import os
+import time
+from chemlearning_data.chemlearning_data import get_gaussian_arguments
+from chemlearning_data.molecule import Molecule
+from chemlearning_data.result_cache import ResultCache, cache_key
+import pytest
+
+ENERGIES = {"scfenergy": -1102.56, "enthalpy": -40.46978, "freeenergy": -40.491059}
+
+
+@pytest.fixture
+def molecules():
+    """Some hydrogen molecules, all with different bond lengths"""
+    return [Molecule([[0.0, 0.0, 0.0], [0.0, 0.0, 0.70 + 0.01 * i]], [1, 1]) for i in range(5)]
+
+
+def test_cache_key(molecules):
+    """Keys ignore differences below input precision, not arguments"""
+    gaussian_args = get_gaussian_arguments()
+    noisy = Molecule(molecules[0].coordinates + 1e-9, molecules[0].elements_list)
+    assert cache_key(noisy, gaussian_args) == cache_key(molecules[0], gaussian_args)
+    assert cache_key(molecules[1], gaussian_args) != cache_key(molecules[0], gaussian_args)
+    other_args = dict(gaussian_args, dispersion=None)
+    assert cache_key(molecules[0], other_args) != cache_key(molecules[0], gaussian_args)
+
+
+def test_cache_hits(molecules, tmp_path):
+    """Stored energies are found again, also from another cache instance"""
+    gaussian_args = get_gaussian_arguments()
+    log_path = str(tmp_path / "job.log")
+    with open(log_path, mode="w") as log:
+        log.write(" Normal termination of Gaussian 16\n")
+    cache = ResultCache(str(tmp_path / "cache"), keep_logs=True)
+    assert cache.get(molecules[0], gaussian_args) is None
+    cache.put(molecules[0], gaussian_args, ENERGIES, log_path=log_path)
+    assert cache.get(molecules[0], gaussian_args) == ENERGIES
+    assert cache.stats["hits"] == 1
+    assert cache.stats["misses"] == 1
+
+    cache = ResultCache(str(tmp_path / "cache"))
+    assert cache.get(molecules[0], gaussian_args) == ENERGIES
+    assert cache.get_log(molecules[0], gaussian_args) == b" Normal termination of Gaussian 16\n"
+    assert cache.get(molecules[0], dict(gaussian_args, basisset="STO-3G")) is None
+
+
+def test_cache_missing_energies(molecules, tmp_path):
+    """Missing energies are stored, and found again as None"""
+    gaussian_args = get_gaussian_arguments()
+    cache = ResultCache(str(tmp_path / "cache"))
+    energies = dict(ENERGIES, enthalpy=None)
+    cache.put(molecules[0], gaussian_args, energies)
+    assert cache.get(molecules[0], gaussian_args) == energies
+
+
+def test_cache_eviction(molecules, tmp_path):
+    """Least recently used entries go first once the cache is full"""
+    gaussian_args = get_gaussian_arguments()
+    cache = ResultCache(str(tmp_path / "cache"))
+    for molecule in molecules[:3]:
+        cache.put(molecule, gaussian_args, ENERGIES)
+    entry_size = cache.size() // 3
+
+    # Make access times distinct, then use the first entry again
+    for i, molecule in enumerate(molecules[:3]):
+        path = os.path.join(
+            str(tmp_path / "cache"), cache_key(molecule, gaussian_args)[:2],
+            cache_key(molecule, gaussian_args) + ".json"
+        )
+        os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+    assert cache.get(molecules[0], gaussian_args) == ENERGIES
+
+    # Stores never evict: the process submitting jobs does, from sizes on disk
+    cache.max_size = 3 * entry_size
+    cache.put(molecules[3], gaussian_args, ENERGIES)
+    assert cache.stats["evictions"] == 0
+    cache.evict()
+    assert cache.stats["evictions"] == 1
+    assert cache.get(molecules[1], gaussian_args) is None
+    assert cache.get(molecules[0], gaussian_args) == ENERGIES
+    assert cache.get(molecules[3], gaussian_args) == ENERGIES
+    assert cache.size() <= cache.max_size
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for the columnar result store"""
+
+import numpy
+from chemlearning_data.chemlearning_data import get_gaussian_arguments
+from chemlearning_data.result_store import (
+    ResultWriter,
+    iter_chunks,
+    load_results,
+    results_directory,
+)
+
+
+def test_result_store(tmp_path):
+    """Rows are written by chunks, and read back memory-mapped"""
+    directory = str(tmp_path / "results")
+    with ResultWriter(directory, chunk_size=4) as writer:
+        for i in range(1, 11):
+            energies = {"scfenergy": -1.0 * i, "enthalpy": -2.0 * i, "freeenergy": None}
+            writer.add(str(i).zfill(6), energies)
+        # Two full chunks written, two rows still buffered
+        assert len(list(iter_chunks(directory))) == 2
+        assert writer.existing_ids() == set(range(1, 9))
+
+    chunks = list(iter_chunks(directory))
+    assert len(chunks) == 3
+    assert isinstance(chunks[0]["scfenergy"], numpy.memmap)
+
+    results = load_results(directory)
+    assert results["file_id"].tolist() == list(range(1, 11))
+    assert results["enthalpy"].dtype == numpy.float64
+    assert results["enthalpy"][9] == -20.0
+    assert numpy.isnan(results["freeenergy"]).all()
+
+    # Reopening appends new chunks after existing ones
+    with ResultWriter(directory) as writer:
+        writer.add("000011", {"scfenergy": -11.0, "enthalpy": -22.0, "freeenergy": -33.0})
+    assert load_results(directory)["file_id"].tolist() == list(range(1, 12))
+
+
+def test_results_directory(tmp_path):
+    """Results of other Gaussian arguments go to another store"""
+    base = str(tmp_path / "results")
+    gaussian_args = get_gaussian_arguments()
+    directory = results_directory(base, gaussian_args)
+    assert directory == results_directory(base, dict(gaussian_args))
+    other = results_directory(base, dict(gaussian_args, basisset="STO-3G"))
+    assert other != directory
+    with ResultWriter(directory) as writer:
+        writer.add("000001", {"scfenergy": -1.0, "enthalpy": -2.0, "freeenergy": -3.0})
+    assert len(load_results(directory)["file_id"]) == 1
+    assert len(load_results(other)["file_id"]) == 0
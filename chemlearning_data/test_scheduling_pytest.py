@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for the cost model and job scheduling"""
+
+import numpy
+from chemlearning_data.chemlearning_data import get_gaussian_arguments, iter_qm9_archive
+from chemlearning_data.molecule import MoleculeBatch
+from chemlearning_data.scheduling import CostModel, schedule_chunks, simulate_makespan
+import pytest
+
+
+@pytest.fixture
+def molecules(qm9_test_archive):
+    """(file_id, Molecule) of the test archive"""
+    return list(iter_qm9_archive(qm9_test_archive, max_workers=0))
+
+
+def test_basis_sizes(molecules):
+    """Basis sizes of a batch are those of its molecules; CH4 has 23 functions in 6-31G*"""
+    model = CostModel(get_gaussian_arguments())
+    batch = MoleculeBatch.from_molecules([molecule for _, molecule in molecules])
+    sizes = [model.basis_size(molecule) for _, molecule in molecules]
+    assert model.basis_sizes(batch).tolist() == sizes
+    assert sizes[0] == 23
+
+
+def test_fit():
+    """Fitted parameters recover a power law"""
+    model = CostModel(get_gaussian_arguments())
+    for size in range(20, 200, 10):
+        model.add_timing(size, 2e-4 * size ** 2.5)
+    assert model.fit()
+    assert model.exponent == pytest.approx(2.5)
+    assert model.predict(100) == pytest.approx(2e-4 * 100 ** 2.5)
+
+
+def test_fit_needs_timings():
+    """Prior parameters are kept until enough jobs have ended"""
+    model = CostModel(get_gaussian_arguments(), min_timings=4)
+    model.add_timing(100, 1.0)
+    model.add_timing(100, None)
+    assert not model.fit()
+    assert model.exponent == 3.0
+
+
+def test_simulate_makespan():
+    """Jobs go to the first free worker"""
+    assert simulate_makespan([1.0, 1.0, 1.0, 3.0], 2) == 4.0
+    assert simulate_makespan([3.0, 1.0, 1.0, 1.0], 2) == 3.0
+    assert simulate_makespan([], 4) == 0.0
+
+
+@pytest.mark.parametrize("policy", ["fifo", "lpt", "guided"])
+def test_schedule_chunks(molecules, policy):
+    """Every molecule is scheduled once, in the order set by the policy"""
+    model = CostModel(get_gaussian_arguments())
+    chunks = list(schedule_chunks(iter(molecules), model, 3, workers=2, policy=policy))
+    scheduled = [item for chunk in chunks for item in chunk]
+    assert sorted(file_id for file_id, _ in scheduled) == [file_id for file_id, _ in molecules]
+    sizes = [model.basis_size(molecule) for _, molecule in scheduled]
+    if policy == "fifo":
+        assert scheduled == molecules
+    else:
+        assert sizes == sorted(sizes, reverse=True)
+    chunk_sizes = [len(chunk) for chunk in chunks]
+    if policy == "guided":
+        assert chunk_sizes == sorted(chunk_sizes, reverse=True)
+        assert chunk_sizes[-1] == 1
+    else:
+        assert chunk_sizes == [3, 3, 3, 1]
+
+
+def test_lpt_makespan(molecules):
+    """Longest first is never worse than source order, here sorted by size"""
+    model = CostModel(get_gaussian_arguments())
+    durations = numpy.sort(model.predict([model.basis_size(m) for _, m in molecules]))
+    fifo = simulate_makespan(durations.tolist(), 3)
+    lpt = simulate_makespan(durations[::-1].tolist(), 3)
+    assert lpt <= fifo
+
+
+def test_unknown_policy(molecules):
+    """Policies are checked"""
+    model = CostModel(get_gaussian_arguments())
+    with pytest.raises(ValueError):
+        list(schedule_chunks(iter(molecules), model, 3, workers=2, policy="random"))
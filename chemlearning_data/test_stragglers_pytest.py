@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for timeouts, retries and speculative copies of Gaussian jobs"""
+
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from chemlearning_data.chemlearning_data import (
+    compute_dispersion_corrections,
+    get_gaussian_arguments,
+    iter_qm9_archive,
+)
+from chemlearning_data.gaussian_job import GaussianJob, JobStopped
+from chemlearning_data.molecule import MoleculeBatch
+from chemlearning_data.scheduling import CostModel
+from chemlearning_data.stragglers import (
+    FALLBACK_ARGUMENTS,
+    StragglerPolicy,
+    speculative_arguments,
+    stop_copy,
+    submit_speculative,
+)
+import pytest
+
+
+@pytest.fixture
+def molecules(qm9_test_archive):
+    """(file_id, Molecule) of the test archive"""
+    return list(iter_qm9_archive(qm9_test_archive, max_workers=0))
+
+
+def make_batch(molecules):
+    """MoleculeBatch of (file_id, Molecule)"""
+    return MoleculeBatch.from_molecules(
+        [molecule for _, molecule in molecules], file_ids=[file_id for file_id, _ in molecules]
+    )
+
+
+def test_timeouts(molecules):
+    """Timeouts follow the fitted cost model, within bounds, and grow with retries"""
+    model = CostModel(get_gaussian_arguments(), min_timings=1)
+    batch = make_batch(molecules)
+    policy = StragglerPolicy(factor=2.0, min_seconds=0.0)
+    # Nothing killed on the prior
+    assert policy.timeouts(model, batch) == [None] * len(batch)
+    model.add_timing(model.basis_size(molecules[0][1]), 300.0)
+    assert model.fit()
+    expected = model.predict(model.basis_sizes(batch))
+    assert policy.timeouts(model, batch) == pytest.approx((2.0 * expected).tolist())
+    assert policy.retry_timeout(10.0, 0) == 10.0
+    assert policy.retry_timeout(10.0, 2) == 40.0
+    assert policy.retry_timeout(None, 1) is None
+    assert StragglerPolicy(max_seconds=15.0).retry_timeout(10.0, 1) == 15.0
+    assert StragglerPolicy(min_seconds=1e6).timeout(1.0) == 1e6
+    assert StragglerPolicy(max_seconds=5.0).timeout(1e6) == 5.0
+    assert StragglerPolicy(retries=2, fallback_args=FALLBACK_ARGUMENTS).attempts({"a": 1}) == [
+        {"a": 1}, {"a": 1, "scf": "XQC"}, {"a": 1, "scf": "XQC"}
+    ]
+
+
+def test_run_timeout(molecules, fake_g16, monkeypatch, tmp_path):
+    """A job over its timeout is killed, with the processes it started"""
+    # Unique duration, to find the sleep started by g16 among all processes
+    monkeypatch.setenv("FAKE_G16_SLEEP", "62.1")
+    file_id, molecule = molecules[0]
+    job = GaussianJob(str(tmp_path), file_id, molecule, file_id, get_gaussian_arguments())
+    job.setup_computation()
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        job.run(timeout=0.5)
+    assert time.monotonic() - start < 10.0
+    # No process left running
+    assert "sleep 62.1" not in subprocess.run(
+        ["ps", "-eo", "args"], capture_output=True, text=True, check=True
+    ).stdout
+
+
+@pytest.mark.parametrize("link1", [False, True])
+@pytest.mark.parametrize("retries", [0, 1])
+def test_retry(molecules, fake_g16, monkeypatch, tmp_path, retries, link1):
+    """Killed jobs are run again with the fallback arguments, in another directory"""
+    # Linked jobs hang too: their molecules are then computed one by one
+    monkeypatch.setenv("FAKE_G16_HANG", "000003.xyz\\|linked_")
+    batch = make_batch(molecules[:3])
+    computations = tmp_path / "computation"
+    policy = StragglerPolicy(retries=retries, fallback_args=FALLBACK_ARGUMENTS)
+    results = compute_dispersion_corrections(
+        batch, {"computations": str(computations)}, get_gaussian_arguments(), link1=link1,
+        timeouts=[1.0] * len(batch), stragglers=policy,
+    )
+    assert [result[0] for result in results] == batch.file_ids
+    for file_id, energies, error, seconds, _ in results:
+        if file_id != "000003" or retries:
+            assert energies["enthalpy"] == -40.469780
+        else:
+            assert energies is None
+            assert error.startswith("Killed after 1 s")
+            # Lower bound of its wall time, for the cost model
+            assert seconds >= 1.0
+    # Directories of killed jobs kept, those of jobs that ended removed
+    expected = ["000003.xyz.00000003"] + (["linked_000001.00000001"] if link1 else [])
+    assert sorted(os.listdir(str(computations))) == expected
+    with open(str(computations / "000003.xyz.00000003" / "000003.xyz.com")) as script:
+        assert "SCF=" not in script.read()
+
+
+def test_stop(molecules, fake_g16, monkeypatch, tmp_path):
+    """A task is stopped, its job killed and its directory removed, once its stop file exists"""
+    monkeypatch.setenv("FAKE_G16_SLEEP", "62.2")
+    computations = tmp_path / "computation"
+    stops = tmp_path / "stop"
+    stops.mkdir()
+    kwargs = speculative_arguments(
+        dict(batch=make_batch(molecules[:2]), locations={"computations": str(computations)},
+             gaussian_args=get_gaussian_arguments()), 1, str(stops)
+    )
+    assert kwargs["copy"] == 1
+    timer = threading.Timer(0.5, stop_copy, args=(kwargs,))
+    timer.start()
+    start = time.monotonic()
+    with pytest.raises(JobStopped):
+        compute_dispersion_corrections(**kwargs)
+    assert time.monotonic() - start < 10.0
+    assert os.listdir(str(computations)) == []
+    assert "sleep 62.2" not in subprocess.run(
+        ["ps", "-eo", "args"], capture_output=True, text=True, check=True
+    ).stdout
+
+
+def test_fallback_route():
+    """Fallback arguments add SCF options to the route"""
+    job = GaussianJob("/tmp", "test", None, 1, dict(get_gaussian_arguments(), scf="XQC"))
+    assert job.header[1] == "# B3LYP EmpiricalDispersion=GD3 SCF=(XQC) gen freq"
+
+
+def test_submit_speculative():
+    """Stragglers get a copy at the end, each job is done once by its first copy, others stopped"""
+    release = threading.Event()
+    stopped = list()
+
+    def stop(kwargs):
+        stopped.append(kwargs)
+        release.set()
+
+
+    def task(value, copy=0):
+        if value == 3 and copy == 0:
+            release.wait(30.0)
+        else:
+            time.sleep(0.01)
+        return value, copy
+
+    results = dict()
+
+    def on_done(key, future):
+        assert key not in results
+        results[key] = future.result()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        stats = submit_speculative(
+            executor, ((value, task, {"value": value}) for value in range(20)), on_done,
+            max_in_flight=4, workers=4, expected=lambda kwargs: 0.01,
+            copy=lambda kwargs, number: dict(kwargs, copy=number), poll_interval=0.05,
+            stop=stop,
+        )
+        assert stopped == [{"value": 3}]
+    assert results == {value: (value, 1 if value == 3 else 0) for value in range(20)}
+    assert stats == {"copies": 1, "won": 1}
+
+
+def test_speculative_failure():
+    """A copy failing does not hide the success of the original"""
+
+    def task(copy=0):
+        if copy:
+            raise RuntimeError("copy failed")
+        time.sleep(0.5)
+        return copy
+
+    results = dict()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        submit_speculative(
+            executor, [("job", task, dict())], lambda key, future: results.update(
+                {key: future.result()}), max_in_flight=2, workers=2,
+            expected=lambda kwargs: 0.01, copy=lambda kwargs, number: dict(kwargs, copy=number),
+            poll_interval=0.05,
+        )
+    assert results == {"job": 0}
+
+
+def test_random_stragglers(molecules, fake_g16, monkeypatch, tmp_path):
+    """Jobs of random durations, all computed once whatever the copies"""
+    monkeypatch.setenv("FAKE_G16_MAX_SLEEP", "1.0")
+    locations = {"computations": str(tmp_path)}
+    model = CostModel(dict(get_gaussian_arguments(), basisset="STO-3G"))
+    policy = StragglerPolicy(factor=1.0, min_seconds=0.5, retries=2)
+    model.scale = 0.05 / model.basis_size(molecules[0][1]) ** model.exponent
+    model.fitted = True
+
+    def jobs():
+        for i in range(12):
+            # Own file id, hence job directory, for each job
+            batch = MoleculeBatch.from_molecules(
+                [molecules[i % len(molecules)][1]], file_ids=[str(i).zfill(6)]
+            )
+            kwargs = dict(batch=batch, locations=locations, gaussian_args=get_gaussian_arguments(),
+                          timeouts=policy.timeouts(model, batch), stragglers=policy)
+            yield i, compute_dispersion_corrections, kwargs
+
+    results = dict()
+
+    def on_done(key, future):
+        assert key not in results
+        results[key] = future.result()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        submit_speculative(
+            executor, jobs(), on_done, max_in_flight=4, workers=4,
+            expected=lambda kwargs: float(
+                model.predict(model.basis_sizes(kwargs["batch"])).sum()
+            ),
+            copy=lambda kwargs, number: dict(kwargs, copy=number), poll_interval=0.05,
+        )
+    assert sorted(results) == list(range(12))
+    for key, result in results.items():
+        assert [file_id for file_id, *_ in result] == [str(key).zfill(6)]
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for the shared filesystem work queue"""
+
+import multiprocessing
+import time
+import numpy
+from chemlearning_data.chemlearning_data import get_gaussian_arguments, iter_qm9_archive
+from chemlearning_data.manifest import RunManifest
+from chemlearning_data.molecule import MoleculeBatch
+from chemlearning_data.result_store import ResultWriter, load_results
+from chemlearning_data.work_queue import (
+    LeaseKeeper,
+    WorkQueue,
+    merge_results,
+    pack_batch,
+    publish_qm9,
+    run_worker,
+    unpack_batch,
+)
+import pytest
+
+
+@pytest.fixture
+def batch(qm9_test_archive):
+    """All molecules of the test archive"""
+    molecules = list(iter_qm9_archive(qm9_test_archive, max_workers=0))
+    return MoleculeBatch.from_molecules(
+        [molecule for _, molecule in molecules], file_ids=[file_id for file_id, _ in molecules]
+    )
+
+
+def test_pack_batch(batch):
+    """Batches are stored without loss"""
+    unpacked = unpack_batch(pack_batch(batch))
+    assert unpacked.file_ids == batch.file_ids
+    assert numpy.array_equal(unpacked.coordinates, batch.coordinates)
+    assert numpy.array_equal(unpacked.elements, batch.elements)
+    assert numpy.array_equal(unpacked.offsets, batch.offsets)
+
+
+def test_lease(batch, tmp_path):
+    """Tasks of dead workers are claimed again, up to max_attempts times"""
+    with WorkQueue(str(tmp_path), lease=0.2, max_attempts=2) as queue:
+        queue.publish([batch], get_gaussian_arguments())
+        task_id, claimed = queue.claim("dead")
+        assert claimed.file_ids == batch.file_ids
+        assert queue.claim("other") is None
+        time.sleep(0.3)
+        assert queue.claim("other")[0] == task_id
+        assert not queue.renew(task_id, "dead")
+        assert queue.renew(task_id, "other")
+        time.sleep(0.3)
+        assert queue.claim("third") is None
+        assert queue.counts()["failed"] == 1
+        assert queue.failed_file_ids() == batch.file_ids
+
+
+def test_lease_keeper(batch, tmp_path):
+    """Leases are renewed while a task is computed, up to max_seconds"""
+    with WorkQueue(str(tmp_path), lease=0.3) as queue:
+        queue.publish([batch], get_gaussian_arguments())
+        task_id, _ = queue.claim("stuck")
+        with LeaseKeeper(queue, task_id, "stuck", max_seconds=0.5):
+            time.sleep(0.4)
+            assert queue.claim("other") is None
+            time.sleep(1.0)
+            assert queue.claim("other")[0] == task_id
+
+
+def test_job_timeout(qm9_test_archive, fake_g16, monkeypatch, tmp_path):
+    """Hung jobs of a worker are killed, and their molecules recorded as failed"""
+    monkeypatch.setenv("FAKE_G16_HANG", "000003")
+    queue_dir = str(tmp_path / "queue")
+    publish_qm9(qm9_test_archive, queue_dir, get_gaussian_arguments(), chunk_size=4)
+    locations = {"computations": str(tmp_path / "computation")}
+    assert run_worker(queue_dir, locations, poll_interval=0.1, job_timeout=1.0) == 3
+    with WorkQueue(queue_dir) as queue:
+        results = {file_id: error for file_id, _, error in queue.results()}
+    assert results.pop("000003").startswith("Killed after 1 s")
+    assert set(results.values()) == {None}
+
+
+def test_local_workers(qm9_test_archive, fake_g16, tmp_path):
+    """Several worker processes share a queue, and take over a dead worker's task"""
+    queue_dir = str(tmp_path / "queue")
+    gaussian_args = get_gaussian_arguments()
+    assert publish_qm9(qm9_test_archive, queue_dir, gaussian_args, chunk_size=2) == 5
+    # A worker claims a task, then dies without completing it
+    with WorkQueue(queue_dir, lease=1.0) as queue:
+        assert queue.claim("dead") is not None
+
+    locations = {"computations": str(tmp_path / "computation")}
+    workers = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(queue_dir, locations),
+            kwargs={"lease": 1.0, "poll_interval": 0.1},
+        )
+        for _ in range(3)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=60)
+        assert worker.exitcode == 0
+
+    with RunManifest(str(tmp_path / "manifest.sqlite"), gaussian_args) as manifest, \
+            ResultWriter(str(tmp_path / "results")) as writer:
+        counts = merge_results(queue_dir, manifest, writer)
+        assert counts == {"done": 10, "failed": 0}
+        assert len(manifest.completed_ids()) == 10
+    # Merging again writes nothing new
+    with RunManifest(str(tmp_path / "manifest.sqlite"), gaussian_args) as manifest, \
+            ResultWriter(str(tmp_path / "results")) as writer:
+        assert merge_results(queue_dir, manifest, writer) == counts
+    file_ids = load_results(str(tmp_path / "results"))["file_id"]
+    assert sorted(file_ids.tolist()) == list(range(1, 11))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for the scratch workspace"""
+
+import gzip
+import os
+from chemlearning_data.chemlearning_data import (
+    compute_dispersion_correction,
+    get_gaussian_arguments,
+    iter_qm9_archive,
+)
+from chemlearning_data.gaussian_job import GaussianJob
+from chemlearning_data.workspace import Workspace
+import pytest
+
+
+def test_directories_reused(tmp_path):
+    """Released directories are emptied and handed out again"""
+    with Workspace(str(tmp_path / "scratch"), pool_size=1) as workspace:
+        path = workspace.acquire()
+        os.makedirs(os.path.join(path, "subdir"))
+        with open(os.path.join(path, "job.log"), mode="w") as log:
+            log.write("content")
+        workspace.release(path)
+        assert workspace.acquire() == path
+        assert os.listdir(path) == []
+        assert workspace.acquire() != path
+        assert workspace.stats["created"] == 2
+    assert not os.path.exists(workspace.root)
+
+
+@pytest.mark.parametrize("keep_logs", ["move", "compress"])
+def test_keep_logs(tmp_path, keep_logs):
+    """Output files are kept in the durable folder on release"""
+    durable = str(tmp_path / "logs")
+    with Workspace(str(tmp_path / "scratch"), durable=durable, keep_logs=keep_logs) as workspace:
+        path = workspace.acquire()
+        log_path = os.path.join(path, "job.log")
+        with open(log_path, mode="w") as log:
+            log.write("content")
+        kept = workspace.release(path, log_path=log_path)
+    opener = gzip.open if keep_logs == "compress" else open
+    with opener(kept, mode="rt") as log:
+        assert log.read() == "content"
+    assert os.listdir(durable) == [os.path.basename(kept)]
+
+
+def test_keep_logs_needs_durable(tmp_path):
+    """Logs cannot be kept without a durable folder"""
+    with pytest.raises(ValueError):
+        Workspace(str(tmp_path), keep_logs="move")
+
+
+def test_job_in_workspace(qm9_test_archive, fake_g16, tmp_path):
+    """Jobs run in pool directories, which all go back to the pool"""
+    with Workspace(str(tmp_path / "scratch"), pool_size=2) as workspace:
+        for file_id, molecule in iter_qm9_archive(qm9_test_archive, max_workers=0):
+            job = GaussianJob(
+                basedir=str(tmp_path / "computation"),
+                name=file_id + ".xyz",
+                molecule=molecule,
+                job_id=file_id,
+                gaussian_args=get_gaussian_arguments(),
+                workspace=workspace,
+            )
+            job.setup_computation()
+            assert job.path.startswith(workspace.root)
+            job.run()
+            assert job.get_energies()["enthalpy"] == -40.469780
+            job.cleanup()
+            assert job.fs_time > 0.0
+        assert workspace.stats["created"] == 2
+        assert workspace.stats["released"] == 10
+    assert not os.path.exists(str(tmp_path / "computation"))
+
+
+def test_compute_with_scratch(qm9_test_archive, fake_g16, tmp_path):
+    """compute_dispersion_correction uses the scratch folder of locations"""
+    locations = {
+        "computations": str(tmp_path / "computation"),
+        "scratch": str(tmp_path / "scratch"),
+        "logs": str(tmp_path / "logs"),
+        "keep_logs": "compress",
+    }
+    file_id, molecule = next(iter_qm9_archive(qm9_test_archive, max_workers=0))
+    _, energies = compute_dispersion_correction(
+        molecule, file_id, file_id + ".xyz", locations, get_gaussian_arguments()
+    )
+    assert energies["enthalpy"] == -40.469780
+    assert os.listdir(locations["logs"]) == [file_id + ".xyz.log.gz"]
+    assert not os.path.exists(locations["computations"])
@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""
+Distribute computations over many nodes through a queue on a shared filesystem.
+
+A coordinator publishes chunks of molecules as tasks of a SQLite queue; any
+number of workers, on any node seeing the queue folder, claim tasks, compute
+them and record their results in the queue. Claimed tasks are leased: a
+worker renews its lease while it computes, and tasks of dead workers are
+claimed again once their lease has expired. Results are finally merged into
+the manifest and result store of the run.
+
+    python -m chemlearning_data.work_queue publish qm9/qm9.tar.bz2 queue
+    python -m chemlearning_data.work_queue work queue --processes 32   # on each node
+    python -m chemlearning_data.work_queue merge queue data
+"""
+
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import numpy
+from chemlearning_data.chemlearning_data import (
+    SCRATCH_LOCATION,
+    compute_dispersion_corrections,
+    get_gaussian_arguments,
+    iter_qm9_archive,
+    setup_logger,
+)
+from chemlearning_data.manifest import ENERGY_KEYS, RunManifest
+from chemlearning_data.molecule import MoleculeBatch
+from chemlearning_data.result_store import ResultWriter, results_directory
+from chemlearning_data.scheduling import CostModel, schedule_chunks
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+QUEUE_FILE = "queue.sqlite"
+# Seconds after which the Gaussian job of a molecule is killed by a worker, so
+# that a hung g16 does not hold its task forever
+JOB_TIMEOUT = 6 * 3600.0
+
+
+def pack_batch(batch):
+    """Serialize a MoleculeBatch to bytes, as uncompressed npz"""
+    buffer = io.BytesIO()
+    numpy.savez(
+        buffer,
+        coordinates=batch.coordinates,
+        elements=batch.elements,
+        offsets=batch.offsets,
+        file_ids=numpy.array(batch.file_ids, dtype=str),
+    )
+    return buffer.getvalue()
+
+
+def unpack_batch(content):
+    """MoleculeBatch serialized by pack_batch"""
+    with numpy.load(io.BytesIO(content), allow_pickle=False) as arrays:
+        return MoleculeBatch(
+            arrays["coordinates"],
+            arrays["elements"],
+            arrays["offsets"],
+            file_ids=arrays["file_ids"].tolist(),
+        )
+
+
+def default_worker_id():
+    """Identifier of the current process: host name and pid"""
+    return socket.gethostname() + ":" + str(os.getpid())
+
+
+class WorkQueue:
+    """
+    SQLite queue of tasks, each a chunk of molecules packed in a MoleculeBatch.
+
+    The database uses the default rollback journal rather than WAL, which
+    needs shared memory and does not work across nodes of a network
+    filesystem. Tasks are claimed in publication order. Methods are thread
+    safe, so that a lease can be renewed from another thread.
+
+    Attributes:
+        - directory (folder of the queue, on a shared filesystem, str)
+        - path (path to the SQLite database, str)
+        - lease (seconds a claimed task stays reserved without renewal, float)
+        - max_attempts (number of claims before a task is marked failed, int)
+
+    """
+
+    def __init__(self, directory, lease=600.0, max_attempts=3):
+        """Open the queue, creating it if necessary."""
+        self.directory = directory
+        self.path = os.path.join(directory, QUEUE_FILE)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Transactions are explicit, to take the write lock when claiming
+        self._connection = sqlite3.connect(
+            self.path, timeout=60.0, isolation_level=None, check_same_thread=False
+        )
+        with self._lock:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " task_id INTEGER PRIMARY KEY,"
+                " file_ids TEXT NOT NULL,"
+                " batch BLOB NOT NULL,"
+                " status TEXT NOT NULL,"
+                " worker TEXT,"
+                " lease_expires REAL,"
+                " attempts INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " file_id TEXT PRIMARY KEY,"
+                " scfenergy REAL,"
+                " enthalpy REAL,"
+                " freeenergy REAL,"
+                " error TEXT,"
+                " worker TEXT NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+
+    def close(self):
+        """Close the database"""
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _transaction(self, statements):
+        """Run (sql, parameters) statements in a single write transaction, return rowcounts"""
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                rowcounts = [
+                    self._connection.execute(sql, params).rowcount for sql, params in statements
+                ]
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+        return rowcounts
+
+    @property
+    def gaussian_args(self):
+        """Arguments of the computations, as published, or None"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM settings WHERE key = 'gaussian_args'"
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def publish(self, batches, gaussian_args):
+        """Add one task per MoleculeBatch, all computed with gaussian_args"""
+        statements = [(
+            "INSERT OR REPLACE INTO settings VALUES ('gaussian_args', ?)",
+            (json.dumps(gaussian_args, sort_keys=True),),
+        )]
+        count = 0
+        for batch in batches:
+            statements.append((
+                "INSERT INTO tasks (file_ids, batch, status) VALUES (?, ?, ?)",
+                (" ".join(batch.file_ids), pack_batch(batch), PENDING),
+            ))
+            count += 1
+        self._transaction(statements)
+        logging.info("Published %d tasks", count)
+        return count
+
+    def claim(self, worker):
+        """
+        Reserve the next task for worker, return (task_id, MoleculeBatch) or None.
+
+        Tasks are claimed in publication order, pending ones as well as running
+        ones whose lease has expired. Expired tasks already claimed
+        max_attempts times are marked failed instead.
+        """
+        now = time.time()
+        with self._lock:
+            # Write lock taken first, so that no other worker claims the same task
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute(
+                    "UPDATE tasks SET status = ? WHERE status = ? AND lease_expires < ?"
+                    " AND attempts >= ?",
+                    (FAILED, RUNNING, now, self.max_attempts),
+                )
+                row = self._connection.execute(
+                    "SELECT task_id, batch, attempts FROM tasks"
+                    " WHERE status = ? OR (status = ? AND lease_expires < ?)"
+                    " ORDER BY task_id LIMIT 1",
+                    (PENDING, RUNNING, now),
+                ).fetchone()
+                if row is not None:
+                    self._connection.execute(
+                        "UPDATE tasks SET status = ?, worker = ?, lease_expires = ?,"
+                        " attempts = attempts + 1 WHERE task_id = ?",
+                        (RUNNING, worker, now + self.lease, row[0]),
+                    )
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+        if row is None:
+            return None
+        task_id, content, attempts = row
+        attempts += 1
+        if attempts > 1:
+            logging.warning("Task %d claimed again, attempt %d", task_id, attempts)
+        return task_id, unpack_batch(content)
+
+    def renew(self, task_id, worker):
+        """Extend the lease of a task, return whether worker still holds it"""
+        (rowcount,) = self._transaction([(
+            "UPDATE tasks SET lease_expires = ? WHERE task_id = ? AND worker = ? AND status = ?",
+            (time.time() + self.lease, task_id, worker, RUNNING),
+        )])
+        return rowcount == 1
+
+    def complete(self, task_id, worker, results):
+        """
+        Record the results of a task, as returned by compute_dispersion_corrections.
+
+        A task claimed again after its lease expired may be completed twice:
+        results of the last worker are kept.
+        """
+        statements = [
+            (
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (str(file_id), *[(energies or dict()).get(key) for key in ENERGY_KEYS],
+                 error, worker),
+            )
+            for file_id, energies, error, _, _ in results
+        ]
+        statements.append(("UPDATE tasks SET status = ? WHERE task_id = ?", (DONE, task_id)))
+        self._transaction(statements)
+
+    def counts(self):
+        """Number of tasks in each state"""
+        with self._lock:
+            cursor = self._connection.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status")
+            counts = dict.fromkeys([PENDING, RUNNING, DONE, FAILED], 0)
+            counts.update(dict(cursor.fetchall()))
+        return counts
+
+    def unfinished(self):
+        """Number of tasks pending or running"""
+        counts = self.counts()
+        return counts[PENDING] + counts[RUNNING]
+
+    def results(self):
+        """List of (file_id, energies, error) of all computed molecules"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT file_id, scfenergy, enthalpy, freeenergy, error FROM results"
+                " ORDER BY file_id"
+            ).fetchall()
+        return [
+            (row[0], dict(zip(ENERGY_KEYS, row[1:4])) if row[4] is None else None, row[4])
+            for row in rows
+        ]
+
+    def failed_file_ids(self):
+        """file_ids of tasks that failed on every attempt"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT file_ids FROM tasks WHERE status = ?", (FAILED,)
+            ).fetchall()
+        return [file_id for (file_ids,) in rows for file_id in file_ids.split()]
+
+
+class LeaseKeeper:
+    """
+    Renew the lease of a task from a background thread, while it is computed.
+
+    Renewals stop after max_seconds, if given: a worker stuck for longer
+    lets its lease expire, and the task is claimed again.
+
+    Attributes:
+        - queue (queue holding the task, WorkQueue)
+        - task_id (task to keep, int)
+        - worker (holder of the lease, str)
+        - max_seconds (longest time the task is kept, None for no limit, float)
+
+    """
+
+    def __init__(self, queue, task_id, worker, max_seconds=None):
+        """Build the LeaseKeeper class."""
+        self.queue = queue
+        self.task_id = task_id
+        self.worker = worker
+        self.max_seconds = max_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        """Renew the lease three times per lease duration, until max_seconds"""
+        start = time.monotonic()
+        while not self._stop.wait(self.queue.lease / 3):
+            if self.max_seconds is not None and time.monotonic() - start > self.max_seconds:
+                logging.warning("Task %d over %.0f s, lease no longer renewed", self.task_id,
+                                self.max_seconds)
+                return
+            if not self.queue.renew(self.task_id, self.worker):
+                logging.warning("Lost lease of task %d", self.task_id)
+                return
+
+
+def run_worker(directory, locations, worker=None, lease=600.0, poll_interval=30.0,
+               cache=None, job_timeout=JOB_TIMEOUT):
+    """
+    Claim and compute tasks until the queue is finished, return the number of tasks done.
+
+    When no task can be claimed but others are still running, wait
+    poll_interval seconds for them to end, or for their lease to expire.
+    New results are stored in cache, a ResultCache, if given; molecules are
+    not looked up in it, those of the queue are all computed.
+    The job of each molecule is killed after job_timeout seconds, and the
+    molecule recorded as failed; the lease of a task is renewed for at most
+    job_timeout seconds per molecule.
+    """
+    worker = worker or default_worker_id()
+    done = 0
+    with WorkQueue(directory, lease=lease) as queue:
+        gaussian_args = queue.gaussian_args
+        while True:
+            task = queue.claim(worker)
+            if task is None:
+                if not queue.unfinished():
+                    break
+                time.sleep(poll_interval)
+                continue
+            task_id, batch = task
+            logging.info("Worker %s computing task %d", worker, task_id)
+            with LeaseKeeper(queue, task_id, worker, max_seconds=job_timeout * len(batch)):
+                results = compute_dispersion_corrections(
+                    batch, locations, gaussian_args, cache=cache,
+                    timeouts=[job_timeout] * len(batch),
+                )
+            queue.complete(task_id, worker, results)
+            done += 1
+    logging.info("Worker %s finished after %d tasks", worker, done)
+    return done
+
+
+def publish_qm9(archive, directory, gaussian_args, chunk_size=8, workers=1, manifest=None,
+                policy="lpt"):
+    """
+    Publish all molecules of a QM9 archive to a queue, longest jobs first.
+
+    Molecules already done in a RunManifest are skipped.
+    Returns the number of tasks published.
+    """
+    completed = manifest.completed_ids() if manifest is not None else set()
+    molecules = (
+        (file_id, molecule) for file_id, molecule in iter_qm9_archive(archive)
+        if file_id not in completed
+    )
+    chunks = schedule_chunks(
+        molecules, CostModel(gaussian_args), chunk_size, workers, policy=policy
+    )
+    batches = (
+        MoleculeBatch.from_molecules(
+            [molecule for _, molecule in chunk], file_ids=[file_id for file_id, _ in chunk]
+        )
+        for chunk in chunks
+    )
+    with WorkQueue(directory) as queue:
+        return queue.publish(batches, gaussian_args)
+
+
+def merge_results(directory, manifest, writer):
+    """
+    Record results of a queue in a RunManifest and a ResultWriter, return counts.
+
+    Results already in the ResultWriter are not written again, so that
+    merging twice gives the same store.
+    """
+    counts = dict.fromkeys([DONE, FAILED], 0)
+    written = writer.existing_ids()
+    with WorkQueue(directory) as queue:
+        for file_id, energies, error in queue.results():
+            if energies is None:
+                manifest.mark_failed(file_id, error)
+                counts[FAILED] += 1
+            else:
+                manifest.mark_done(file_id, energies)
+                if int(file_id) not in written:
+                    writer.add(file_id, energies)
+                counts[DONE] += 1
+        for file_id in queue.failed_file_ids():
+            manifest.mark_failed(file_id, "Task failed on every attempt")
+            counts[FAILED] += 1
+    return counts
+
+
+def _worker_process(directory, locations, lease, poll_interval, job_timeout):
+    """Entry point of worker processes"""
+    setup_logger()
+    run_worker(directory, locations, lease=lease, poll_interval=poll_interval,
+               job_timeout=job_timeout)
+
+
+def main():
+    """Launcher."""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    publish = commands.add_parser("publish", help="publish the molecules of a QM9 archive")
+    publish.add_argument("archive")
+    publish.add_argument("queue")
+    publish.add_argument("--chunk-size", type=int, default=8)
+    publish.add_argument("--manifest", help="manifest of former runs, to skip molecules")
+    work = commands.add_parser("work", help="compute tasks until the queue is finished")
+    work.add_argument("queue")
+    work.add_argument("--processes", type=int, default=os.cpu_count())
+    work.add_argument("--lease", type=float, default=600.0)
+    work.add_argument("--poll-interval", type=float, default=30.0)
+    work.add_argument("--job-timeout", type=float, default=JOB_TIMEOUT,
+                      help="seconds after which the job of a molecule is killed")
+    work.add_argument("--computations", default=os.path.join(os.getcwd(), "computation"))
+    work.add_argument("--scratch", action="store_true",
+                      help="job directories in " + SCRATCH_LOCATION + ", in memory")
+    merge = commands.add_parser("merge", help="write results to a manifest and result store")
+    merge.add_argument("queue")
+    merge.add_argument("data")
+    args = parser.parse_args()
+
+    setup_logger()
+    if args.command == "publish":
+        gaussian_args = get_gaussian_arguments()
+        if args.manifest:
+            with RunManifest(args.manifest, gaussian_args) as manifest:
+                publish_qm9(args.archive, args.queue, gaussian_args, args.chunk_size,
+                            manifest=manifest)
+        else:
+            publish_qm9(args.archive, args.queue, gaussian_args, args.chunk_size)
+    elif args.command == "work":
+        locations = {"computations": args.computations, "scratch": None}
+        if args.scratch and os.path.isdir(SCRATCH_LOCATION):
+            locations["scratch"] = tempfile.mkdtemp(prefix="chemlearning_", dir=SCRATCH_LOCATION)
+            logging.info("Job directories on scratch, in memory: %s", locations["scratch"])
+        processes = [
+            multiprocessing.Process(
+                target=_worker_process,
+                args=(args.queue, locations, args.lease, args.poll_interval, args.job_timeout),
+            )
+            for _ in range(args.processes)
+        ]
+        try:
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+            if locations["scratch"] is not None:
+                shutil.rmtree(locations["scratch"], ignore_errors=True)
+    elif args.command == "merge":
+        with WorkQueue(args.queue) as queue:
+            gaussian_args = queue.gaussian_args
+        os.makedirs(args.data, exist_ok=True)
+        manifest_file = os.path.join(args.data, "qm9_dispersion.sqlite")
+        with RunManifest(manifest_file, gaussian_args) as manifest, \
+                ResultWriter(results_directory(os.path.join(args.data, "qm9_dispersion"),
+                                               gaussian_args)) as writer:
+            counts = merge_results(args.queue, manifest, writer)
+            manifest.export_tsv(os.path.join(args.data, "qm9_dispersion.data"))
+        logging.info("Merged %d results, %d failures", counts[DONE], counts[FAILED])
+
+
+if __name__ == "__main__":
+    main()
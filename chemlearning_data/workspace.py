@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Reusable job directories on a fast scratch filesystem"""
+
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from functools import lru_cache
+
+KEEP_LOGS = (None, "move", "compress")
+
+
+def empty_directory(path):
+    """Remove everything in a directory, but not the directory itself"""
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.unlink(entry.path)
+
+
+class Workspace:
+    """
+    Pool of job directories on a scratch location, such as /dev/shm or a local disk.
+
+    Directories are created once, then emptied and handed out again, instead
+    of being created and removed for every job. Each process has its own
+    pool, in a folder named after its pid. Output files can be moved or
+    compressed to durable storage when a directory is released; directories
+    never released (failed jobs) are kept until close.
+
+    Attributes:
+        - scratch (folder in which the pool is created, str)
+        - root (folder of the pool of this process, str)
+        - durable (folder to which logs are kept, str or None)
+        - keep_logs (None, "move" or "compress", str)
+        - stats (time in seconds spent on each operation, and their counts, dict)
+
+    """
+
+    def __init__(self, scratch, durable=None, keep_logs=None, pool_size=4):
+        """Create the pool, with pool_size directories ready to use."""
+        if keep_logs not in KEEP_LOGS:
+            raise ValueError("keep_logs should be one of " + str(KEEP_LOGS))
+        if keep_logs is not None and durable is None:
+            raise ValueError("A durable folder is needed to keep logs")
+        self.scratch = scratch
+        self.root = os.path.join(scratch, "workspace_" + str(os.getpid()))
+        self.durable = durable
+        self.keep_logs = keep_logs
+        self.stats = dict.fromkeys(["acquire", "release", "archive"], 0.0)
+        self.stats.update(dict.fromkeys(["acquired", "released", "archived", "created"], 0))
+        self._free = list()
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        if durable is not None:
+            os.makedirs(durable, exist_ok=True)
+        # Leftovers of a former process with the same pid are emptied
+        for entry in os.scandir(self.root):
+            if entry.is_dir(follow_symlinks=False):
+                empty_directory(entry.path)
+                self._free.append(entry.path)
+        while len(self._free) < pool_size:
+            self._free.append(self._create())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _create(self):
+        """Create a new directory in the pool"""
+        self.stats["created"] += 1
+        return tempfile.mkdtemp(prefix="job_", dir=self.root)
+
+    def acquire(self):
+        """Empty directory for a job, reused from the pool if possible"""
+        start = time.perf_counter()
+        with self._lock:
+            path = self._free.pop() if self._free else None
+            if path is None:
+                path = self._create()
+            self.stats["acquired"] += 1
+            self.stats["acquire"] += time.perf_counter() - start
+        return path
+
+    def release(self, path, log_path=None):
+        """
+        Give back a directory acquired for a job.
+
+        The output file at log_path is kept first, as set by keep_logs.
+        Returns the path of the kept log, or None.
+        """
+        kept = None
+        if log_path is not None and self.keep_logs is not None:
+            kept = self.archive(log_path)
+        start = time.perf_counter()
+        empty_directory(path)
+        with self._lock:
+            self._free.append(path)
+            self.stats["released"] += 1
+            self.stats["release"] += time.perf_counter() - start
+        return kept
+
+    def archive(self, log_path):
+        """Move or compress an output file to the durable folder, return the new path"""
+        start = time.perf_counter()
+        destination = os.path.join(self.durable, os.path.basename(log_path))
+        if self.keep_logs == "compress":
+            destination += ".gz"
+            # Written under another name, then renamed, so that no partial file is seen
+            tmp_path = destination + ".tmp"
+            with open(log_path, mode="rb") as log, gzip.open(tmp_path, mode="wb") as gz_file:
+                shutil.copyfileobj(log, gz_file)
+            os.replace(tmp_path, destination)
+        else:
+            shutil.move(log_path, destination)
+        with self._lock:
+            self.stats["archived"] += 1
+            self.stats["archive"] += time.perf_counter() - start
+        logging.debug("Kept %s as %s", log_path, destination)
+        return destination
+
+    def close(self):
+        """Remove the pool and all its directories"""
+        with self._lock:
+            self._free = list()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+@lru_cache(maxsize=None)
+def _process_workspace(pid, scratch, durable, keep_logs, pool_size):
+    """Workspace cached per pid: forked processes do not share their parent's"""
+    return Workspace(scratch, durable=durable, keep_logs=keep_logs, pool_size=pool_size)
+
+
+def process_workspace(scratch, durable=None, keep_logs=None, pool_size=4):
+    """Workspace of the current process, created on first use"""
+    return _process_workspace(os.getpid(), scratch, durable, keep_logs, pool_size)